@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+#
+"""
+Measure how long importing r53utils takes, in fresh interpreters, and
+which heavy modules it pulls in: once for a bare import plus offline
+helpers (ChangeBatch, rrset_to_text), and once including the creation of
+a client, which loads boto3.
+
+Example:
+    bench_import.py --runs 20
+"""
+
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+
+TOPDIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+SCENARIOS = [
+    ('import', "import r53utils"),
+    ('offline_helpers', """
+import r53utils
+batch = r53utils.ChangeBatch()
+batch.create('www.example.com.', 'A', 300, ['192.0.2.1'])
+list(batch.chunks())
+r53utils.rrset_to_text(batch.data()['Changes'][0]['ResourceRecordSet'])
+"""),
+    ('get_client', """
+import r53utils
+r53utils.get_client()
+"""),
+]
+
+# runs the scenario and reports its time and which heavy modules it loaded
+HARNESS = """
+import sys, time, json
+start = time.perf_counter()
+exec({code!r})
+elapsed = time.perf_counter() - start
+print(json.dumps({{'elapsed': elapsed,
+                   'loaded': [x for x in ('boto3', 'botocore', 'asyncio')
+                              if x in sys.modules]}}))
+"""
+
+
+def process_args(arguments=None):
+    """Process command line arguments"""
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument("--runs", type=int, default=10,
+                        help="interpreters to start per scenario "
+                        "(default: %(default)s)")
+    return parser.parse_args(arguments)
+
+
+def run(code):
+    """run code in a fresh interpreter; return its measurement"""
+    env = dict(os.environ, AWS_DEFAULT_REGION=os.environ.get(
+        'AWS_DEFAULT_REGION', 'us-east-1'))
+    output = subprocess.run([sys.executable, '-c', HARNESS.format(code=code)],
+                            cwd=TOPDIR, env=env, check=True,
+                            stdout=subprocess.PIPE).stdout
+    return json.loads(output)
+
+
+def main(arguments=None):
+    """main function"""
+
+    args = process_args(arguments)
+    print("{:<18} {:>10} {:>10}  loaded".format("scenario", "median",
+                                                "min"))
+    for name, code in SCENARIOS:
+        results = [run(code) for _ in range(args.runs)]
+        times = [x['elapsed'] * 1000 for x in results]
+        print("{:<18} {:>8.1f}ms {:>8.1f}ms  {}".format(
+            name, statistics.median(times), min(times),
+            ",".join(results[-1]['loaded']) or "-"))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+#
+
+"""
+Benchmark r53utils against a moto-backed Route53, with large synthetic
+zones and many hosted zones. For each benchmark, report the API calls
+made per operation, wall time, peak (Python) memory and items/sec, and
+optionally save the results as JSON and compare them with an earlier run.
+Peak memory is traced in a second run that replays the responses of the
+timed run, so the tracer doesn't slow the timed run, and moto's backend
+isn't counted.
+
+Example:
+    bench_r53utils.py --sizes 1000,10000 --zones 1000 --output run.json
+    bench_r53utils.py --sizes 1000,10000 --zones 1000 --compare run.json
+"""
+
+import os
+import sys
+import copy
+import json
+import time
+import platform
+import argparse
+import tracemalloc
+import collections
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+# moto needs (fake) credentials and a region before any client is made
+for _name, _value in (('AWS_ACCESS_KEY_ID', 'testing'),
+                      ('AWS_SECRET_ACCESS_KEY', 'testing'),
+                      ('AWS_DEFAULT_REGION', 'us-east-1')):
+    os.environ.setdefault(_name, _value)
+
+import moto
+import r53utils
+from r53utils import (ClientPool, Metrics, ChangeBatch, ZoneIndex,
+                      create_zone, generator_zones, generator_rrsets,
+                      name_to_zoneid, empty_zone, empty_zone_streaming,
+                      change_rrsets_chunked, rrset_to_text, BATCH_LIMITS)
+
+
+ZONE = "bench.example."
+
+
+def process_args(arguments=None):
+    """Process command line arguments"""
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument("--sizes", default="1000,10000",
+                        help="comma separated rrset counts of test zones "
+                        "(default: %(default)s)")
+    parser.add_argument("--zones", type=int, default=1000,
+                        help="number of hosted zones (default: %(default)s)")
+    parser.add_argument("--lookups", type=int, default=50,
+                        help="zone name lookups to time (default: "
+                        "%(default)s)")
+    parser.add_argument("--output", help="save results as JSON to file")
+    parser.add_argument("--compare", help="compare with results JSON file")
+    return parser.parse_args(arguments)
+
+
+class Bench:
+    """Runs benchmarks and collects their results"""
+
+    def __init__(self):
+        self.pool = ClientPool()
+        self.metrics = Metrics()
+        self.pool.attach(self.metrics)
+        self.client = self.pool.get()
+        self.results = []
+
+    def measure(self, name, size, func):
+        """
+        run func, which returns the number of items it processed, once
+        timed and once replaying the responses of that run to trace its
+        memory use
+        """
+
+        events = self.client.meta.events
+        responses = collections.defaultdict(collections.deque)
+
+        def record(model, http_response, parsed, **kwargs):
+            responses[model.name].append((http_response, parsed))
+
+        def replay(model, **kwargs):
+            if not responses[model.name]:
+                raise RuntimeError("{}: no recorded {} response".format(
+                    name, model.name))
+            http_response, parsed = responses[model.name].popleft()
+            return http_response, copy.deepcopy(parsed)
+
+        self.metrics.reset()
+        events.register('after-call.route53', record,
+                        unique_id='bench-record')
+        try:
+            start = time.perf_counter()
+            items = func()
+            elapsed = time.perf_counter() - start
+        finally:
+            events.unregister('after-call.route53', unique_id='bench-record')
+        calls = {op: stats['calls']
+                 for op, stats in self.metrics.snapshot().items()}
+
+        events.register('before-call.route53', replay,
+                        unique_id='bench-replay')
+        tracemalloc.start()
+        try:
+            func()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+            events.unregister('before-call.route53', unique_id='bench-replay')
+        result = {
+            'benchmark': name,
+            'size': size,
+            'items': items,
+            'wall_time': elapsed,
+            'items_per_sec': items / elapsed if elapsed else 0.0,
+            'peak_memory': peak,
+            'calls': calls,
+        }
+        self.results.append(result)
+        print("{:<28} {:>8} {:>10.3f}s {:>12.0f}/s {:>10.1f}KiB  {}".format(
+            name, size, elapsed, result['items_per_sec'], peak / 1024,
+            " ".join("{}={}".format(k, v) for k, v in sorted(calls.items()))))
+        return result
+
+
+def fill_zone(client, zoneid, size):
+    """add size A rrsets to zone"""
+    batch = ChangeBatch()
+    for i in range(size):
+        batch.create("h{:07d}.{}".format(i, ZONE), 'A', 300,
+                     ['192.0.2.{}'.format(i % 254 + 1)])
+    change_rrsets_chunked(client, zoneid, batch)
+
+
+def bench_zone(bench, size):
+    """benchmarks on one zone of the given size"""
+
+    client = bench.client
+    zoneid = create_zone(client, ZONE)[0]
+    fill_zone(client, zoneid, size)
+
+    def batch_changes():
+        batch = ChangeBatch()
+        for i in range(size):
+            batch.upsert("h{:07d}.{}".format(i, ZONE), 'A', 600,
+                         ['192.0.2.{}'.format(i % 254 + 1)])
+        change_rrsets_chunked(client, zoneid, batch)
+        return size
+
+    bench.measure('change_rrsets_chunked', size, batch_changes)
+    bench.measure('generator_rrsets', size,
+                  lambda: sum(1 for _ in generator_rrsets(client, zoneid)))
+    bench.measure('generator_rrsets_prefetch', size,
+                  lambda: sum(1 for _ in generator_rrsets(client, zoneid,
+                                                          prefetch=2)))
+    bench.measure('rrsets_in_memory', size,
+                  lambda: len(list(generator_rrsets(client, zoneid))))
+    bench.measure('rrsets_in_memory_compact', size,
+                  lambda: len(list(generator_rrsets(client, zoneid,
+                                                    compact=True))))
+    rrsets = list(generator_rrsets(client, zoneid))
+    bench.measure('rrset_to_text', size,
+                  lambda: sum(len(rrset_to_text(x)) > 0 for x in rrsets))
+    del rrsets
+
+    # empty_zone sends the whole zone as one batch, which Route53 rejects
+    # beyond the batch limits
+    if size <= BATCH_LIMITS.values:
+        bench.measure('empty_zone', size,
+                      lambda: empty_zone(client, zoneid, ZONE) and size)
+        fill_zone(client, zoneid, size)
+    else:
+        print("{:<28} {:>8} skipped: over batch limits".format('empty_zone',
+                                                                size))
+    bench.measure('empty_zone_streaming', size,
+                  lambda: len(empty_zone_streaming(client, zoneid,
+                                                   ZONE)) and size)
+    r53utils.delete_zone(client, zoneid)
+
+
+def bench_zones(bench, count, lookups):
+    """benchmarks on many hosted zones"""
+
+    client = bench.client
+    names = ["z{:06d}.example.".format(i) for i in range(count)]
+    for name in names:
+        create_zone(client, name)
+    targets = names[::max(1, count // lookups)][:lookups]
+
+    bench.measure('generator_zones', count,
+                  lambda: sum(1 for _ in generator_zones(client)))
+    bench.measure('name_to_zoneid', len(targets),
+                  lambda: len([name_to_zoneid(client, x) for x in targets]))
+
+    def cached_lookups():
+        index = ZoneIndex(client, ttl=300)
+        return len([index.zoneid(x) for x in targets])
+    bench.measure('zoneindex_cached', len(targets), cached_lookups)
+
+
+def compare(results, path):
+    """print wall time and call count changes relative to earlier results"""
+
+    with open(path) as infile:
+        baseline = {(x['benchmark'], x['size']): x
+                    for x in json.load(infile)['results']}
+    print("\nCompared with {}:".format(path))
+    for result in results:
+        old = baseline.get((result['benchmark'], result['size']))
+        if old is None:
+            continue
+        print("{:<28} {:>8} time x{:.2f} calls {} -> {}".format(
+            result['benchmark'], result['size'],
+            result['wall_time'] / old['wall_time'] if old['wall_time'] else 0,
+            sum(old['calls'].values()), sum(result['calls'].values())))
+
+
+def main(arguments=None):
+    """main function"""
+
+    args = process_args(arguments)
+    print("{:<28} {:>8} {:>11} {:>14} {:>13}  calls".format(
+        "benchmark", "size", "wall", "items", "peak mem"))
+    with moto.mock_aws():
+        bench = Bench()
+        for size in [int(x) for x in args.sizes.split(',') if x]:
+            bench_zone(bench, size)
+        if args.zones:
+            bench_zones(bench, args.zones, args.lookups)
+
+    if args.output:
+        with open(args.output, 'w') as outfile:
+            json.dump({'r53utils': r53utils.__version__,
+                       'moto': moto.__version__,
+                       'python': platform.python_version(),
+                       'timestamp': time.time(),
+                       'results': bench.results}, outfile, indent=2)
+    if args.compare:
+        compare(bench.results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
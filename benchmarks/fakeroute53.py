@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+#
+
+"""
+Local Route53 stand-in for load testing. Requests are answered by an
+in-process moto backend, after applying production-like behaviour:
+per-operation latency distributions, a per-account token bucket that
+returns real Throttling errors, PENDING -> INSYNC delays for changes, and
+ChangeResourceRecordSets batch limit validation.
+
+Point r53utils at it with get_client(endpoint_url="http://127.0.0.1:8053")
+or ClientPool(endpoint_url=...). It can be started in-process with
+FakeRoute53(...).start(), or run as a separate server:
+
+    fakeroute53.py --port 8053 --rate 5 --insync-delay 30 \\
+        --latency lognormal:-3.0,0.5 \\
+        --latency ListResourceRecordSets=uniform:0.1,0.4
+"""
+
+import os
+import re
+import sys
+import time
+import random
+import argparse
+import threading
+import xml.etree.ElementTree as ET
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+import moto
+import requests
+from r53utils import BATCH_LIMITS, RateLimiter
+
+
+ROUTE53_URL = "https://route53.amazonaws.com"
+XMLNS = "https://route53.amazonaws.com/doc/2013-04-01/"
+
+# (method, path regex, operation name)
+OPERATIONS = [
+    ('POST', r'/2013-04-01/hostedzone$', 'CreateHostedZone'),
+    ('GET', r'/2013-04-01/hostedzone$', 'ListHostedZones'),
+    ('GET', r'/2013-04-01/hostedzonesbyname$', 'ListHostedZonesByName'),
+    ('GET', r'/2013-04-01/hostedzone/[^/]+$', 'GetHostedZone'),
+    ('DELETE', r'/2013-04-01/hostedzone/[^/]+$', 'DeleteHostedZone'),
+    ('GET', r'/2013-04-01/hostedzone/[^/]+/rrset/?$',
+     'ListResourceRecordSets'),
+    ('POST', r'/2013-04-01/hostedzone/[^/]+/rrset/?$',
+     'ChangeResourceRecordSets'),
+    ('GET', r'/2013-04-01/change/[^/]+$', 'GetChange'),
+    ('GET', r'/2013-04-01/testdnsanswer$', 'TestDNSAnswer'),
+]
+
+ERROR_TEMPLATE = """<?xml version="1.0"?>
+<ErrorResponse xmlns="{}"><Error><Type>Sender</Type><Code>{}</Code>\
+<Message>{}</Message></Error><RequestId>{}</RequestId></ErrorResponse>"""
+
+
+def operation_name(method, path):
+    """return Route53 operation name of a request"""
+    path = path.split('?', 1)[0]
+    for op_method, pattern, name in OPERATIONS:
+        if method == op_method and re.match(pattern, path):
+            return name
+    return 'Other'
+
+
+def parse_latency(spec):
+    """
+    return function producing latencies (seconds) from a distribution
+    spec: fixed:S, uniform:A,B, normal:MEAN,SD or lognormal:MU,SIGMA
+    """
+
+    kind, _, params = spec.partition(':')
+    values = [float(x) for x in params.split(',') if x]
+    if kind == 'fixed':
+        return lambda: values[0]
+    if kind == 'uniform':
+        return lambda: random.uniform(*values)
+    if kind == 'normal':
+        return lambda: max(0.0, random.gauss(*values))
+    if kind == 'lognormal':
+        return lambda: random.lognormvariate(*values)
+    raise ValueError("Unknown latency distribution: {}".format(spec))
+
+
+def batch_errors(body, limits=BATCH_LIMITS):
+    """return list of batch limit violations of a ChangeBatch request"""
+
+    root = ET.fromstring(body)
+    changes = root.findall('.//{%s}Change' % XMLNS)
+    values = chars = 0
+    for change in changes:
+        weight = 2 if change.findtext('{%s}Action' % XMLNS) == 'UPSERT' else 1
+        for value in change.iter('{%s}Value' % XMLNS):
+            values += weight
+            chars += weight * len(value.text or '')
+    errors = []
+    if len(changes) > limits.changes:
+        errors.append("Number of changes {} exceeds {}".format(
+            len(changes), limits.changes))
+    if values > limits.values:
+        errors.append("Number of records {} exceeds {}".format(
+            values, limits.values))
+    if chars > limits.chars:
+        errors.append("Number of characters {} exceeds {}".format(
+            chars, limits.chars))
+    return errors
+
+
+class FakeRoute53:
+    """
+    Route53 stand-in server. latency maps operation names (or 'default')
+    to latency functions; rate and burst configure each account's token
+    bucket (accounts are told apart by access key id); changes stay
+    PENDING for insync_delay seconds.
+    """
+
+    def __init__(self, host='127.0.0.1', port=8053, latency=None, rate=5.0,
+                 burst=None, insync_delay=0.0, limits=BATCH_LIMITS):
+        self.latency = latency or {}
+        self.rate = rate
+        self.burst = burst
+        self.insync_delay = insync_delay
+        self.limits = limits
+        self.buckets = {}
+        self.changes = {}
+        self.counts = {}
+        self.lock = threading.Lock()
+        self.mock = None
+        self.server = ThreadingHTTPServer((host, port), self._handler_class())
+        self.server.daemon_threads = True
+
+    @property
+    def endpoint_url(self):
+        """URL to pass to get_client(endpoint_url=...)"""
+        host, port = self.server.server_address[:2]
+        return "http://{}:{}".format(host, port)
+
+    def _handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            """Request handler forwarding to FakeRoute53"""
+
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                """handle GET request"""
+                fake.handle(self)
+
+            do_POST = do_GET
+            do_DELETE = do_GET
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def _bucket(self, account):
+        with self.lock:
+            bucket = self.buckets.get(account)
+            if bucket is None:
+                bucket = RateLimiter(rate=self.rate, burst=self.burst)
+                self.buckets[account] = bucket
+            return bucket
+
+    def _throttled(self, account):
+        """take a token from the account's bucket; True if there was none"""
+        if not self.rate:
+            return False
+        return not self._bucket(account).try_acquire()
+
+    def _count(self, operation, result):
+        with self.lock:
+            key = (operation, result)
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def stats(self):
+        """return dict of {operation: {result: count}} for served requests"""
+        with self.lock:
+            result = {}
+            for (operation, outcome), count in self.counts.items():
+                result.setdefault(operation, {})[outcome] = count
+            return result
+
+    def _track_changes(self, text):
+        """record change ids in a response; report them as PENDING"""
+        if not self.insync_delay:
+            return text
+        match = re.search(r'<ChangeInfo><Id>([^<]+)</Id>', text)
+        if match:
+            with self.lock:
+                self.changes[match.group(1).rsplit('/', 1)[-1]] = \
+                    time.monotonic() + self.insync_delay
+        return text.replace('<Status>INSYNC</Status>',
+                            '<Status>PENDING</Status>')
+
+    def _change_status(self, path, text):
+        changeid = path.split('?', 1)[0].rsplit('/', 1)[-1]
+        with self.lock:
+            insync_at = self.changes.get(changeid)
+        if insync_at is not None and time.monotonic() < insync_at:
+            return text.replace('<Status>INSYNC</Status>',
+                                '<Status>PENDING</Status>')
+        return text
+
+    @staticmethod
+    def _reply(handler, code, body, content_type='text/xml'):
+        body = body.encode() if isinstance(body, str) else body
+        handler.send_response(code)
+        handler.send_header('Content-Type', content_type)
+        handler.send_header('Content-Length', str(len(body)))
+        handler.send_header('x-amzn-RequestId', 'fake-route53')
+        handler.end_headers()
+        handler.wfile.write(body)
+
+    def _error(self, handler, code, error_code, message):
+        self._reply(handler, code, ERROR_TEMPLATE.format(
+            XMLNS, error_code, message, 'fake-route53'))
+
+    def handle(self, handler):
+        """handle one request"""
+
+        length = int(handler.headers.get('Content-Length') or 0)
+        body = handler.rfile.read(length) if length else b''
+        operation = operation_name(handler.command, handler.path)
+        match = re.search(r'Credential=([^/]+)/',
+                          handler.headers.get('Authorization', ''))
+        account = match.group(1) if match else None
+
+        latency = self.latency.get(operation, self.latency.get('default'))
+        if latency is not None:
+            time.sleep(latency())
+
+        if self._throttled(account):
+            self._count(operation, 'throttled')
+            self._error(handler, 400, 'Throttling', 'Rate exceeded')
+            return
+        if operation == 'ChangeResourceRecordSets':
+            errors = batch_errors(body, self.limits)
+            if errors:
+                self._count(operation, 'invalid')
+                self._error(handler, 400, 'InvalidChangeBatch',
+                            "; ".join(errors))
+                return
+
+        response = requests.request(
+            handler.command, ROUTE53_URL + handler.path, data=body,
+            headers={'Content-Type': handler.headers.get('Content-Type',
+                                                         'text/xml')})
+        text = response.text
+        if response.status_code < 300:
+            if operation == 'GetChange':
+                text = self._change_status(handler.path, text)
+            elif operation in ('CreateHostedZone', 'DeleteHostedZone',
+                               'ChangeResourceRecordSets'):
+                text = self._track_changes(text)
+        self._count(operation, response.status_code)
+        self._reply(handler, response.status_code, text,
+                    response.headers.get('Content-Type', 'text/xml'))
+
+    def start(self):
+        """start the moto backend and serve requests on a thread"""
+        self.mock = moto.mock_aws()
+        self.mock.start()
+        threading.Thread(target=self.server.serve_forever,
+                         daemon=True).start()
+
+    def serve_forever(self):
+        """start the moto backend and serve requests until interrupted"""
+        self.mock = moto.mock_aws()
+        self.mock.start()
+        try:
+            self.server.serve_forever()
+        finally:
+            self.mock.stop()
+
+    def stop(self):
+        """stop serving requests"""
+        self.server.shutdown()
+        self.server.server_close()
+        if self.mock is not None:
+            self.mock.stop()
+            self.mock = None
+
+
+def process_args(arguments=None):
+    """Process command line arguments"""
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8053)
+    parser.add_argument("--rate", type=float, default=5.0,
+                        help="requests/sec per account, 0 for no limit "
+                        "(default: %(default)s)")
+    parser.add_argument("--burst", type=float,
+                        help="token bucket size (default: rate)")
+    parser.add_argument("--insync-delay", type=float, default=0.0,
+                        help="seconds changes stay PENDING")
+    parser.add_argument("--latency", action="append", default=[],
+                        help="[Operation=]distribution, eg. fixed:0.05, "
+                        "uniform:0.02,0.2, lognormal:-3,0.5")
+    return parser.parse_args(arguments)
+
+
+def main(arguments=None):
+    """main function"""
+
+    args = process_args(arguments)
+    latency = {}
+    for spec in args.latency:
+        operation, _, distribution = spec.rpartition('=')
+        latency[operation or 'default'] = parse_latency(distribution)
+    fake = FakeRoute53(args.host, args.port, latency=latency,
+                       rate=args.rate, burst=args.burst,
+                       insync_delay=args.insync_delay)
+    print("Serving fake Route53 at {}".format(fake.endpoint_url))
+    try:
+        fake.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -2,30 +2,26 @@
 #
 
 """
-Delete all Route53 zones given on the command line by name.
+Delete all Route53 zones given on the command line by name. Zones are
+emptied in parallel, and child zones are deleted before their parents.
 """
 
 import sys
-from botocore.exceptions import ClientError
-from r53utils import (get_client, generator_zones,
-                      empty_zone, delete_zone, R53Error)
+from r53utils import get_client, client_pool, ZoneTeardown, RateLimiter
 
 
 if __name__ == '__main__':
 
-    TO_DELETE = []
-    for zonename in sys.argv[1:]:
-        if not zonename.endswith('.'):
-            zonename += "."
-        TO_DELETE.append(zonename)
-
+    client_pool.attach(RateLimiter())
     client = get_client()
-    for zone in generator_zones(client):
-        if zone['Name'] in TO_DELETE:
-            try:
-                empty_zone(client, zone['Id'], zonename=zone['Name'])
-                delete_zone(client, zone['Id'])
-            except (R53Error, ClientError) as error:
-                print("ERROR:", error)
-            else:
-                print("DELETED zone: {} {}".format(zone['Name'], zone['Id']))
+
+    teardown = ZoneTeardown(client)
+    deleted = teardown.teardown(sys.argv[1:])
+    for zoneid in sorted(deleted):
+        print("DELETED zone: {} {}".format(teardown.names[zoneid], zoneid))
+    for zoneid, error in sorted(teardown.errors.items()):
+        print("ERROR: {} {}: {}".format(teardown.names[zoneid], zoneid,
+                                        error))
+    for zonename in teardown.missing:
+        print("ERROR: zone not found: {}".format(zonename))
+    sys.exit(1 if teardown.errors or teardown.missing else 0)
@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+#
+
+"""
+Print all resource record sets of all zones in the account (or of the
+zones given by name on the command line), one JSON object per line.
+"""
+
+import sys
+import json
+from r53utils import (get_client, client_pool, generator_zones,
+                      ZoneExporter, RateLimiter)
+
+
+if __name__ == '__main__':
+
+    client_pool.attach(RateLimiter())
+    client = get_client()
+
+    ZONES = None
+    if len(sys.argv) > 1:
+        NAMES = {x if x.endswith('.') else x + '.' for x in sys.argv[1:]}
+        ZONES = [x for x in generator_zones(client) if x['Name'] in NAMES]
+
+    exporter = ZoneExporter(client)
+    for zone, rrset in exporter.export(ZONES):
+        print(json.dumps({'Zone': zone['Name'], 'ZoneId': zone['Id'],
+                          'RRset': rrset}))
+    for zoneid, error in exporter.errors.items():
+        print("ERROR: {}: {}".format(zoneid, error), file=sys.stderr)
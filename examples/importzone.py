@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+#
+
+"""
+Import a BIND master zone file into an existing Route53 zone. The file
+is read as a stream and sent as chunked change batches, at the rate
+allowed by a RateLimiter, reporting progress as batches are applied.
+The apex SOA and NS rrsets are skipped, unless --apex is given.
+"""
+
+import sys
+import time
+import argparse
+from botocore.exceptions import ClientError
+from r53utils import (get_client, client_pool, import_zone, RateLimiter,
+                      R53Error)
+
+
+def process_args(arguments=None):
+    """Process command line arguments"""
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument("zoneid", help="Route53 zone id")
+    parser.add_argument("zonefile", help="master zone file, or - for stdin")
+    parser.add_argument("--origin", help="initial $ORIGIN (default: zone "
+                        "name)")
+    parser.add_argument("--upsert", action="store_true",
+                        help="UPSERT rrsets instead of creating them")
+    parser.add_argument("--apex", action="store_true",
+                        help="also import the apex SOA and NS rrsets")
+    parser.add_argument("--check", action="store_true",
+                        help="fail on rrsets split across the file, keeping "
+                        "the names of all rrsets in memory")
+    parser.add_argument("--rate", type=float, default=5.0,
+                        help="API requests/sec (default: %(default)s)")
+    return parser.parse_args(arguments)
+
+
+def main(arguments=None):
+    """main function"""
+
+    args = process_args(arguments)
+    client_pool.attach(RateLimiter(rate=args.rate))
+    client = get_client()
+
+    start = time.time()
+    totals = {'batches': 0, 'rrsets': 0}
+
+    def progress(chunk, change_info):
+        totals['batches'] += 1
+        totals['rrsets'] += len(chunk)
+        print("{:.1f}s: batch {} applied ({}), {} rrsets so far".format(
+            time.time() - start, totals['batches'], change_info['Id'],
+            totals['rrsets']), file=sys.stderr)
+
+    infile = sys.stdin if args.zonefile == '-' else open(args.zonefile)
+    try:
+        with infile:
+            import_zone(client, args.zoneid, infile, origin=args.origin,
+                        action='UPSERT' if args.upsert else 'CREATE',
+                        skip_apex=not args.apex, check=args.check,
+                        progress=progress)
+    except (R53Error, ClientError) as error:
+        print("ERROR:", error, file=sys.stderr)
+        return 1
+    print("Imported {} rrsets in {} batches".format(totals['rrsets'],
+                                                   totals['batches']))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,26 +2,26 @@
 #
 
 """
-Given a Route53 zoneid, print all the resource record sets in the zone.
+Given a Route53 zoneid, print all the resource record sets in the zone,
+as a JSON array (default), one JSON object per line (ndjson), or in
+master file format (zone). Records are written as they are listed.
 
+Usage: listrrsets2.py <zoneid> [json|ndjson|zone]
 """
 
 import sys
-import json
 from botocore.exceptions import ClientError
-from r53utils import get_client, generator_rrsets, R53Error
+from r53utils import get_client, export_zone, R53Error
 
 
 if __name__ == '__main__':
 
     client = get_client()
     zoneid = sys.argv[1]
+    fmt = sys.argv[2] if len(sys.argv) > 2 else 'json'
 
-    rrset_list = []
     try:
-        for rrset in generator_rrsets(client, zoneid):
-            rrset_list.append(rrset)
+        export_zone(client, zoneid, sys.stdout, fmt)
     except (R53Error, ClientError) as error:
-        print("ERROR:", error)
-    else:
-        print(json.dumps(rrset_list))
+        print("ERROR:", error, file=sys.stderr)
+        sys.exit(1)
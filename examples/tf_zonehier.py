@@ -2,31 +2,28 @@
 #
 
 """
-Given a list of DNS zones on the command line, output a Terraform
-configuration file that creates each zone in the Amazon Route53 DNS
-service, and also setup delegation records between all needed parent
-child zone pairs.
+Output a Terraform configuration that creates a hierarchy of zones in
+the Amazon Route53 DNS service, and also sets up delegation records
+between all needed parent child zone pairs. The zones are either given
+on the command line, or, with --inventory, are all the public zones in
+the account, in which case import blocks for the existing zones and
+delegation records are generated too. With --shard-dir, one file is
+written per zone subtree, plus a provider.tf file.
 """
 
 
 import os
 import sys
-import dns.name
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from r53utils import (get_client, client_pool, generator_zones, get_rrsets,
+                      closest_parents, short_zoneid, RateLimiter)
 
 
 NS_TTL = 86400
+BUFSIZE = 1024 * 1024
 
-
-def remove_trailing_dot(dnsname):
-    """Remove trailing period from domain name string"""
-    if dnsname.endswith('.'):
-        dnsname = dnsname[:-1]
-    return dnsname
-
-
-def preamble():
-    """Print Terraform config file preamble"""
-    print("""\
+PREAMBLE = """\
 
 variable "region" {
   default = "us-east-1"
@@ -37,82 +34,224 @@ provider "aws" {
   region  = var.region
 }
 
-""")
+"""
 
 
-def create_zone(zonename):
-    """Output zone creation Terraform instructions"""
+def remove_trailing_dot(dnsname):
+    """Remove trailing period from domain name string"""
+    if dnsname.endswith('.'):
+        dnsname = dnsname[:-1]
+    return dnsname
 
-    zonename_text = remove_trailing_dot(zonename.to_text())
-    if zonename_text.endswith('.'):
-        zonename_text = zonename_text[:-1]
-    resource_name = zonename_text.replace('.', '_')
 
-    print("### Zone: {}".format(zonename_text))
-    print("""\
-resource "aws_route53_zone" "{}" {{
-  name = "{}"
-}}
-""".format(resource_name, zonename_text))
+def resource_name(zonename):
+    """Return Terraform resource name for zone"""
+    return remove_trailing_dot(zonename).replace('.', '_')
 
 
-def add_delegation(parent, child, ttl=NS_TTL):
-    """Add delegation NS record set in parent zone to child"""
+def zone_config(zonename, zoneid=None):
+    """Return zone creation Terraform config, and import block"""
 
-    parent_text = remove_trailing_dot(parent.to_text())
-    child_text = remove_trailing_dot(child.to_text())
-    parent_resource = parent_text.replace('.', '_')
-    child_resource = child_text.replace('.', '_')
+    zonename_text = remove_trailing_dot(zonename)
+    resource = resource_name(zonename)
+    config = """\
+### Zone: {0}
+resource "aws_route53_zone" "{1}" {{
+  name = "{0}"
+}}
 
-    print("### Delegation: {} -> {}".format(parent_text, child_text))
-    print("""\
-resource "aws_route53_record" "ns-{0}" {{
-  zone_id = aws_route53_zone.{1}.zone_id
-  name = "{2}"
-  type = "NS"
-  ttl = "{3}"
-  records = aws_route53_zone.{4}.name_servers
+""".format(zonename_text, resource)
+    if zoneid is not None:
+        config += """\
+import {{
+  to = aws_route53_zone.{}
+  id = "{}"
 }}
-""".format(child_resource, parent_resource, child_text, ttl, child_resource))
-    return True
 
+""".format(resource, short_zoneid(zoneid))
+    return config
 
-def delegation_list(zones):
 
+def delegation_config(parent, child, ttl=NS_TTL, parentid=None):
     """
-    Generate list of delegations needed from zone list. For each
-    zone find the closest ancestor zone, if it exists in the list.
+    Return Terraform config for delegation NS record set in parent zone
+    to child, with an import block if the record set exists in parentid
     """
 
-    delegations = []
+    parent_text = remove_trailing_dot(parent)
+    child_text = remove_trailing_dot(child)
+    parent_resource = resource_name(parent)
+    child_resource = resource_name(child)
 
-    for zonename in zones:
-        orig_zonename = zonename
-        while zonename != dns.name.root:
-            ancestorname = zonename.parent()
-            if ancestorname in zones:
-                delegations.append((ancestorname, orig_zonename))
-                break
-            zonename = ancestorname
+    config = """\
+### Delegation: {0} -> {1}
+resource "aws_route53_record" "ns-{2}" {{
+  zone_id = aws_route53_zone.{3}.zone_id
+  name = "{1}"
+  type = "NS"
+  ttl = "{4}"
+  records = aws_route53_zone.{2}.name_servers
+}}
 
-    return delegations
+""".format(parent_text, child_text, child_resource, parent_resource, ttl)
+    if parentid is not None:
+        config += """\
+import {{
+  to = aws_route53_record.ns-{}
+  id = "{}_{}_NS"
+}}
 
+""".format(child_resource, short_zoneid(parentid), child_text)
+    return config
 
-if __name__ == '__main__':
 
-    if len(sys.argv) < 2:
-        print("Usage: {} <zone1> <zone2> ...".format(
-            os.path.basename(sys.argv[0])))
-        sys.exit(1)
+def inventory(client, workers=8):
+    """
+    Return (zones, parents, delegations, errors) for the public zones in
+    the account: dict of zone name -> zone, dict of zone name -> closest
+    parent zone name, dict of child zone name -> existing delegation NS
+    rrset in its parent, and dict of parent zone name -> exception, for
+    parents whose delegations could not be looked up. The delegations of
+    each parent are looked up together with get_rrsets.
+    """
 
-    preamble()
+    zones = {}
+    for zone in generator_zones(client):
+        if not zone.get('Config', {}).get('PrivateZone'):
+            zones[zone['Name']] = zone
+    parents = closest_parents(zones)
+
+    children = {}
+    for child, parent in parents.items():
+        if parent is not None:
+            children.setdefault(parent, []).append((child, 'NS'))
+
+    def lookup(parent):
+        zone = zones[parent]
+        try:
+            hits, _ = get_rrsets(client, zone['Id'], children[parent],
+                                 rrcount=zone.get('ResourceRecordSetCount'))
+        except Exception as error:
+            return parent, {}, error
+        return parent, hits, None
+
+    delegations = {}
+    errors = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for parent, hits, error in executor.map(lookup, children):
+            if error is not None:
+                errors[parent] = error
+            for (child, _), rrset in hits.items():
+                delegations[child] = rrset
+    return zones, parents, delegations, errors
+
+
+def subtree_root(zonename, parents, roots):
+    """Return topmost ancestor zone of zonename, memoized in roots"""
+    path = []
+    while zonename not in roots:
+        path.append(zonename)
+        if parents[zonename] is None:
+            roots[zonename] = zonename
+            break
+        zonename = parents[zonename]
+    for name in path:
+        roots[name] = roots[zonename]
+    return roots[zonename]
+
+
+def write_config(outfiles, zones, parents, delegations=None):
+    """
+    Write zone and delegation config for each zone. outfiles is a function
+    returning the file object to write a zone subtree's config to, given
+    the name of the subtree's topmost zone. Zones are written in reversed
+    label order, so each subtree is written in one contiguous run.
+    """
 
-    ZONELIST = []
+    roots = {}
+    for zonename in sorted(parents, key=lambda x: x.split('.')[::-1]):
+        outfile = outfiles(subtree_root(zonename, parents, roots))
+        zone = zones.get(zonename)
+        outfile.write(zone_config(zonename,
+                                  zone['Id'] if zone else None))
+        parent = parents[zonename]
+        if parent is None:
+            continue
+        rrset = (delegations or {}).get(zonename)
+        if rrset is None:
+            outfile.write(delegation_config(parent, zonename))
+        else:
+            outfile.write(delegation_config(parent, zonename, rrset['TTL'],
+                                            zones[parent]['Id']))
+
+
+def process_args(arguments=None):
+    """Process command line arguments"""
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument("zones", nargs="*", help="zone names")
+    parser.add_argument("--inventory", action="store_true",
+                        help="use all public zones in the account")
+    parser.add_argument("--output", help="output file (default: stdout)")
+    parser.add_argument("--shard-dir",
+                        help="write one file per zone subtree in directory")
+    args = parser.parse_args(arguments)
+    if bool(args.zones) == args.inventory:
+        parser.error("give either zone names or --inventory")
+    return args
+
+
+def main(arguments=None):
+    """main function, returning the exit status"""
+
+    args = process_args(arguments)
+
+    delegations = None
+    errors = {}
+    if args.inventory:
+        client_pool.attach(RateLimiter())
+        zones, parents, delegations, errors = inventory(get_client())
+        for parent, error in sorted(errors.items()):
+            print("ERROR: delegations in {} not looked up, no import blocks "
+                  "written for them: {}".format(parent, error),
+                  file=sys.stderr)
+    else:
+        zones = {}
+        parents = closest_parents(args.zones)
+
+    if args.shard_dir:
+        os.makedirs(args.shard_dir, exist_ok=True)
+        with open(os.path.join(args.shard_dir, 'provider.tf'), 'w') as outfile:
+            outfile.write(PREAMBLE)
+        shard = {}
+
+        def outfiles(root):
+            # subtrees are written one at a time; keep one file open
+            if shard.get('root') != root:
+                if shard:
+                    shard['file'].close()
+                path = os.path.join(args.shard_dir,
+                                    "zone_{}.tf".format(resource_name(root)))
+                shard['root'] = root
+                shard['file'] = open(path, 'w', buffering=BUFSIZE)
+            return shard['file']
+        try:
+            write_config(outfiles, zones, parents, delegations)
+        finally:
+            if shard:
+                shard['file'].close()
+        return 1 if errors else 0
+
+    outfile = open(args.output, 'w', buffering=BUFSIZE) if args.output \
+        else sys.stdout
+    try:
+        outfile.write(PREAMBLE)
+        write_config(lambda root: outfile, zones, parents, delegations)
+    finally:
+        if outfile is not sys.stdout:
+            outfile.close()
+    return 1 if errors else 0
 
-    for zone_name in sys.argv[1:]:
-        zone_name = dns.name.from_text(zone_name)
-        create_zone(zone_name)
-        ZONELIST.append(zone_name)
 
-    for parentzone, childzone in delegation_list(ZONELIST):
-        add_delegation(parentzone, childzone)
+if __name__ == '__main__':
+    sys.exit(main())
@@ -4,10 +4,21 @@ Small library of routines to deal with Amazon Route53 operations.
 Author: Shumon Huque
 """
 
+import os
+import sys
+import copy
+import json
 import random
+import sqlite3
 import time
-import boto3
-import botocore.config
+import queue
+import heapq
+import bisect
+import itertools
+import threading
+import collections
+import weakref
+from concurrent.futures import Future, ThreadPoolExecutor
 
 
 __version__ = "0.3.0"
@@ -15,27 +26,433 @@ __version__ = "0.3.0"
 MAXITEMS = '100'
 CALLER_REF_PREFIX = "r53utils"
 
+# Route53 limits per ChangeResourceRecordSets request: number of changes,
+# number of ResourceRecord values, and total characters of rdata values.
+BatchLimits = collections.namedtuple('BatchLimits',
+                                     ['changes', 'values', 'chars'])
+BATCH_LIMITS = BatchLimits(changes=1000, values=1000, chars=32000)
+
+# rrset dict fields that RRset keeps in dedicated slots
+RRSET_FIELDS = ('Name', 'Type', 'TTL', 'ResourceRecords')
+
+# Error codes returned by Route53 when requests are being throttled
+THROTTLE_CODES = ('Throttling', 'ThrottlingException',
+                  'PriorRequestNotComplete')
+
 class R53Error(Exception):
     """R53Error Class"""
 
 
-botoconfig = botocore.config.Config(
+# boto3 and botocore take a few hundred milliseconds to import, so they
+# are only imported when the first client (or botoconfig) is needed, and
+# offline helpers like ChangeBatch and rrset_to_text never load them.
+BOTOCONFIG_OPTIONS = dict(
     retries = {
         'total_max_attempts': 3,
         'mode': 'standard'
     }
 )
 
-def get_client(creds=None):
-    """get boto3 route53 client"""
-    if creds:
-        return boto3.client('route53',
-                            config=botoconfig,
-                            aws_access_key_id=creds['AccessKeyId'],
-                            aws_secret_access_key=creds['SecretAccessKey'],
-                            aws_session_token=creds['SessionToken'])
-    return boto3.client('route53',
-                        config=botoconfig)
+_botoconfig = None
+
+
+def get_botoconfig():
+    """return the default botocore Config for route53 clients"""
+    global _botoconfig
+    if _botoconfig is None:
+        import botocore.config
+        _botoconfig = botocore.config.Config(**BOTOCONFIG_OPTIONS)
+    return _botoconfig
+
+
+def __getattr__(name):
+    """build module attributes that need botocore on first access"""
+    if name == 'botoconfig':
+        return get_botoconfig()
+    raise AttributeError("module {!r} has no attribute {!r}".format(
+        __name__, name))
+
+
+class RateLimiter:
+    """
+    Token bucket rate limiter for Route53 API requests, shared between the
+    threads and clients it is attached to. Every HTTP request (including
+    retries) takes a token. The rate is cut by the decrease factor when a
+    throttling error is seen, and grows back by the increase step on each
+    successful response, up to max_rate.
+
+    The bulk helpers (ZoneExporter, ZoneProvisioner, ZoneTeardown,
+    generator_rrsets_partitioned) make concurrent requests through one
+    client, so a RateLimiter attached to it paces all of them. Those
+    classes record per-zone failures in an errors dict instead of raising.
+    """
+
+    def __init__(self, rate=5.0, burst=None, min_rate=0.5, max_rate=None,
+                 increase=0.05, decrease=0.5):
+        self._rate = float(rate)
+        self.min_rate = min_rate
+        self.max_rate = float(max_rate or rate)
+        self.burst = burst or max(1.0, self._rate)
+        self.increase = increase
+        self.decrease = decrease
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.last_decrease = 0.0
+        self.waiting = 0
+        self.requests = 0
+        self.throttles = 0
+        self.lock = threading.Lock()
+
+    @property
+    def rate(self):
+        """current request rate, in requests per second"""
+        return self._rate
+
+    @property
+    def queue_depth(self):
+        """number of requests currently waiting for a token"""
+        return self.waiting
+
+    def _refill(self, now):
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.updated) * self._rate)
+        self.updated = now
+
+    def acquire(self):
+        """block until a request token is available"""
+        with self.lock:
+            self._refill(time.monotonic())
+            self.tokens -= 1
+            self.requests += 1
+            delay = -self.tokens / self._rate if self.tokens < 0 else 0
+            if delay:
+                self.waiting += 1
+        if delay:
+            time.sleep(delay)
+            with self.lock:
+                self.waiting -= 1
+
+    def try_acquire(self):
+        """take a request token if one is available now; return whether so"""
+        with self.lock:
+            self._refill(time.monotonic())
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            self.requests += 1
+            return True
+
+    def on_throttle(self):
+        """reduce the rate after a throttling response"""
+        with self.lock:
+            self.throttles += 1
+            now = time.monotonic()
+            # a burst of throttled requests only counts as one signal
+            if now - self.last_decrease < 1 / self._rate:
+                return
+            self.last_decrease = now
+            self._refill(now)
+            self._rate = max(self.min_rate, self._rate * self.decrease)
+            self.tokens = min(self.tokens, 0)
+
+    def on_success(self):
+        """increase the rate after a successful response"""
+        with self.lock:
+            if self._rate < self.max_rate:
+                self._refill(time.monotonic())
+                self._rate = min(self.max_rate, self._rate + self.increase)
+
+    def _before_send(self, **kwargs):
+        self.acquire()
+
+    def _needs_retry(self, response=None, **kwargs):
+        if response is None:
+            return
+        code = response[1].get('Error', {}).get('Code')
+        if code in THROTTLE_CODES:
+            self.on_throttle()
+        elif code is None:
+            self.on_success()
+
+    def attach(self, client):
+        """hook rate limiting into a boto3 route53 client"""
+        # unique ids are per client emitter, not per event
+        unique_id = "r53utils-ratelimiter-{}".format(id(self))
+        client.meta.events.register('before-send.route53', self._before_send,
+                                    unique_id=unique_id + '-send')
+        client.meta.events.register('needs-retry.route53', self._needs_retry,
+                                    unique_id=unique_id + '-retry')
+
+
+# Upper bounds (seconds) of the API call latency histogram buckets
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Metrics:
+    """
+    Per-operation instrumentation of Route53 API calls, hooked into the
+    botocore event system of the clients it is attached to: call count,
+    errors, latency histogram, retries, throttled attempts, and for List*
+    operations the number of pages and items. snapshot() returns the
+    current values, and export() renders them with an exporter function,
+    like prometheus_text or json_text.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.operations = {}
+        self.lock = threading.Lock()
+
+    def _operation(self, name):
+        stats = self.operations.get(name)
+        if stats is None:
+            stats = dict(calls=0, errors=0, retries=0, throttles=0,
+                         pages=0, items=0, latency_sum=0.0,
+                         latency_counts=[0] * (len(self.buckets) + 1))
+            self.operations[name] = stats
+        return stats
+
+    def _record_latency(self, stats, context):
+        latency = time.monotonic() - context.pop('r53utils_start',
+                                                 time.monotonic())
+        stats['calls'] += 1
+        stats['latency_sum'] += latency
+        index = 0
+        while index < len(self.buckets) and latency > self.buckets[index]:
+            index += 1
+        stats['latency_counts'][index] += 1
+
+    def _before_call(self, context, **kwargs):
+        context['r53utils_start'] = time.monotonic()
+
+    def _after_call(self, http_response, parsed, model, context, **kwargs):
+        with self.lock:
+            stats = self._operation(model.name)
+            self._record_latency(stats, context)
+            stats['retries'] += parsed.get('ResponseMetadata', {}).get(
+                'RetryAttempts', 0)
+            if http_response.status_code >= 300:
+                stats['errors'] += 1
+            elif model.name.startswith('List'):
+                stats['pages'] += 1
+                stats['items'] += sum(len(x) for x in parsed.values()
+                                      if isinstance(x, list))
+
+    def _after_call_error(self, context, **kwargs):
+        operation = context.get('r53utils_operation')
+        if operation is None:
+            return
+        with self.lock:
+            stats = self._operation(operation)
+            self._record_latency(stats, context)
+            stats['errors'] += 1
+
+    def _before_parameter_build(self, model, context, **kwargs):
+        context['r53utils_operation'] = model.name
+
+    def _needs_retry(self, response=None, operation=None, **kwargs):
+        if response is None or operation is None:
+            return
+        if response[1].get('Error', {}).get('Code') in THROTTLE_CODES:
+            with self.lock:
+                self._operation(operation.name)['throttles'] += 1
+
+    def attach(self, client):
+        """hook instrumentation into a boto3 route53 client"""
+        for event, handler in (
+                ('before-parameter-build', self._before_parameter_build),
+                ('before-call', self._before_call),
+                ('after-call', self._after_call),
+                ('after-call-error', self._after_call_error),
+                ('needs-retry', self._needs_retry)):
+            client.meta.events.register(
+                event + '.route53', handler,
+                unique_id="r53utils-metrics-{}-{}".format(id(self), event))
+
+    def reset(self):
+        """discard all recorded values"""
+        with self.lock:
+            self.operations = {}
+
+    def snapshot(self):
+        """return dict of recorded values, keyed by operation name"""
+        result = {}
+        with self.lock:
+            for name, stats in self.operations.items():
+                cumulative = 0
+                buckets = []
+                for bound, count in zip(self.buckets + (float('inf'),),
+                                        stats['latency_counts']):
+                    cumulative += count
+                    buckets.append((bound, cumulative))
+                result[name] = {
+                    'calls': stats['calls'],
+                    'errors': stats['errors'],
+                    'retries': stats['retries'],
+                    'throttles': stats['throttles'],
+                    'pages': stats['pages'],
+                    'items': stats['items'],
+                    'items_per_page': (stats['items'] / stats['pages']
+                                       if stats['pages'] else 0.0),
+                    'latency_sum': stats['latency_sum'],
+                    'latency_buckets': buckets,
+                }
+        return result
+
+    def export(self, exporter):
+        """return snapshot rendered by exporter, eg. prometheus_text"""
+        return exporter(self.snapshot())
+
+
+def prometheus_text(snapshot, prefix='r53utils'):
+    """Render a Metrics snapshot in the Prometheus text exposition format"""
+
+    lines = []
+    for metric in ('calls', 'errors', 'retries', 'throttles', 'pages',
+                   'items'):
+        name = "{}_{}_total".format(prefix, metric)
+        lines.append("# TYPE {} counter".format(name))
+        for operation, stats in sorted(snapshot.items()):
+            lines.append('{}{{operation="{}"}} {}'.format(
+                name, operation, stats[metric]))
+    name = "{}_latency_seconds".format(prefix)
+    lines.append("# TYPE {} histogram".format(name))
+    for operation, stats in sorted(snapshot.items()):
+        for bound, count in stats['latency_buckets']:
+            lines.append('{}_bucket{{operation="{}",le="{}"}} {}'.format(
+                name, operation, "+Inf" if bound == float('inf') else bound,
+                count))
+        lines.append('{}_sum{{operation="{}"}} {}'.format(
+            name, operation, stats['latency_sum']))
+        lines.append('{}_count{{operation="{}"}} {}'.format(
+            name, operation, stats['calls']))
+    return "\n".join(lines) + "\n"
+
+
+def json_text(snapshot):
+    """Render a Metrics snapshot as JSON"""
+
+    result = {}
+    for operation, stats in snapshot.items():
+        result[operation] = dict(stats)
+        result[operation]['latency_buckets'] = [
+            ["+Inf" if bound == float('inf') else bound, count]
+            for bound, count in stats['latency_buckets']]
+    return json.dumps(result, indent=2, sort_keys=True)
+
+
+class ClientPool:
+    """
+    Thread-safe pool of boto3 route53 clients keyed by credentials
+    (AccessKeyId and SessionToken), so that clients and their connection
+    pools are created once and reused. At most maxclients clients are
+    kept, evicting the least recently used, eg. those of expired rotating
+    credentials. Objects with an attach(client) method, like RateLimiter
+    or Metrics, can be attached to all pooled clients.
+    """
+
+    def __init__(self, max_pool_connections=25, connect_timeout=60,
+                 read_timeout=60, tcp_keepalive=True, max_attempts=None,
+                 config=None, endpoint_url=None, maxclients=32):
+        self.options = dict(max_pool_connections=max_pool_connections,
+                            connect_timeout=connect_timeout,
+                            read_timeout=read_timeout,
+                            tcp_keepalive=tcp_keepalive)
+        if max_attempts is not None:
+            self.options['retries'] = {'total_max_attempts': max_attempts,
+                                       'mode': 'standard'}
+        self.base_config = config
+        self._config = None
+        self.endpoint_url = endpoint_url
+        self.maxclients = maxclients
+        self.clients = collections.OrderedDict()
+        self.hooks = []
+        self.lock = threading.Lock()
+
+    @property
+    def config(self):
+        """botocore Config of the pooled clients, built on first use"""
+        if self._config is None:
+            import botocore.config
+            self._config = (self.base_config or get_botoconfig()).merge(
+                botocore.config.Config(**self.options))
+        return self._config
+
+    def _new_client(self, creds, endpoint_url):
+        """create a new boto3 route53 client"""
+        import boto3
+        kwargs = dict(config=self.config)
+        if endpoint_url:
+            kwargs['endpoint_url'] = endpoint_url
+        if creds:
+            return boto3.client('route53',
+                                aws_access_key_id=creds['AccessKeyId'],
+                                aws_secret_access_key=creds['SecretAccessKey'],
+                                aws_session_token=creds['SessionToken'],
+                                **kwargs)
+        return boto3.client('route53', **kwargs)
+
+    def get(self, creds=None, endpoint_url=None):
+        """
+        return pooled client for the given credentials, and endpoint_url
+        (default: the pool's endpoint_url), eg. a local Route53 stand-in
+        """
+        key = self._key(creds, endpoint_url)
+        # boto3 client creation isn't thread-safe, so it happens under lock
+        with self.lock:
+            client = self.clients.get(key)
+            if client is None:
+                client = self._new_client(creds, key[1])
+                for hook in self.hooks:
+                    hook.attach(client)
+                self.clients[key] = client
+                while len(self.clients) > self.maxclients:
+                    self.clients.popitem(last=False)
+            else:
+                self.clients.move_to_end(key)
+        return client
+
+    def _key(self, creds, endpoint_url):
+        endpoint_url = endpoint_url or self.endpoint_url
+        key = (creds['AccessKeyId'], creds['SessionToken']) if creds else None
+        return key, endpoint_url
+
+    def discard(self, creds=None, endpoint_url=None):
+        """drop the pooled client for the given credentials, if any"""
+        with self.lock:
+            self.clients.pop(self._key(creds, endpoint_url), None)
+
+    def attach(self, hook):
+        """attach hook (eg. a RateLimiter) to current and future clients"""
+        with self.lock:
+            self.hooks.append(hook)
+            for client in self.clients.values():
+                hook.attach(client)
+
+    def clear(self):
+        """drop all pooled clients"""
+        with self.lock:
+            self.clients = collections.OrderedDict()
+
+
+client_pool = ClientPool()
+
+
+def get_client(creds=None, pool=None, endpoint_url=None):
+    """get boto3 route53 client, reused from the client pool"""
+    return (pool or client_pool).get(creds, endpoint_url=endpoint_url)
+
+
+def _as_client(client):
+    """return a client, given either a client or a ClientPool"""
+    if isinstance(client, ClientPool):
+        return client.get()
+    return client
+
+
+def short_zoneid(zoneid):
+    """return zoneid without the /hostedzone/ prefix"""
+    return zoneid.rsplit('/', 1)[-1]
 
 
 def get_caller_ref(prefix=CALLER_REF_PREFIX):
@@ -48,40 +465,585 @@ def status(http_response):
     return http_response['ResponseMetadata']['HTTPStatusCode']
 
 
-def generator_zones(client, maxitems=MAXITEMS):
-    """return generator over list of R53 hosted zones"""
+def _put(pipe, item, stop):
+    """put item on a bounded queue, giving up once stop is set"""
+    while not stop.is_set():
+        try:
+            pipe.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def generator_prefetch(iterable, depth):
+    """
+    Return generator over iterable, with up to depth items produced ahead
+    of the consumer on a worker thread. Exceptions raised in the worker
+    are re-raised to the consumer.
+    """
+
+    pipe = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    done = object()
+
+    def worker():
+        try:
+            for item in iterable:
+                if not _put(pipe, (item, None), stop):
+                    return
+        except Exception as error:
+            _put(pipe, (done, error), stop)
+            return
+        _put(pipe, (done, None), stop)
+
+    threading.Thread(target=worker, daemon=True).start()
+    try:
+        while True:
+            item, error = pipe.get()
+            if item is done:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stop.set()
+
+
+def generator_zone_pages(client, maxitems=MAXITEMS, start=None):
+    """
+    return generator over pages of R53 hosted zones, as (zones, next)
+    tuples, where next holds the parameters of the following page or None;
+    start gives the parameters of the first page
+    """
 
+    client = _as_client(client)
     kwargs = dict(MaxItems=maxitems)
+    if start:
+        kwargs.update(start)
     while True:
         response = client.list_hosted_zones_by_name(**kwargs)
         if status(response) != 200:
             raise Exception("list_hosted_zones_by_name() error: {}".format(
                 response))
-        for zone in response['HostedZones']:
-            yield zone
-        if response['IsTruncated']:
-            kwargs['DNSName'] = response['NextDNSName']
-            kwargs['HostedZoneId'] = response['NextHostedZoneId']
+        if response.get('IsTruncated'):
+            nextpage = dict(DNSName=response['NextDNSName'],
+                            HostedZoneId=response['NextHostedZoneId'])
         else:
+            nextpage = None
+        yield response['HostedZones'], nextpage
+        if nextpage is None:
             break
+        kwargs.update(nextpage)
 
 
-def generator_rrsets(client, zoneid, maxitems=MAXITEMS):
-    """return generator over rrsets in a given R53 zoneid"""
+def generator_rrset_pages(client, zoneid, maxitems=MAXITEMS, start=None):
+    """
+    return generator over pages of rrsets in a given R53 zoneid, as
+    (rrsets, next) tuples, where next holds the parameters of the
+    following page or None; start gives the parameters of the first page
+    """
 
+    client = _as_client(client)
     kwargs = dict(HostedZoneId=zoneid, MaxItems=maxitems)
+    if start:
+        kwargs.update(start)
     while True:
         response = client.list_resource_record_sets(**kwargs)
         if status(response) != 200:
             raise Exception("list_resource_record_sets() error: {}".format(
                 response))
-        for rrset in response['ResourceRecordSets']:
-            yield rrset
         if response['IsTruncated']:
-            kwargs['StartRecordName'] = response['NextRecordName']
-            kwargs['StartRecordType'] = response['NextRecordType']
+            nextpage = dict(StartRecordName=response['NextRecordName'],
+                            StartRecordType=response['NextRecordType'])
+            if 'NextRecordIdentifier' in response:
+                nextpage['StartRecordIdentifier'] = \
+                    response['NextRecordIdentifier']
         else:
+            nextpage = None
+        yield response['ResourceRecordSets'], nextpage
+        if nextpage is None:
             break
+        kwargs.pop('StartRecordIdentifier', None)
+        kwargs.update(nextpage)
+
+
+class RRset:
+    """
+    Compact, slotted form of an rrset dict, for holding large zones in
+    memory. Name, type and rdata values are interned, so that repeated
+    ones (eg. the same target address) are stored once. Other fields
+    (AliasTarget, SetIdentifier, routing policy) are kept as a tuple of
+    (key, value) pairs. to_dict() returns the API dict form.
+    """
+
+    __slots__ = ('name', 'type', 'ttl', 'values', 'extra')
+
+    def __init__(self, name, rrtype, ttl=None, values=(), extra=()):
+        self.name = sys.intern(name)
+        self.type = sys.intern(rrtype)
+        self.ttl = ttl
+        self.values = None if values is None else \
+            tuple(sys.intern(x) for x in values)
+        self.extra = tuple(extra)
+
+    @classmethod
+    def from_dict(cls, rrset):
+        """return RRset for an rrset dict, as listed by route53"""
+        records = rrset.get('ResourceRecords')
+        extra = tuple((key, value) for key, value in rrset.items()
+                      if key not in RRSET_FIELDS)
+        return cls(rrset['Name'], rrset['Type'], rrset.get('TTL'),
+                   None if records is None else
+                   [x['Value'] for x in records],
+                   extra)
+
+    def to_dict(self):
+        """return rrset dict form, as used by the route53 API"""
+        rrset = {'Name': self.name, 'Type': self.type}
+        rrset.update(self.extra)
+        if self.ttl is not None:
+            rrset['TTL'] = self.ttl
+        if self.values is not None:
+            rrset['ResourceRecords'] = [{'Value': x} for x in self.values]
+        return rrset
+
+    def get(self, key, default=None):
+        """dict-style access to rrset fields"""
+        if key == 'Name':
+            return self.name
+        if key == 'Type':
+            return self.type
+        if key == 'TTL':
+            return default if self.ttl is None else self.ttl
+        if key == 'ResourceRecords':
+            if self.values is None:
+                return default
+            return [{'Value': x} for x in self.values]
+        for name, value in self.extra:
+            if name == key:
+                return value
+        return default
+
+    def __getitem__(self, key):
+        value = self.get(key, self)
+        if value is self:
+            raise KeyError(key)
+        return value
+
+    def __eq__(self, other):
+        if not isinstance(other, RRset):
+            return NotImplemented
+        return (self.name, self.type, self.ttl, self.values, self.extra) == \
+            (other.name, other.type, other.ttl, other.values, other.extra)
+
+    def __repr__(self):
+        return "RRset({!r}, {!r}, {!r}, {!r})".format(
+            self.name, self.type, self.ttl, self.values)
+
+
+def _generator_cursor_pages(pages, cursor, on_cursor, prefetch):
+    """
+    Return generator of items from (items, next) pages, calling on_cursor
+    with the cursor to resume from after the items of each page have been
+    consumed; the cursor is {} when there are no more pages.
+    """
+
+    if cursor == {}:
+        return
+    if prefetch:
+        pages = generator_prefetch(pages, prefetch)
+    for items, nextpage in pages:
+        yield from items
+        if on_cursor is not None:
+            on_cursor(nextpage or {})
+
+
+def generator_zones(client, maxitems=MAXITEMS, prefetch=0, cursor=None,
+                    on_cursor=None):
+    """
+    return generator over list of R53 hosted zones; with prefetch, up to
+    that many pages are fetched ahead on a worker thread. on_cursor is
+    called with a JSON serializable cursor after each page is consumed,
+    and passing it back as cursor resumes the listing after that page.
+    """
+
+    pages = generator_zone_pages(client, maxitems, start=cursor)
+    yield from _generator_cursor_pages(pages, cursor, on_cursor, prefetch)
+
+
+def generator_rrsets(client, zoneid, maxitems=MAXITEMS, prefetch=0,
+                     compact=False, cursor=None, on_cursor=None):
+    """
+    return generator over rrsets in a given R53 zoneid; with prefetch, up
+    to that many pages are fetched ahead on a worker thread; with compact,
+    RRset objects are returned instead of dicts. on_cursor is called with
+    a JSON serializable cursor after each page is consumed, and passing it
+    back as cursor resumes the listing after that page.
+    """
+
+    pages = generator_rrset_pages(client, zoneid, maxitems, start=cursor)
+    rrsets = _generator_cursor_pages(pages, cursor, on_cursor, prefetch)
+    if compact:
+        rrsets = map(RRset.from_dict, rrsets)
+    yield from rrsets
+
+
+class Checkpoint:
+    """
+    Cursors of listings (see generator_rrsets), saved by key to a JSON
+    file, so that interrupted listings can be resumed. Each update
+    atomically replaces the file, at most once per interval seconds.
+    Completed listings have an empty cursor.
+    """
+
+    def __init__(self, path, interval=0.0):
+        self.path = path
+        self.interval = interval
+        self.saved_at = None
+        self.lock = threading.Lock()
+        try:
+            with open(path) as infile:
+                self.cursors = json.load(infile)
+        except FileNotFoundError:
+            self.cursors = {}
+
+    def cursor(self, key):
+        """return cursor to resume listing key from, or None"""
+        with self.lock:
+            return self.cursors.get(key)
+
+    def done(self, key):
+        """check whether listing key has been completed"""
+        return self.cursor(key) == {}
+
+    def update(self, key, cursor):
+        """record cursor of listing key, saving it if interval has passed"""
+        with self.lock:
+            self.cursors[key] = cursor
+            if self.saved_at is not None and cursor and \
+               time.monotonic() - self.saved_at < self.interval:
+                return
+            self._save()
+
+    def callback(self, key):
+        """return on_cursor callback updating listing key"""
+        return lambda cursor: self.update(key, cursor)
+
+    def save(self):
+        """save all cursors now"""
+        with self.lock:
+            self._save()
+
+    def _save(self):
+        tmpfile = "{}.tmp".format(self.path)
+        with open(tmpfile, 'w') as outfile:
+            json.dump(self.cursors, outfile)
+            outfile.flush()
+            os.fsync(outfile.fileno())
+        os.replace(tmpfile, self.path)
+        self.saved_at = time.monotonic()
+
+
+# characters of DNS labels in Route53 listing order, with '.' standing for
+# the end of a label, used as digits of the positions of split probes
+PROBE_CHARS = '-.0123456789_abcdefghijklmnopqrstuvwxyz'
+PROBE_DIGITS = 12
+
+
+def _first_rrset(client, zoneid, rrname, rrtype=None, setid=None):
+    """return first rrset at or after name (and type) in listing order"""
+    kwargs = dict(HostedZoneId=zoneid, StartRecordName=rrname, MaxItems='1')
+    if rrtype:
+        kwargs['StartRecordType'] = rrtype
+        if setid:
+            kwargs['StartRecordIdentifier'] = setid
+    response = client.list_resource_record_sets(**kwargs)
+    if status(response) != 200:
+        raise R53Error("list_resource_record_sets() error: {}".format(
+            response))
+    rrsets = response['ResourceRecordSets']
+    return rrsets[0] if rrsets else None
+
+
+def _split_key(rrset):
+    return (listing_key(rrset['Name'], rrset['Type']),
+            rrset.get('SetIdentifier') or '')
+
+
+def _label_value(label):
+    """Return position of a label in listing order, as an integer"""
+    value = 0
+    for char in (label + '.').ljust(PROBE_DIGITS, '-')[:PROBE_DIGITS]:
+        digit = min(bisect.bisect_left(PROBE_CHARS, char),
+                    len(PROBE_CHARS) - 1)
+        value = value * len(PROBE_CHARS) + digit
+    return value
+
+
+def _value_label(value):
+    """Return label at a position in listing order"""
+    chars = []
+    for _ in range(PROBE_DIGITS):
+        value, digit = divmod(value, len(PROBE_CHARS))
+        chars.append(PROBE_CHARS[digit])
+    return ''.join(reversed(chars)).split('.', 1)[0]
+
+
+def _probe_splits(client, zoneid, zonename, partitions, probes, workers):
+    """
+    Return rrsets splitting a zone into up to partitions ranges, found by
+    bisecting the listing order of the labels below the apex: each round
+    probes the middle of every range with StartRecordName, and splits it
+    at the record found there, or halves it if there was none. This goes
+    on until there are 4 times as many candidate splits, or probes run
+    out; candidates are then picked at even intervals.
+    """
+
+    zonename = normalize_name(zonename)
+
+    def top_value(rrset):
+        label = rrset['Name'][:-len(zonename)].rstrip('.')
+        return _label_value(label.rsplit('.', 1)[-1])
+
+    def probe(value):
+        label = _value_label(value)
+        if not label:
+            return None
+        return _first_rrset(client, zoneid, label + '.' + zonename)
+
+    splits = {}
+    first = _first_rrset(client, zoneid, PROBE_CHARS[0] + '.' + zonename)
+    if first is None:
+        return []
+    ranges = [(top_value(first), len(PROBE_CHARS) ** PROBE_DIGITS)]
+    probes -= 1
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while ranges and probes > 0 and len(splits) < 4 * partitions:
+            ranges = [x for x in ranges if x[1] - x[0] > 1][:probes]
+            probes -= len(ranges)
+            middles = [(low + high) // 2 for low, high in ranges]
+            found = executor.map(probe, middles)
+            new_ranges = []
+            for (low, high), middle, rrset in zip(ranges, middles, found):
+                value = None if rrset is None else top_value(rrset)
+                if value is None or value >= high:
+                    new_ranges.append((low, middle))
+                elif value >= middle:
+                    splits[_split_key(rrset)] = rrset
+                    new_ranges.extend([(low, middle), (value, high)])
+                # else the labels in range share the probe's label, and
+                # can't be split any further
+            ranges = new_ranges
+    keys = sorted(splits)
+    step = max(1, len(keys) / partitions)
+    return [splits[keys[int(i * step)]]
+            for i in range(1, partitions) if int(i * step) < len(keys)]
+
+
+def _snapshot_splits(client, zoneid, store, partitions, workers):
+    """
+    Return rrsets splitting a zone into partitions ranges of about equal
+    size according to its snapshot in store, re-probed to the records
+    that are in the zone now.
+    """
+
+    points = store.split_points(zoneid, partitions)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        rrsets = executor.map(lambda x: _first_rrset(client, zoneid, *x),
+                              points)
+        splits = {_split_key(x): x for x in rrsets if x is not None}
+    return [splits[x] for x in sorted(splits)]
+
+
+def generator_rrsets_partitioned(client, zoneid, zonename=None,
+                                 partitions=8, store=None, maxpages=256,
+                                 probes=None, maxitems=MAXITEMS):
+    """
+    Return generator over rrsets in a given R53 zoneid, in listing order,
+    listing ranges of the zone on up to partitions threads concurrently.
+    The ranges start at exact records, split points taken from the zone's
+    snapshot in a SnapshotStore (store) if given, or else found with up to
+    probes (4 per range by default) StartRecordName probes of names below
+    zonename. Each range is listed until it reaches the record that starts
+    the next one, so no rrset is returned twice. Ranges are listed and
+    returned in order. Pages listed ahead of the consumer are buffered, up
+    to maxpages across all ranges, and the zone is split into enough ranges
+    that the ones being listed fit in that buffer, so memory stays bounded
+    without holding up the listing. With maxpages=None, buffering is
+    unbounded and the zone is split into partitions ranges.
+    """
+
+    client = _as_client(client)
+    ranges = partitions
+    if maxpages is not None or zonename is None:
+        zone = get_zone(client, zoneid)
+        zonename = zonename or zone['Name']
+        if maxpages is not None:
+            # each range being listed gets its share of the buffer
+            size = max(1, maxpages // partitions) * int(maxitems)
+            count = zone.get('ResourceRecordSetCount', 0)
+            ranges = max(partitions, (count + size - 1) // size)
+    if store is not None:
+        splits = _snapshot_splits(client, zoneid, store, ranges, partitions)
+    else:
+        splits = _probe_splits(client, zoneid, zonename, ranges,
+                               probes or 4 * ranges, partitions)
+    starts = [None] + splits
+    ends = splits + [None]
+    pipes = [queue.Queue() for _ in starts]
+    stop = threading.Event()
+    done = object()
+    budget = threading.Condition()
+    state = dict(current=0, buffered=0)
+
+    def reserve(index):
+        """wait until a page of range index may be buffered"""
+        with budget:
+            budget.wait_for(lambda: (
+                stop.is_set() or maxpages is None or
+                state['buffered'] < maxpages or
+                (index == state['current'] and pipes[index].empty())))
+            state['buffered'] += 1
+            return not stop.is_set()
+
+    def scan(index, start, end):
+        params = None
+        if start is not None:
+            params = dict(StartRecordName=start['Name'],
+                          StartRecordType=start['Type'])
+            if 'SetIdentifier' in start:
+                params['StartRecordIdentifier'] = start['SetIdentifier']
+        endkey = None if end is None else _split_key(end)
+        if stop.is_set():
+            return
+        try:
+            for rrsets, _ in generator_rrset_pages(client, zoneid, maxitems,
+                                                   start=params):
+                page = rrsets
+                if endkey is not None:
+                    for i, rrset in enumerate(rrsets):
+                        key = _split_key(rrset)
+                        if key == endkey or key[0] > endkey[0]:
+                            page = rrsets[:i]
+                            break
+                if page:
+                    if not reserve(index):
+                        return
+                    pipes[index].put(page)
+                if page is not rrsets:
+                    break
+        except Exception as error:
+            pipes[index].put(error)
+            return
+        pipes[index].put(done)
+
+    executor = ThreadPoolExecutor(max_workers=partitions)
+    try:
+        for index, (start, end) in enumerate(zip(starts, ends)):
+            executor.submit(scan, index, start, end)
+        for index, pipe in enumerate(pipes):
+            with budget:
+                state['current'] = index
+                budget.notify_all()
+            while True:
+                page = pipe.get()
+                if page is done:
+                    break
+                if isinstance(page, Exception):
+                    raise page
+                with budget:
+                    state['buffered'] -= 1
+                    budget.notify_all()
+                yield from page
+    finally:
+        with budget:
+            stop.set()
+            budget.notify_all()
+        executor.shutdown(wait=False)
+
+
+class ZoneExporter:
+    """
+    Export the rrsets of many zones concurrently; failed listings resume
+    from the failed page, up to retries times
+    """
+
+    def __init__(self, client, workers=8, retries=3, maxitems=MAXITEMS):
+        self.client = _as_client(client)
+        self.workers = workers
+        self.retries = retries
+        self.maxitems = maxitems
+        self.errors = {}
+
+    def _scan_zone(self, zone, pipe, stop):
+        """list zone rrsets page by page onto pipe, resuming on errors"""
+
+        start = None
+        attempts = 0
+        try:
+            while not stop.is_set():
+                try:
+                    for rrsets, nextpage in generator_rrset_pages(
+                            self.client, zone['Id'], self.maxitems,
+                            start=start):
+                        if not _put(pipe, (zone, rrsets), stop):
+                            return
+                        start = nextpage
+                        attempts = 0
+                    return
+                except Exception as error:
+                    attempts += 1
+                    if attempts > self.retries:
+                        self.errors[zone['Id']] = error
+                        return
+                    time.sleep(min(2 ** attempts, 30))
+        finally:
+            _put(pipe, (zone, None), stop)
+
+    def export(self, zones=None):
+        """
+        return generator of (zone, rrset) for the given zone dicts, or all
+        zones in the account by default; failures go in errors by zone id
+        """
+
+        self.errors = {}
+        if zones is None:
+            zones = generator_zones(self.client)
+        pipe = queue.Queue(maxsize=2 * self.workers)
+        stop = threading.Event()
+        executor = ThreadPoolExecutor(max_workers=self.workers)
+        futures = []
+        try:
+            for zone in zones:
+                futures.append(
+                    executor.submit(self._scan_zone, zone, pipe, stop))
+            remaining = len(futures)
+            while remaining:
+                zone, rrsets = pipe.get()
+                if rrsets is None:
+                    remaining -= 1
+                    continue
+                for rrset in rrsets:
+                    yield zone, rrset
+        finally:
+            stop.set()
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+
+def _change_size(change):
+    """
+    Return (values, characters) that a change counts against the batch
+    limits. UPSERT changes are counted twice by Route53.
+    """
+    records = change['ResourceRecordSet'].get('ResourceRecords', [])
+    values = len(records)
+    chars = sum(len(x['Value']) for x in records)
+    if change['Action'] == 'UPSERT':
+        return 2 * values, 2 * chars
+    return values, chars
 
 
 class ChangeBatch:
@@ -90,9 +1052,21 @@ class ChangeBatch:
     def __init__(self):
         self.reset()
 
+    def __len__(self):
+        return len(self.datadict['Changes'])
+
     def reset(self):
         """reset changebatch"""
         self.datadict = {'Changes': []}
+        self.num_values = 0
+        self.num_chars = 0
+
+    def _append(self, change):
+        """append change and account for its size"""
+        values, chars = _change_size(change)
+        self.datadict['Changes'].append(change)
+        self.num_values += values
+        self.num_chars += chars
 
     def create(self, rrname, rrtype, ttl, rdatalist):
         """create operation"""
@@ -105,7 +1079,7 @@ class ChangeBatch:
                 'ResourceRecords': [{'Value': x} for x in rdatalist]
             }
         }
-        self.datadict['Changes'].append(change)
+        self._append(change)
 
     def upsert(self, rrname, rrtype, ttl, rdatalist):
         """upsert operation: create, or update if already exists"""
@@ -118,15 +1092,32 @@ class ChangeBatch:
                 'ResourceRecords': [{'Value': x} for x in rdatalist]
             }
         }
-        self.datadict['Changes'].append(change)
+        self._append(change)
 
     def delete(self, rrset):
         """delete operation"""
+        self.add_change('DELETE', rrset)
+
+    def add_change(self, action, rrset):
+        """add change with given action for a complete rrset dict or RRset"""
+        if isinstance(rrset, RRset):
+            rrset = rrset.to_dict()
         change = {
-            'Action': 'DELETE',
+            'Action': action,
             'ResourceRecordSet': rrset
         }
-        self.datadict['Changes'].append(change)
+        self._append(change)
+
+    def fits(self, change, limits=BATCH_LIMITS):
+        """check whether change can be added without exceeding limits"""
+        values, chars = _change_size(change)
+        return (len(self) < limits.changes and
+                self.num_values + values <= limits.values and
+                self.num_chars + chars <= limits.chars)
+
+    def chunks(self, limits=BATCH_LIMITS):
+        """return generator of ChangeBatch chunks that fit within limits"""
+        return generator_chunks(self.datadict['Changes'], limits=limits)
 
     def data(self):
         """return ChangeBatch data"""
@@ -135,23 +1126,332 @@ class ChangeBatch:
         return None
 
 
+def generator_chunks(changes, limits=BATCH_LIMITS):
+    """
+    Return generator of ChangeBatch objects built from an iterable of
+    change dicts, each one filled up to the given batch limits.
+    """
+
+    chunk = ChangeBatch()
+    for change in changes:
+        if not chunk.fits(change, limits):
+            if chunk:
+                yield chunk
+                chunk = ChangeBatch()
+            if not chunk.fits(change, limits):
+                raise R53Error("Change exceeds batch limits: {} {}".format(
+                    change['ResourceRecordSet']['Name'],
+                    change['ResourceRecordSet']['Type']))
+        chunk._append(change)
+    if chunk:
+        yield chunk
+
+
+def normalize_name(rrname):
+    """
+    Return domain name in the form Route53 lists it: lowercase, absolute,
+    and with '*' escaped as \\052
+    """
+    rrname = rrname.lower()
+    if not rrname.endswith('.'):
+        rrname += '.'
+    return rrname.replace('*', '\\052')
+
+
+def rrset_key(rrset):
+    """Return (name, type, SetIdentifier) key that identifies an rrset"""
+    return (normalize_name(rrset['Name']), rrset['Type'],
+            rrset.get('SetIdentifier'))
+
+
+def _rrset_canonical(rrset):
+    """Return rrset in a canonical form, for comparison"""
+    canonical = dict(rrset)
+    canonical['Name'] = normalize_name(rrset['Name'])
+    if 'ResourceRecords' in rrset:
+        canonical['ResourceRecords'] = sorted(
+            x['Value'] for x in rrset['ResourceRecords'])
+    if 'AliasTarget' in rrset:
+        canonical['AliasTarget'] = dict(rrset['AliasTarget'])
+        canonical['AliasTarget']['DNSName'] = normalize_name(
+            rrset['AliasTarget']['DNSName'])
+    return canonical
+
+
+class ReconcilePlan:
+    """
+    Minimal set of changes that brings a zone's current rrsets to a
+    desired state, as lists of rrsets to create, upsert and delete, and
+    the ready to send ChangeBatch chunks. Deletes are ordered first, so
+    that a name can change type (eg. CNAME to A) across chunks.
+    """
+
+    def __init__(self, creates, upserts, deletes, limits=BATCH_LIMITS):
+        self.creates = creates
+        self.upserts = upserts
+        self.deletes = deletes
+        changes = [{'Action': 'DELETE', 'ResourceRecordSet': x}
+                   for x in deletes]
+        changes += [{'Action': 'CREATE', 'ResourceRecordSet': x}
+                    for x in creates]
+        changes += [{'Action': 'UPSERT', 'ResourceRecordSet': x}
+                    for x in upserts]
+        self.batches = list(generator_chunks(changes, limits=limits))
+
+    @property
+    def api_calls(self):
+        """number of change_resource_record_sets calls the plan needs"""
+        return len(self.batches)
+
+    def __len__(self):
+        return len(self.creates) + len(self.upserts) + len(self.deletes)
+
+
+def plan_reconcile(desired, current, zonename=None, delete=True,
+                   limits=BATCH_LIMITS):
+    """
+    Compare desired and current rrsets, keyed by (name, type,
+    SetIdentifier), and return a ReconcilePlan with the changes needed.
+    Current rrsets missing from desired are deleted unless delete is
+    False; the apex SOA and NS sets of zonename are never deleted.
+    """
+
+    wanted = {}
+    for rrset in desired:
+        key = rrset_key(rrset)
+        if key in wanted:
+            raise R53Error("Duplicate desired rrset: {} {} {}".format(*key))
+        wanted[key] = rrset
+
+    apex = normalize_name(zonename) if zonename else None
+    creates, upserts, deletes = [], [], []
+    for rrset in current:
+        key = rrset_key(rrset)
+        target = wanted.pop(key, None)
+        if target is None:
+            if delete and not (key[0] == apex and key[1] in ['SOA', 'NS']):
+                deletes.append(rrset)
+        elif _rrset_canonical(target) != _rrset_canonical(rrset):
+            upserts.append(target)
+    creates.extend(wanted.values())
+    return ReconcilePlan(creates, upserts, deletes, limits=limits)
+
+
+class ZoneIndex:
+    """
+    Zone name to zone ids index. Without a ttl, each lookup seeks straight
+    to the name with list_hosted_zones_by_name and stops at the first zone
+    that doesn't match. With a ttl (seconds), lookups are answered from an
+    in-memory name -> [ids] map of the whole account, rebuilt from a single
+    sweep of generator_zones when it expires or is invalidated.
+    """
+
+    def __init__(self, client, ttl=None):
+        self.client = _as_client(client)
+        self.ttl = ttl
+        self.zonemap = None
+        self.built_at = None
+        self.stale = set()
+        self.lock = threading.Lock()
+
+    def seek(self, zonename):
+        """return list of zone ids for zonename, seeking directly to it"""
+
+        zoneids = []
+        kwargs = dict(DNSName=zonename, MaxItems=MAXITEMS)
+        while True:
+            response = self.client.list_hosted_zones_by_name(**kwargs)
+            if status(response) != 200:
+                raise R53Error("list_hosted_zones_by_name() error: {}".format(
+                    response))
+            for zone in response['HostedZones']:
+                if zone['Name'] != zonename:
+                    return zoneids
+                zoneids.append(zone['Id'])
+            if not response.get('IsTruncated'):
+                return zoneids
+            kwargs['DNSName'] = response['NextDNSName']
+            kwargs['HostedZoneId'] = response['NextHostedZoneId']
+
+    def refresh(self):
+        """
+        rebuild the name -> [ids] map from one sweep of all zones, and
+        return it
+        """
+
+        zonemap = {}
+        for zone in generator_zones(self.client):
+            zonemap.setdefault(zone['Name'], []).append(zone['Id'])
+        with self.lock:
+            self.zonemap = zonemap
+            self.built_at = time.monotonic()
+            self.stale = set()
+        return zonemap
+
+    def invalidate(self, zonename=None):
+        """invalidate a single zone name, or the whole map"""
+
+        with self.lock:
+            if zonename is None:
+                self.zonemap = None
+            else:
+                self.stale.add(zonename)
+
+    def _expired(self):
+        # called with lock held
+        return (self.zonemap is None or
+                time.monotonic() - self.built_at >= self.ttl)
+
+    def zoneids(self, zonename):
+        """return list of zone ids for the given zone name"""
+
+        if self.ttl is None:
+            return self.seek(zonename)
+        # keep a reference to the map, which invalidate() may drop
+        with self.lock:
+            zonemap = None if self._expired() else self.zonemap
+            stale = zonename in self.stale
+        if zonemap is None:
+            zonemap = self.refresh()
+            stale = False
+        if not stale:
+            with self.lock:
+                return list(zonemap.get(zonename, []))
+        zoneids = self.seek(zonename)
+        with self.lock:
+            if self.zonemap is not None:
+                if zoneids:
+                    self.zonemap[zonename] = zoneids
+                else:
+                    self.zonemap.pop(zonename, None)
+            self.stale.discard(zonename)
+        return list(zoneids)
+
+    def zoneid(self, zonename):
+        """return the single zone id for the given zone name"""
+
+        zoneid_set = self.zoneids(zonename)
+        count = len(zoneid_set)
+        if count == 1:
+            return zoneid_set[0]
+        if count == 0:
+            raise R53Error("Zone {} not found".format(zonename))
+        raise R53Error("Multiple zone ids found: {}".format(zoneid_set))
+
+
 def name_to_zoneid(client, zonename):
     """Return zoneid for the given zone name"""
 
-    zoneid_set = []
-    for zone in generator_zones(client):
-        if zone['Name'] == zonename:
-            zoneid_set.append(zone['Id'])
-    count = len(zoneid_set)
-    if count == 1:
-        return zoneid_set[0]
-    if count == 0:
-        raise R53Error("Zone {} not found".format(zonename))
-    raise R53Error("Multiple zone ids found: {}".format(zoneid_set))
+    return ZoneIndex(client).zoneid(zonename)
 
 
-def get_rrset(client, zoneid, rrname, rrtype):
-    """given zoneid, get specified RRset by name and type"""
+class RRsetCache:
+    """
+    In-process LRU cache of get_rrset results, evicting by size and TTL.
+    Misses are cached too, for negative_ttl seconds. The cache attaches
+    itself to the clients it is used with, and drops a zone's entries
+    whenever rrsets are changed or the zone is deleted through that client
+    (as change_rrsets, empty_zone and delete_zone do).
+    """
+
+    def __init__(self, maxsize=10000, ttl=60, negative_ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = ttl if negative_ttl is None else negative_ttl
+        self.entries = collections.OrderedDict()
+        self.zonekeys = {}
+        self.clients = weakref.WeakSet()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def _lookup(self, key):
+        """return (found, rrset) for key, counting hits and misses"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return True, entry[1]
+                self._remove(key)
+            self.misses += 1
+            return False, None
+
+    def _store(self, key, rrset):
+        ttl = self.ttl if rrset is not None else self.negative_ttl
+        with self.lock:
+            self.entries[key] = (time.monotonic() + ttl, rrset)
+            self.entries.move_to_end(key)
+            self.zonekeys.setdefault(key[0], set()).add(key)
+            while len(self.entries) > self.maxsize:
+                self._remove(next(iter(self.entries)))
+
+    def _remove(self, key):
+        del self.entries[key]
+        keys = self.zonekeys[key[0]]
+        keys.discard(key)
+        if not keys:
+            del self.zonekeys[key[0]]
+
+    def invalidate(self, zoneid=None):
+        """drop cached entries of zoneid, or all entries"""
+        with self.lock:
+            if zoneid is None:
+                self.entries.clear()
+                self.zonekeys.clear()
+                return
+            for key in self.zonekeys.pop(short_zoneid(zoneid), ()):
+                del self.entries[key]
+
+    def stats(self):
+        """return dict of cache hits, misses and size"""
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'size': len(self.entries)}
+
+    def _before_write(self, params, context, **kwargs):
+        zoneid = params.get('HostedZoneId') or params['Id']
+        context['r53utils_zoneid'] = zoneid
+        self.invalidate(zoneid)
+
+    def _after_write(self, context, **kwargs):
+        # a concurrent lookup may have cached the old rrset during the call
+        if 'r53utils_zoneid' in context:
+            self.invalidate(context['r53utils_zoneid'])
+
+    def attach(self, client):
+        """invalidate zone entries on writes made through client"""
+        for operation in ('ChangeResourceRecordSets', 'DeleteHostedZone'):
+            for event, handler in (('before-parameter-build',
+                                    self._before_write),
+                                   ('after-call', self._after_write),
+                                   ('after-call-error', self._after_write)):
+                event_name = '{}.route53.{}'.format(event, operation)
+                client.meta.events.register(
+                    event_name, handler,
+                    unique_id="r53utils-rrsetcache-{}-{}".format(
+                        id(self), event_name))
+        self.clients.add(client)
+
+    def get_rrset(self, client, zoneid, rrname, rrtype):
+        """given zoneid, get specified RRset by name and type, via cache"""
+
+        client = _as_client(client)
+        if client not in self.clients:
+            self.attach(client)
+        key = (short_zoneid(zoneid), rrname, rrtype)
+        found, rrset = self._lookup(key)
+        if not found:
+            rrset = _lookup_rrset(client, zoneid, rrname, rrtype)
+            self._store(key, rrset)
+        if rrset is None:
+            raise R53Error("RRset doesn't exist: {} {}".format(rrname, rrtype))
+        return copy.deepcopy(rrset)
+
+
+def _lookup_rrset(client, zoneid, rrname, rrtype):
+    """given zoneid, get specified RRset by name and type, or None"""
 
     response = client.list_resource_record_sets(
         HostedZoneId=zoneid,
@@ -163,17 +1463,163 @@ def get_rrset(client, zoneid, rrname, rrtype):
         raise R53Error("list_resource_record_sets() error: {}".format(
             response))
 
+    if not response['ResourceRecordSets']:
+        return None
     rrset0 = response['ResourceRecordSets'][0]
     if rrname == rrset0['Name'] and rrtype == rrset0['Type']:
         return rrset0
-    raise R53Error("RRset doesn't exist: {} {}".format(rrname, rrtype))
+    return None
+
+
+def get_rrset(client, zoneid, rrname, rrtype, cache=None):
+    """
+    given zoneid, get specified RRset by name and type; an RRsetCache can
+    be given to answer repeated lookups from memory
+    """
+
+    client = _as_client(client)
+    if cache is not None:
+        return cache.get_rrset(client, zoneid, rrname, rrtype)
+    rrset = _lookup_rrset(client, zoneid, rrname, rrtype)
+    if rrset is None:
+        raise R53Error("RRset doesn't exist: {} {}".format(rrname, rrtype))
+    return rrset
+
+
+def listing_key(rrname, rrtype=''):
+    """
+    Return key that sorts rrsets in Route53 listing order: by name as a
+    string with its labels reversed (eg. com.example.www.), then by type
+    """
+    labels = normalize_name(rrname)[:-1].split('.')
+    return '.'.join(reversed(labels)) + '.', rrtype
+
+
+def _rrsets_point(client, zoneid, keys, hits, misses):
+    """resolve each key with its own get_rrset style lookup"""
+    for key in keys:
+        rrset = _lookup_rrset(client, zoneid, normalize_name(key[0]), key[1])
+        if rrset is None:
+            misses.append(key)
+        else:
+            hits[key] = rrset
+
+
+def _rrsets_scan(client, zoneid, keys, hits, misses, maxitems):
+    """
+    resolve keys with range scans: each listing starts at the first
+    unresolved key in listing order, and resolves every key up to the last
+    rrset it returned
+    """
+
+    pending = sorted(keys, key=lambda x: listing_key(*x))
+    while pending:
+        start = pending[0]
+        response = client.list_resource_record_sets(
+            HostedZoneId=zoneid,
+            StartRecordName=normalize_name(start[0]),
+            StartRecordType=start[1],
+            MaxItems=maxitems)
+        if status(response) != 200:
+            raise R53Error("list_resource_record_sets() error: {}".format(
+                response))
+        found = {}
+        for rrset in response['ResourceRecordSets']:
+            found.setdefault((rrset['Name'], rrset['Type']), rrset)
+        if response['IsTruncated'] and response['ResourceRecordSets']:
+            last = response['ResourceRecordSets'][-1]
+            last = listing_key(last['Name'], last['Type'])
+        else:
+            last = None
+        while pending and (last is None or
+                           listing_key(*pending[0]) <= last):
+            key = pending.pop(0)
+            rrset = found.get((normalize_name(key[0]), key[1]))
+            if rrset is None:
+                misses.append(key)
+            else:
+                hits[key] = rrset
+
+
+def _rrsets_full(client, zoneid, keys, hits, misses, maxitems):
+    """resolve keys by listing the zone from the start, until all found"""
+    wanted = {(normalize_name(x[0]), x[1]): x for x in keys}
+    for rrsets, _ in generator_rrset_pages(client, zoneid, maxitems):
+        for rrset in rrsets:
+            key = wanted.pop((rrset['Name'], rrset['Type']), None)
+            if key is not None:
+                hits[key] = rrset
+        if not wanted:
+            break
+    misses.extend(wanted.values())
+
+
+def get_rrsets(client, zoneid, keys, strategy='auto', rrcount=None,
+               maxitems=MAXITEMS):
+    """
+    Given zoneid, get many RRsets by (name, type) keys; returns a dict of
+    key -> rrset for the keys found and a list of the keys not found.
+
+    Strategies: 'point' does one lookup per key; 'scan' covers the keys in
+    listing order with range scans, taking at most min(keys, zone pages)
+    calls; 'full' lists the zone from the start until all keys are found.
+    'auto' uses point lookups for a single key, a full listing when the
+    zone's rrcount (if given) fits in one page, and range scans otherwise.
+    """
+
+    client = _as_client(client)
+    keys = list(dict.fromkeys(keys))
+    if strategy == 'auto':
+        if len(keys) <= 1:
+            strategy = 'point'
+        elif rrcount is not None and rrcount <= int(maxitems):
+            strategy = 'full'
+        else:
+            strategy = 'scan'
+
+    hits = {}
+    misses = []
+    if strategy == 'point':
+        _rrsets_point(client, zoneid, keys, hits, misses)
+    elif strategy == 'scan':
+        _rrsets_scan(client, zoneid, keys, hits, misses, maxitems)
+    elif strategy == 'full':
+        _rrsets_full(client, zoneid, keys, hits, misses, maxitems)
+    else:
+        raise R53Error("Unknown get_rrsets strategy: {}".format(strategy))
+    return hits, misses
+
+
+def _field_text(value):
+    """Return text form of an rrset field value, eg. GeoLocation dicts"""
+    if isinstance(value, dict):
+        return ",".join("{}={}".format(k, v) for k, v in value.items())
+    return str(value)
 
 
 def rrset_to_text(rrset):
-    """Return textual presentation form of RRset"""
+    """
+    Return textual presentation form of RRset. Route53 specific data, such
+    as routing policy fields and alias targets, which have no master file
+    form, is written as comments.
+    """
 
+    if isinstance(rrset, RRset):
+        rrset = rrset.to_dict()
     rr_strings = []
-    for rdata_dict in rrset['ResourceRecords']:
+    routing = ["{}={}".format(k, _field_text(v)) for k, v in rrset.items()
+               if k not in RRSET_FIELDS and k != 'AliasTarget']
+    if routing:
+        rr_strings.append("; {} {} {}".format(rrset['Name'], rrset['Type'],
+                                              " ".join(routing)))
+    if 'AliasTarget' in rrset:
+        alias = rrset['AliasTarget']
+        rr_strings.append("; {} ALIAS {} {} HostedZoneId={} "
+                          "EvaluateTargetHealth={}".format(
+                              rrset['Name'], rrset['Type'],
+                              alias['DNSName'], alias['HostedZoneId'],
+                              alias.get('EvaluateTargetHealth', False)))
+    for rdata_dict in rrset.get('ResourceRecords', []):
         rdata = rdata_dict['Value']
         rr_strings.append("{} {} IN {} {}".format(rrset['Name'],
                                                   rrset['TTL'],
@@ -182,9 +1628,291 @@ def rrset_to_text(rrset):
     return "\n".join(rr_strings)
 
 
+EXPORT_FORMATS = ('zone', 'json', 'ndjson')
+
+
+def write_rrsets(outfile, rrsets, fmt='zone'):
+    """
+    Write rrsets (dicts or RRsets, from any iterable such as
+    generator_rrsets) to a text file object as they arrive, in master file
+    ('zone'), JSON array ('json') or one JSON object per line ('ndjson')
+    format. Only one rrset is held in memory at a time. Returns the number
+    of rrsets written.
+    """
+
+    if fmt not in EXPORT_FORMATS:
+        raise R53Error("Unknown export format: {}".format(fmt))
+    count = 0
+    if fmt == 'json':
+        outfile.write("[")
+    for rrset in rrsets:
+        if fmt == 'zone':
+            outfile.write(rrset_to_text(rrset))
+            outfile.write("\n")
+        else:
+            if isinstance(rrset, RRset):
+                rrset = rrset.to_dict()
+            if fmt == 'json':
+                outfile.write(",\n" if count else "\n")
+            outfile.write(json.dumps(rrset))
+            if fmt == 'ndjson':
+                outfile.write("\n")
+        count += 1
+    if fmt == 'json':
+        outfile.write("\n]\n")
+    return count
+
+
+def export_zone(client, zoneid, outfile, fmt='zone', maxitems=MAXITEMS,
+                prefetch=1, cursor=None, on_cursor=None):
+    """
+    Stream all rrsets of zoneid to outfile in the given format (see
+    write_rrsets), fetching the next page while the current one is
+    written. cursor and on_cursor resume and checkpoint the listing as in
+    generator_rrsets; outfile is flushed before on_cursor is called, and
+    the 'zone' and 'ndjson' formats can be appended to when resuming.
+    Returns the number of rrsets written.
+    """
+
+    client = _as_client(client)
+    if on_cursor is not None:
+        checkpoint = on_cursor
+
+        def on_cursor(cursor):
+            outfile.flush()
+            checkpoint(cursor)
+
+    return write_rrsets(outfile, generator_rrsets(
+        client, zoneid, maxitems, prefetch=prefetch, cursor=cursor,
+        on_cursor=on_cursor), fmt)
+
+
+TTL_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+
+# positions of domain names in the rdata of types that have them, which
+# are made absolute when they are relative to $ORIGIN
+RDATA_NAME_FIELDS = {
+    'NS': (0,), 'CNAME': (0,), 'PTR': (0,), 'DNAME': (0,), 'MX': (1,),
+    'SRV': (3,), 'SOA': (0, 1), 'HTTPS': (1,), 'SVCB': (1,),
+}
+
+
+def ttl_value(text):
+    """Return TTL in seconds, from a number or units form like 1h30m"""
+    text = text.lower()
+    if text.isdigit():
+        return int(text)
+    seconds = 0
+    number = ''
+    for char in text:
+        if char.isdigit():
+            number += char
+        elif char in TTL_UNITS and number:
+            seconds += int(number) * TTL_UNITS[char]
+            number = ''
+        else:
+            raise R53Error("Invalid TTL: {}".format(text))
+    if number:
+        raise R53Error("Invalid TTL: {}".format(text))
+    return seconds
+
+
+def _is_ttl(token):
+    """check whether a master file token is a TTL"""
+    if not token[0].isdigit():
+        return False
+    try:
+        ttl_value(token)
+    except R53Error:
+        return False
+    return True
+
+
+def _tokenize(line):
+    """
+    Split a master file line into tokens, dropping comments; quoted
+    strings are kept as single tokens with their quotes. Returns (tokens,
+    parenthesis depth change).
+    """
+
+    if '"' not in line:
+        line = line.partition(';')[0]
+        depth = line.count('(') - line.count(')')
+        if depth or ')' in line:
+            line = line.replace('(', ' ').replace(')', ' ')
+        return line.split(), depth
+
+    tokens = []
+    depth = 0
+    token = ''
+    quoted = escaped = False
+    for char in line:
+        if quoted:
+            token += char
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                quoted = False
+        elif char == '"':
+            token += char
+            quoted = True
+        elif char == ';':
+            break
+        elif char in '()':
+            depth += 1 if char == '(' else -1
+            if token:
+                tokens.append(token)
+                token = ''
+        elif char.isspace():
+            if token:
+                tokens.append(token)
+                token = ''
+        else:
+            token += char
+    if quoted:
+        raise R53Error("Unterminated quoted string: {}".format(line.strip()))
+    if token:
+        tokens.append(token)
+    return tokens, depth
+
+
+def _absolute_name(name, origin):
+    """Return name made absolute relative to origin"""
+    if name == '@':
+        return origin
+    if name.endswith('.'):
+        return name
+    if origin is None:
+        raise R53Error("Relative name {} without $ORIGIN".format(name))
+    if origin == '.':
+        return name + '.'
+    return name + '.' + origin
+
+
+def generator_zone_lines(infile):
+    """
+    Return generator of (line number, tokens, owner blank) for the entries
+    of a master file, joining entries continued over lines by parentheses
+    """
+
+    entry = []
+    depth = 0
+    start = blank = None
+    for lineno, line in enumerate(infile, 1):
+        tokens, change = _tokenize(line)
+        if depth == 0:
+            if not tokens:
+                continue
+            start, blank = lineno, line[0].isspace()
+        entry.extend(tokens)
+        depth += change
+        if depth < 0:
+            raise R53Error("line {}: unbalanced parentheses".format(lineno))
+        if depth == 0:
+            yield start, entry, blank
+            entry = []
+    if depth:
+        raise R53Error("line {}: unbalanced parentheses".format(start))
+
+
+def generator_zone_records(infile, origin=None, ttl=None):
+    """
+    Return generator of (name, ttl, type, rdata) records read from a
+    master (BIND zone) file object, one entry at a time. $ORIGIN and $TTL
+    directives, relative names, '@', blank owners, parentheses, comments
+    and TTL units (1h, 2d) are handled. origin and ttl give the initial
+    $ORIGIN and $TTL; without a $TTL, a record with no TTL inherits that
+    of the previous record.
+    """
+
+    if origin is not None and not origin.endswith('.'):
+        origin += '.'
+    owner = None
+    last_ttl = ttl
+    for lineno, tokens, blank in generator_zone_lines(infile):
+        directive = tokens[0].upper()
+        if directive == '$ORIGIN':
+            origin = _absolute_name(tokens[1], origin)
+            continue
+        if directive == '$TTL':
+            ttl = last_ttl = ttl_value(tokens[1])
+            continue
+        if directive.startswith('$'):
+            raise R53Error("line {}: unsupported directive {}".format(
+                lineno, tokens[0]))
+
+        if not blank:
+            owner = _absolute_name(tokens.pop(0), origin)
+        elif owner is None:
+            raise R53Error("line {}: no owner name".format(lineno))
+        rrttl = None
+        while tokens and (_is_ttl(tokens[0]) or tokens[0].upper() == 'IN'):
+            token = tokens.pop(0)
+            if token.upper() != 'IN':
+                rrttl = ttl_value(token)
+        if len(tokens) < 2:
+            raise R53Error("line {}: incomplete record".format(lineno))
+        rrtype, rdata = tokens[0].upper(), tokens[1:]
+        if rrttl is None:
+            rrttl = ttl if ttl is not None else last_ttl
+            if rrttl is None:
+                raise R53Error("line {}: no TTL for record".format(lineno))
+        last_ttl = rrttl
+        for i in RDATA_NAME_FIELDS.get(rrtype, ()):
+            if i < len(rdata) and not (rrtype in ('HTTPS', 'SVCB') and
+                                       rdata[i] == '.'):
+                rdata[i] = _absolute_name(rdata[i], origin)
+        if rrtype == 'SOA':
+            rdata[3:7] = [str(ttl_value(x)) for x in rdata[3:7]]
+        yield owner, rrttl, rrtype, " ".join(rdata)
+
+
+def generator_zone_rrsets(infile, origin=None, ttl=None, window=1000,
+                          check=False):
+    """
+    Return generator of rrset dicts read from a master file object, for
+    creating the zone in Route53. Records are grouped into rrsets while
+    up to window rrsets are open; the oldest open rrset is yielded when
+    the window is full, and at the end, so memory use is bounded by the
+    window. Records of one rrset get the smallest TTL.
+
+    A record of an rrset that was already yielded starts a new rrset, which
+    Route53 will reject; sort the file by owner name, or use a larger
+    window. With check, this raises R53Error instead, but the keys of all
+    yielded rrsets are then kept, so memory grows with the zone.
+    """
+
+    pending = collections.OrderedDict()
+    flushed = set()
+    for name, rrttl, rrtype, rdata in generator_zone_records(infile, origin,
+                                                             ttl):
+        key = (name.lower(), rrtype)
+        rrset = pending.get(key)
+        if rrset is None:
+            if check and key in flushed:
+                raise R53Error("RRset {} {} appears again after it was "
+                               "written; increase window".format(name,
+                                                                 rrtype))
+            rrset = {'Name': name, 'Type': rrtype, 'TTL': rrttl,
+                     'ResourceRecords': []}
+            pending[key] = rrset
+            if len(pending) > window:
+                oldkey, oldrrset = pending.popitem(last=False)
+                if check:
+                    flushed.add(oldkey)
+                yield oldrrset
+        rrset['TTL'] = min(rrset['TTL'], rrttl)
+        if {'Value': rdata} not in rrset['ResourceRecords']:
+            rrset['ResourceRecords'].append({'Value': rdata})
+    yield from pending.values()
+
+
 def test_dns_answer(client, zoneid, qname, qtype):
     """test DNS answer for R53 query name and type and given zoneid"""
 
+    client = _as_client(client)
     response = client.test_dns_answer(
         HostedZoneId=zoneid,
         RecordName=qname,
@@ -211,6 +1939,7 @@ def wait_for_insync(client, changeid, polltime=5, timeout=120):
     ChangeInfo: { 'Status': 'PENDING'|'INSYNC', ... }
     """
 
+    client = _as_client(client)
     elapsed = 0
     while True:
         time.sleep(polltime)
@@ -223,12 +1952,151 @@ def wait_for_insync(client, changeid, polltime=5, timeout=120):
             raise R53Error("timed out waiting for INSYNC")
 
 
+class ChangeTracker:
+    """
+    Track many pending Route53 changes from a single background thread.
+    Each tracked change id gets a Future that resolves to its ChangeInfo
+    once the change is INSYNC, or fails with R53Error when the tracker's
+    overall deadline (timeout seconds from creation) passes. Each change
+    is first polled after initial seconds, then with the poll interval
+    growing by factor up to maxpoll.
+    """
+
+    def __init__(self, client, initial=1.0, factor=1.5, maxpoll=15.0,
+                 timeout=600):
+        self.client = _as_client(client)
+        self.initial = initial
+        self.factor = factor
+        self.maxpoll = maxpoll
+        self.deadline = None if timeout is None else \
+            time.monotonic() + timeout
+        self.futures = {}
+        self.heap = []
+        self.counter = itertools.count()
+        self.cond = threading.Condition()
+        self.thread = None
+        self.closed = False
+
+    def track(self, changeid, callback=None):
+        """
+        Track changeid (or a ChangeInfo dict); return a Future for it.
+        The optional callback is called with the Future when it is done.
+        """
+
+        if isinstance(changeid, dict):
+            changeid = changeid['Id']
+        with self.cond:
+            if self.closed:
+                raise R53Error("ChangeTracker is closed")
+            future = self.futures.get(changeid)
+            if future is None:
+                future = Future()
+                self.futures[changeid] = future
+                heapq.heappush(self.heap,
+                               (time.monotonic() + self.initial,
+                                next(self.counter), changeid, self.initial))
+                if self.thread is None:
+                    self.thread = threading.Thread(target=self._run,
+                                                   daemon=True)
+                    self.thread.start()
+                self.cond.notify()
+        if callback is not None:
+            future.add_done_callback(callback)
+        return future
+
+    def track_async(self, changeid):
+        """track changeid; return an asyncio future for it"""
+        import asyncio
+        return asyncio.wrap_future(self.track(changeid))
+
+    def wait(self, changeids=None):
+        """wait for the given (default: all tracked) changes to be INSYNC"""
+        if changeids is None:
+            with self.cond:
+                futures = list(self.futures.values())
+        else:
+            futures = [self.track(x) for x in changeids]
+        return [x.result() for x in futures]
+
+    @property
+    def pending(self):
+        """number of changes not yet INSYNC"""
+        with self.cond:
+            return len(self.heap)
+
+    def close(self):
+        """stop polling, failing any changes that are still pending"""
+        with self.cond:
+            self.closed = True
+            self._fail_all(R53Error("ChangeTracker closed"))
+            self.cond.notify()
+
+    def _fail_all(self, error):
+        for _, _, changeid, _ in self.heap:
+            self.futures.pop(changeid).set_exception(error)
+        self.heap = []
+
+    def _next(self):
+        """return next (changeid, interval) to poll, or None to stop"""
+        with self.cond:
+            while True:
+                if self.closed or not self.heap:
+                    self.thread = None
+                    return None
+                now = time.monotonic()
+                if self.deadline is not None and now >= self.deadline:
+                    self._fail_all(R53Error("timed out waiting for INSYNC"))
+                    continue
+                polltime = self.heap[0][0]
+                if polltime <= now:
+                    _, _, changeid, interval = heapq.heappop(self.heap)
+                    return changeid, interval
+                if self.deadline is not None:
+                    polltime = min(polltime, self.deadline)
+                self.cond.wait(polltime - now)
+
+    def _run(self):
+        while True:
+            item = self._next()
+            if item is None:
+                return
+            changeid, interval = item
+            try:
+                response = self.client.get_change(Id=changeid)
+            except Exception as error:
+                with self.cond:
+                    future = self.futures.pop(changeid, None)
+                if future is not None:
+                    future.set_exception(error)
+                continue
+            change_info = response['ChangeInfo']
+            with self.cond:
+                if changeid not in self.futures:
+                    continue
+                if change_info['Status'] == 'INSYNC':
+                    future = self.futures.pop(changeid)
+                elif self.closed:
+                    # closed while polling: it won't be polled again
+                    self.futures.pop(changeid).set_exception(
+                        R53Error("ChangeTracker closed"))
+                    continue
+                else:
+                    future = None
+                    interval = min(self.maxpoll, interval * self.factor)
+                    heapq.heappush(self.heap,
+                                   (time.monotonic() + interval,
+                                    next(self.counter), changeid, interval))
+            if future is not None:
+                future.set_result(change_info)
+
+
 def create_zone(client, zonename, private=False, vpcinfo=None):
     """
     Create zone in Route53; private zones require vpc region and id;
     Returns: zoneid, NS set, caller_ref, and change_info.
     """
 
+    client = _as_client(client)
     caller_ref = get_caller_ref()
     kwargs = dict(Name=zonename, CallerReference=caller_ref)
     if private:
@@ -256,6 +2124,7 @@ def create_zone(client, zonename, private=False, vpcinfo=None):
 def change_rrsets(client, zoneid, change_batch):
     """create/delete/update RRsets in a zone"""
 
+    client = _as_client(client)
     response = client.change_resource_record_sets(
         HostedZoneId=zoneid,
         ChangeBatch=change_batch.data())
@@ -266,9 +2135,50 @@ def change_rrsets(client, zoneid, change_batch):
     return response['ChangeInfo']
 
 
+def submit_chunks(client, zoneid, chunks, progress=None):
+    """
+    Send an iterable of ChangeBatch chunks to the zone in order. The next
+    chunk is produced while the previous one is being sent, so lazily
+    generated chunks overlap with the API calls. If given, progress is
+    called with (chunk, ChangeInfo) after each chunk is sent. Returns list
+    of ChangeInfo.
+    """
+
+    client = _as_client(client)
+    change_infos = []
+
+    def finish(pending):
+        chunk, future = pending
+        change_infos.append(future.result())
+        if progress is not None:
+            progress(chunk, change_infos[-1])
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        pending = None
+        for chunk in chunks:
+            if pending is not None:
+                finish(pending)
+            pending = (chunk, executor.submit(change_rrsets, client, zoneid,
+                                              chunk))
+        if pending is not None:
+            finish(pending)
+    return change_infos
+
+
+def change_rrsets_chunked(client, zoneid, change_batch, limits=BATCH_LIMITS):
+    """
+    create/delete/update RRsets in a zone, splitting the ChangeBatch into
+    chunks that fit within Route53 batch limits; returns list of ChangeInfo.
+    """
+
+    client = _as_client(client)
+    return submit_chunks(client, zoneid, change_batch.chunks(limits))
+
+
 def get_zone(client, zoneid):
     """Get hosted zone information, given zoneid"""
 
+    client = _as_client(client)
     response = client.get_hosted_zone(Id=zoneid)
     if status(response) != 200:
         raise R53Error("get_hosted_zone() failed: {}".format(response))
@@ -281,6 +2191,7 @@ def get_associated_vpcs(client, zoneid):
     of {VPCRegion:, VPCId:} dicts.
     """
 
+    client = _as_client(client)
     response = client.get_hosted_zone(Id=zoneid)
     if status(response) != 200:
         raise R53Error("get_hosted_zone() failed: {}".format(response))
@@ -289,27 +2200,550 @@ def get_associated_vpcs(client, zoneid):
     return response['VPCs']
 
 
+def closest_parents(zonenames):
+    """
+    Return dict mapping each zone name to the name of its closest ancestor
+    zone among zonenames, or None. Ancestors are looked up in a set index,
+    one label at a time. Names are returned as normalize_name gives them.
+    """
+
+    names = {normalize_name(x) for x in zonenames}
+    parents = {}
+    for name in names:
+        parents[name] = None
+        ancestor = name
+        while ancestor != '.':
+            ancestor = ancestor.split('.', 1)[1] or '.'
+            if ancestor in names:
+                parents[name] = ancestor
+                break
+    return parents
+
+
+class ZoneProvisioner:
+    """
+    Create zones concurrently, then add each parent's delegations to its
+    child zones with one chunked ChangeBatch
+    """
+
+    def __init__(self, client, workers=8, ns_ttl=86400, limits=BATCH_LIMITS):
+        self.client = _as_client(client)
+        self.workers = workers
+        self.ns_ttl = ns_ttl
+        self.limits = limits
+        self.errors = {}
+
+    def _delegate(self, parentid, children, zones):
+        """add delegations for the children to parent zone"""
+        batch = ChangeBatch()
+        for child in children:
+            batch.create(child, 'NS', self.ns_ttl, zones[child][1])
+        return change_rrsets_chunked(self.client, parentid, batch,
+                                     self.limits)
+
+    def provision(self, zonenames):
+        """
+        Create zones and delegations; return dict mapping zone name to
+        (zoneid, NS set) for the zones that were created. Failures go in
+        errors by zone name
+        """
+
+        self.errors = {}
+        parents = closest_parents(zonenames)
+        zones = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(create_zone, self.client, name): name
+                       for name in sorted(parents, key=listing_key)}
+            for future, name in futures.items():
+                try:
+                    zones[name] = future.result()[:2]
+                except Exception as error:
+                    self.errors[name] = error
+
+            delegations = collections.defaultdict(list)
+            for child, parent in parents.items():
+                if parent in zones and child in zones:
+                    delegations[parent].append(child)
+            futures = {executor.submit(self._delegate, zones[parent][0],
+                                       sorted(children), zones): children
+                       for parent, children in delegations.items()}
+            for future, children in futures.items():
+                try:
+                    future.result()
+                except Exception as error:
+                    for child in children:
+                        self.errors[child] = R53Error(
+                            "delegation of {} failed: {}".format(child,
+                                                                 error))
+        return zones
+
+
+class ZoneTeardown:
+    """
+    Empty zones concurrently, and delete each one once its deletes are
+    INSYNC and its child zones are deleted
+    """
+
+    def __init__(self, client, workers=8, limits=BATCH_LIMITS, tracker=None,
+                 sweep_threshold=20):
+        self.client = _as_client(client)
+        self.workers = workers
+        self.limits = limits
+        self.tracker = tracker
+        self.sweep_threshold = sweep_threshold
+        self.errors = {}
+        self.missing = []
+        self.deleted = {}
+        self.lock = threading.Lock()
+
+    def _resolve(self, zonenames):
+        """return dict of zone id -> name, and dict of id -> parent ids"""
+
+        parents = closest_parents(zonenames)
+        index = ZoneIndex(self.client, ttl=3600 if len(parents) >
+                          self.sweep_threshold else None)
+        zoneids = {}
+        for zonename in parents:
+            zoneids[zonename] = index.zoneids(zonename)
+            if not zoneids[zonename]:
+                self.missing.append(zonename)
+        names = {}
+        parentids = {}
+        for zonename, parent in parents.items():
+            for zoneid in zoneids[zonename]:
+                names[zoneid] = zonename
+                parentids[zoneid] = zoneids.get(parent, [])
+        return names, parentids
+
+    def _finish(self, zoneid, error=None, change_info=None):
+        """record zone as deleted or failed; fail its ancestors too"""
+        with self.lock:
+            if zoneid in self.finished:
+                return
+            self.finished.add(zoneid)
+            if error is None:
+                self.deleted[zoneid] = change_info
+            else:
+                self.errors[zoneid] = error
+            if len(self.finished) == len(self.names):
+                self.done.set()
+        for parentid in self.parentids[zoneid]:
+            if error is None:
+                self._release(parentid)
+            else:
+                self._finish(parentid, R53Error(
+                    "child zone {} not deleted".format(self.names[zoneid])))
+
+    def _release(self, zoneid):
+        """count down what zoneid waits for; delete it when nothing is left"""
+        with self.lock:
+            self.waiting[zoneid] -= 1
+            if self.waiting[zoneid] or zoneid in self.finished:
+                return
+        self.executor.submit(self._delete, zoneid)
+
+    def _empty(self, zoneid):
+        try:
+            change_infos = empty_zone_streaming(
+                self.client, zoneid, self.names[zoneid], self.limits)
+            if not change_infos:
+                self._release(zoneid)
+                return
+            self.tracker.track(change_infos[-1], callback=lambda future:
+                               self._synced(zoneid, future))
+        except Exception as error:
+            self._finish(zoneid, error)
+
+    def _synced(self, zoneid, future):
+        if future.exception() is not None:
+            self._finish(zoneid, future.exception())
+        else:
+            self._release(zoneid)
+
+    def _delete(self, zoneid):
+        try:
+            change_info = delete_zone(self.client, zoneid)
+        except Exception as error:
+            self._finish(zoneid, error)
+        else:
+            self._finish(zoneid, change_info=change_info)
+
+    def teardown(self, zonenames):
+        """
+        Empty and delete the zones with the given names; return dict of
+        zone id -> ChangeInfo of the zone deletion, for deleted zones.
+        Failures go in errors by zone id, leaving their ancestor zones in
+        place, and names not found in missing
+        """
+
+        self.errors = {}
+        self.missing = []
+        self.deleted = {}
+        self.names, self.parentids = self._resolve(zonenames)
+        self.waiting = {x: 1 for x in self.names}
+        for parentids in self.parentids.values():
+            for parentid in parentids:
+                self.waiting[parentid] += 1
+        self.finished = set()
+        self.done = threading.Event()
+        if not self.names:
+            return self.deleted
+
+        tracker = self.tracker
+        if tracker is None:
+            self.tracker = ChangeTracker(self.client, timeout=3600)
+        self.executor = ThreadPoolExecutor(max_workers=self.workers)
+        try:
+            # deepest zones first, so that they are emptied first
+            for zoneid in sorted(self.names, key=lambda x:
+                                 -self.names[x].count('.')):
+                self.executor.submit(self._empty, zoneid)
+            self.done.wait()
+        finally:
+            self.executor.shutdown(wait=True)
+            if tracker is None:
+                self.tracker.close()
+                self.tracker = None
+        return self.deleted
+
+
+def generator_delete_changes(client, zoneid, zonename):
+    """
+    Return generator of DELETE changes for all zone RRsets except the
+    apex SOA and NS set
+    """
+
+    client = _as_client(client)
+    for rrset in generator_rrsets(client, zoneid):
+        if (rrset['Name'] == zonename) and (rrset['Type'] in ['SOA', 'NS']):
+            continue
+        yield {'Action': 'DELETE', 'ResourceRecordSet': rrset}
+
+
 def empty_zone(client, zoneid, zonename=None):
     """Delete all zone RRsets except the apex SOA and NS set"""
 
+    client = _as_client(client)
     if zonename is None:
         zonename = get_zone(client, zoneid)['Name']
 
     change_batch = ChangeBatch()
-    for rrset in generator_rrsets(client, zoneid):
-        if (rrset['Name'] == zonename) and (rrset['Type'] in ['SOA', 'NS']):
-            continue
-        change_batch.delete(rrset)
+    for change in generator_delete_changes(client, zoneid, zonename):
+        change_batch._append(change)
     if change_batch.data() is None:
         return None
     return change_rrsets(client, zoneid, change_batch)
 
 
+def empty_zone_streaming(client, zoneid, zonename=None, limits=BATCH_LIMITS):
+    """
+    Delete all zone RRsets except the apex SOA and NS set, sending delete
+    chunks while the following pages are still being listed. Memory use is
+    bounded by the chunk size. Returns list of ChangeInfo.
+    """
+
+    client = _as_client(client)
+    if zonename is None:
+        zonename = get_zone(client, zoneid)['Name']
+
+    changes = generator_delete_changes(client, zoneid, zonename)
+    return submit_chunks(client, zoneid,
+                         generator_chunks(changes, limits=limits))
+
+
+def import_zone(client, zoneid, infile, origin=None, ttl=None,
+                action='CREATE', skip_apex=True, window=1000, check=False,
+                limits=BATCH_LIMITS, progress=None):
+    """
+    Import a master (BIND zone) file object into zoneid, streaming it:
+    rrsets are read with generator_zone_rrsets and sent as chunked change
+    batches with the given action (CREATE or UPSERT) as they are read.
+    origin defaults to the zone name. With skip_apex, the apex SOA and NS
+    rrsets, which Route53 manages, are left out. window and check are
+    passed to generator_zone_rrsets, and progress to submit_chunks.
+    Returns list of ChangeInfo.
+    """
+
+    client = _as_client(client)
+    if origin is None:
+        origin = get_zone(client, zoneid)['Name']
+    apex = normalize_name(origin)
+
+    def changes():
+        for rrset in generator_zone_rrsets(infile, origin, ttl, window,
+                                           check):
+            if skip_apex and rrset['Type'] in ('SOA', 'NS') and \
+               normalize_name(rrset['Name']) == apex:
+                continue
+            yield {'Action': action, 'ResourceRecordSet': rrset}
+
+    return submit_chunks(client, zoneid, generator_chunks(changes(), limits),
+                         progress=progress)
+
+
+def plan_zone(client, zoneid, desired, zonename=None, delete=True,
+              limits=BATCH_LIMITS):
+    """
+    Return ReconcilePlan that brings the zone's rrsets, as listed by
+    generator_rrsets, to the desired rrsets
+    """
+
+    client = _as_client(client)
+    if zonename is None:
+        zonename = get_zone(client, zoneid)['Name']
+    return plan_reconcile(desired, generator_rrsets(client, zoneid),
+                          zonename=zonename, delete=delete, limits=limits)
+
+
+def apply_plan(client, zoneid, plan):
+    """Send the ChangeBatch chunks of a ReconcilePlan; return ChangeInfos"""
+
+    client = _as_client(client)
+    return submit_chunks(client, zoneid, plan.batches)
+
+
 def delete_zone(client, zoneid):
     """Delete zone identified by given zoneid; return ChangeInfo"""
 
+    client = _as_client(client)
     response = client.delete_hosted_zone(Id=zoneid)
     if status(response) != 200:
         raise R53Error("ERROR: zone delete failed: {}: {}".format(zoneid,
                                                                    response))
     return response['ChangeInfo']
+
+
+class SnapshotStore:
+    """
+    On-disk (SQLite) snapshot of zones and their rrsets, as captured by
+    generator_zones and generator_rrsets, indexed by zone, name, type and
+    rdata value, that answers lookups and listings without API calls.
+    refresh() re-lists only the zones whose ResourceRecordSetCount
+    changed, or that were marked stale, eg. by change activity seen on a
+    client the store is attached to.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS zones (
+        zoneid TEXT PRIMARY KEY,
+        name TEXT NOT NULL,
+        rrcount INTEGER,
+        captured_at REAL NOT NULL,
+        stale INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE INDEX IF NOT EXISTS zones_name ON zones (name);
+    CREATE TABLE IF NOT EXISTS rrsets (
+        zoneid TEXT NOT NULL,
+        seq INTEGER NOT NULL,
+        name TEXT NOT NULL,
+        type TEXT NOT NULL,
+        setid TEXT,
+        data TEXT NOT NULL,
+        PRIMARY KEY (zoneid, seq)
+    );
+    CREATE INDEX IF NOT EXISTS rrsets_name ON rrsets (name, type);
+    CREATE TABLE IF NOT EXISTS rdata (
+        zoneid TEXT NOT NULL,
+        seq INTEGER NOT NULL,
+        value TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS rdata_value ON rdata (value);
+    CREATE INDEX IF NOT EXISTS rdata_zone ON rdata (zoneid, seq);
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.conn:
+            self.conn.executescript(self.SCHEMA)
+
+    def close(self):
+        """close the underlying database"""
+        self.conn.close()
+
+    def _insert_page(self, zoneid, seq, rrsets):
+        rrset_rows = []
+        rdata_rows = []
+        for rrset in rrsets:
+            rrset_rows.append((zoneid, seq, rrset['Name'], rrset['Type'],
+                               rrset.get('SetIdentifier'),
+                               json.dumps(rrset)))
+            for rdata in rrset.get('ResourceRecords', []):
+                rdata_rows.append((zoneid, seq, rdata['Value']))
+            if 'AliasTarget' in rrset:
+                rdata_rows.append((zoneid, seq,
+                                   rrset['AliasTarget']['DNSName']))
+            seq += 1
+        self.conn.executemany(
+            "INSERT INTO rrsets VALUES (?, ?, ?, ?, ?, ?)", rrset_rows)
+        self.conn.executemany(
+            "INSERT INTO rdata VALUES (?, ?, ?)", rdata_rows)
+        return seq
+
+    def capture_zone(self, client, zone):
+        """
+        (Re)capture all rrsets of a zone, given a zone dict as returned by
+        generator_zones; the previous snapshot is replaced atomically
+        """
+
+        client = _as_client(client)
+        zoneid = short_zoneid(zone['Id'])
+        staging = zoneid + '#capture'
+        captured_at = time.time()
+        # pages are staged under a temporary key, so that lookups are not
+        # blocked while the zone is listed, then swapped in at the end
+        with self.lock, self.conn:
+            self._delete_rows(staging)
+        seq = 0
+        for rrsets, _ in generator_rrset_pages(client, zone['Id']):
+            with self.lock, self.conn:
+                seq = self._insert_page(staging, seq, rrsets)
+        with self.lock, self.conn:
+            self._delete_rows(zoneid)
+            for table in ('rrsets', 'rdata'):
+                self.conn.execute(
+                    "UPDATE {} SET zoneid = ? WHERE zoneid = ?".format(table),
+                    (zoneid, staging))
+            self.conn.execute(
+                "INSERT OR REPLACE INTO zones VALUES (?, ?, ?, ?, 0)",
+                (zoneid, zone['Name'], zone.get('ResourceRecordSetCount'),
+                 captured_at))
+
+    def _delete_rows(self, zoneid):
+        for table in ('rrsets', 'rdata'):
+            self.conn.execute(
+                "DELETE FROM {} WHERE zoneid = ?".format(table), (zoneid,))
+
+    def refresh(self, client, force=False, max_age=None):
+        """
+        Bring the snapshot up to date with the account: capture new zones
+        and zones whose rrset count changed, that are marked stale, or
+        whose capture is older than max_age seconds, and drop zones that
+        no longer exist. Returns list of recaptured zone ids.
+        """
+
+        client = _as_client(client)
+        with self.lock:
+            known = {row[0]: row[1:] for row in self.conn.execute(
+                "SELECT zoneid, rrcount, captured_at, stale FROM zones")}
+        now = time.time()
+        refreshed = []
+        for zone in generator_zones(client):
+            zoneid = short_zoneid(zone['Id'])
+            info = known.pop(zoneid, None)
+            if (force or info is None or info[2] or
+                    info[0] != zone.get('ResourceRecordSetCount') or
+                    (max_age is not None and now - info[1] > max_age)):
+                self.capture_zone(client, zone)
+                refreshed.append(zoneid)
+        for zoneid in known:
+            self.drop_zone(zoneid)
+        return refreshed
+
+    def drop_zone(self, zoneid):
+        """remove a zone from the snapshot"""
+        zoneid = short_zoneid(zoneid)
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM zones WHERE zoneid = ?", (zoneid,))
+            self._delete_rows(zoneid)
+
+    def mark_stale(self, zoneid):
+        """mark zone to be recaptured by the next refresh"""
+        with self.lock, self.conn:
+            self.conn.execute("UPDATE zones SET stale = 1 WHERE zoneid = ?",
+                              (short_zoneid(zoneid),))
+
+    def _on_change(self, params, **kwargs):
+        self.mark_stale(params['HostedZoneId'])
+
+    def attach(self, client):
+        """mark zones stale when rrsets are changed through client"""
+        client.meta.events.register(
+            'before-parameter-build.route53.ChangeResourceRecordSets',
+            self._on_change,
+            unique_id="r53utils-snapshot-{}".format(id(self)))
+
+    def zones(self):
+        """return list of captured zones"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT zoneid, name, rrcount, captured_at, stale "
+                "FROM zones ORDER BY name").fetchall()
+        return [{'Id': x[0], 'Name': x[1], 'ResourceRecordSetCount': x[2],
+                 'CapturedAt': x[3], 'Stale': bool(x[4])} for x in rows]
+
+    def captured_at(self, zoneid):
+        """return capture timestamp of zone, or None if not captured"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT captured_at FROM zones WHERE zoneid = ?",
+                (short_zoneid(zoneid),)).fetchone()
+        return row[0] if row else None
+
+    def get_rrset(self, zoneid, rrname, rrtype):
+        """given zoneid, get specified RRset by name and type"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT data FROM rrsets WHERE zoneid = ? AND name = ? "
+                "AND type = ? ORDER BY seq LIMIT 1",
+                (short_zoneid(zoneid), normalize_name(rrname),
+                 rrtype)).fetchone()
+        if row is None:
+            raise R53Error("RRset doesn't exist: {} {}".format(rrname, rrtype))
+        return json.loads(row[0])
+
+    def split_points(self, zoneid, partitions):
+        """
+        return (name, type, SetIdentifier) of the captured rrsets that
+        split zoneid into partitions ranges of equal size, in order
+        """
+        with self.lock:
+            count = self.conn.execute(
+                "SELECT COUNT(*) FROM rrsets WHERE zoneid = ?",
+                (short_zoneid(zoneid),)).fetchone()[0]
+            seqs = sorted({count * i // partitions
+                           for i in range(1, partitions)} - {0})
+            return self.conn.execute(
+                "SELECT name, type, setid FROM rrsets WHERE zoneid = ? "
+                "AND seq IN ({}) ORDER BY seq".format(
+                    ",".join("?" * len(seqs))),
+                [short_zoneid(zoneid)] + seqs).fetchall()
+
+    def generator_rrsets(self, zoneid):
+        """return generator over captured rrsets of zoneid, in order"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT data FROM rrsets WHERE zoneid = ? ORDER BY seq",
+                (short_zoneid(zoneid),)).fetchall()
+        for row in rows:
+            yield json.loads(row[0])
+
+    def find_rrsets(self, rrname=None, rrtype=None, value=None, zoneid=None):
+        """
+        return list of (zoneid, rrset) for captured rrsets matching all of
+        the given name, type, rdata value (or alias target) and zoneid
+        """
+
+        query = "SELECT DISTINCT r.zoneid, r.seq, r.data FROM rrsets r"
+        where = []
+        args = []
+        if value is not None:
+            query += " JOIN rdata d ON d.zoneid = r.zoneid AND d.seq = r.seq"
+            where.append("d.value = ?")
+            args.append(value)
+        if rrname is not None:
+            where.append("r.name = ?")
+            args.append(normalize_name(rrname))
+        if rrtype is not None:
+            where.append("r.type = ?")
+            args.append(rrtype)
+        if zoneid is not None:
+            where.append("r.zoneid = ?")
+            args.append(short_zoneid(zoneid))
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        query += " ORDER BY r.zoneid, r.seq"
+        with self.lock:
+            rows = self.conn.execute(query, args).fetchall()
+        return [(x[0], json.loads(x[2])) for x in rows]
@@ -0,0 +1,179 @@
+"""
+Asyncio versions of the core r53utils routines.
+
+API calls are awaited directly when the client is an aiobotocore client,
+and plain boto3 clients are driven from a small bounded thread pool. In
+both cases an AsyncClient limits how many calls are in flight at once.
+All routines can be cancelled like any other coroutine.
+"""
+
+import asyncio
+import weakref
+import functools
+import inspect
+from concurrent.futures import ThreadPoolExecutor
+from r53utils import (MAXITEMS, R53Error, status, get_caller_ref,
+                      _as_client)
+
+
+class AsyncClient:
+    """
+    Awaitable wrapper around a route53 client, with at most concurrency
+    API calls in flight at a time on each event loop it is used from.
+    """
+
+    def __init__(self, client, concurrency=16, executor=None):
+        self.client = _as_client(client)
+        self.concurrency = concurrency
+        self.native = inspect.iscoroutinefunction(
+            getattr(self.client, '_make_api_call', None))
+        self.executor = executor
+        self.semaphores = weakref.WeakKeyDictionary()
+
+    async def call(self, operation, **kwargs):
+        """call route53 API operation, eg. 'get_change'"""
+
+        # one per event loop: before Python 3.10, a semaphore is bound to
+        # the loop it was created on
+        loop = asyncio.get_running_loop()
+        semaphore = self.semaphores.get(loop)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.concurrency)
+            self.semaphores[loop] = semaphore
+        async with semaphore:
+            method = getattr(self.client, operation)
+            if self.native:
+                return await method(**kwargs)
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(
+                    max_workers=self.concurrency)
+            return await loop.run_in_executor(
+                self.executor, functools.partial(method, **kwargs))
+
+
+async def generator_zones(aclient, maxitems=MAXITEMS):
+    """return async generator over list of R53 hosted zones"""
+
+    kwargs = dict(MaxItems=maxitems)
+    while True:
+        response = await aclient.call('list_hosted_zones_by_name', **kwargs)
+        if status(response) != 200:
+            raise R53Error("list_hosted_zones_by_name() error: {}".format(
+                response))
+        for zone in response['HostedZones']:
+            yield zone
+        if response.get('IsTruncated'):
+            kwargs['DNSName'] = response['NextDNSName']
+            kwargs['HostedZoneId'] = response['NextHostedZoneId']
+        else:
+            break
+
+
+async def generator_rrsets(aclient, zoneid, maxitems=MAXITEMS):
+    """return async generator over rrsets in a given R53 zoneid"""
+
+    kwargs = dict(HostedZoneId=zoneid, MaxItems=maxitems)
+    while True:
+        response = await aclient.call('list_resource_record_sets', **kwargs)
+        if status(response) != 200:
+            raise R53Error("list_resource_record_sets() error: {}".format(
+                response))
+        for rrset in response['ResourceRecordSets']:
+            yield rrset
+        if response['IsTruncated']:
+            kwargs['StartRecordName'] = response['NextRecordName']
+            kwargs['StartRecordType'] = response['NextRecordType']
+            kwargs.pop('StartRecordIdentifier', None)
+            if 'NextRecordIdentifier' in response:
+                kwargs['StartRecordIdentifier'] = \
+                    response['NextRecordIdentifier']
+        else:
+            break
+
+
+async def get_rrset(aclient, zoneid, rrname, rrtype):
+    """given zoneid, get specified RRset by name and type"""
+
+    response = await aclient.call('list_resource_record_sets',
+                                  HostedZoneId=zoneid,
+                                  StartRecordName=rrname,
+                                  StartRecordType=rrtype,
+                                  MaxItems='1')
+    if status(response) != 200:
+        raise R53Error("list_resource_record_sets() error: {}".format(
+            response))
+
+    if response['ResourceRecordSets']:
+        rrset0 = response['ResourceRecordSets'][0]
+        if rrname == rrset0['Name'] and rrtype == rrset0['Type']:
+            return rrset0
+    raise R53Error("RRset doesn't exist: {} {}".format(rrname, rrtype))
+
+
+async def change_rrsets(aclient, zoneid, change_batch):
+    """create/delete/update RRsets in a zone"""
+
+    response = await aclient.call('change_resource_record_sets',
+                                  HostedZoneId=zoneid,
+                                  ChangeBatch=change_batch.data())
+    if status(response) != 200:
+        raise R53Error("change_rrsets() failed: {}".format(response))
+    return response['ChangeInfo']
+
+
+async def create_zone(aclient, zonename, private=False, vpcinfo=None):
+    """
+    Create zone in Route53; private zones require vpc region and id;
+    Returns: zoneid, NS set, caller_ref, and change_info.
+    """
+
+    caller_ref = get_caller_ref()
+    kwargs = dict(Name=zonename, CallerReference=caller_ref)
+    if private:
+        kwargs['HostedZoneConfig'] = {'PrivateZone': True}
+        try:
+            region, vpcid = vpcinfo
+        except ValueError as vpc_info_missing:
+            raise R53Error("VPC region and id must be specified") from vpc_info_missing
+        kwargs['VPC'] = {'VPCRegion': region, 'VPCId': vpcid}
+
+    response = await aclient.call('create_hosted_zone', **kwargs)
+    if status(response) not in [200, 201]:
+        raise R53Error("create_zone() {} failed: {}".format(zonename,
+                                                             response))
+
+    ns_set = response['DelegationSet']['NameServers'] \
+        if 'DelegationSet' in response else []
+
+    return (response['HostedZone']['Id'],
+            ns_set,
+            caller_ref,
+            response['ChangeInfo'])
+
+
+async def delete_zone(aclient, zoneid):
+    """Delete zone identified by given zoneid; return ChangeInfo"""
+
+    response = await aclient.call('delete_hosted_zone', Id=zoneid)
+    if status(response) != 200:
+        raise R53Error("ERROR: zone delete failed: {}: {}".format(zoneid,
+                                                                   response))
+    return response['ChangeInfo']
+
+
+async def wait_for_insync(aclient, changeid, polltime=5, timeout=120):
+    """
+    Given a changeid for a previously issued route53 operation, query
+    its status until it becomes in-sync, polling every 5 seconds by
+    default. Returns the ChangeInfo.
+    """
+
+    elapsed = 0
+    while True:
+        await asyncio.sleep(polltime)
+        response = await aclient.call('get_change', Id=changeid)
+        if response['ChangeInfo']['Status'] == 'INSYNC':
+            return response['ChangeInfo']
+        elapsed += polltime
+        if elapsed >= timeout:
+            raise R53Error("timed out waiting for INSYNC")
@@ -0,0 +1,80 @@
+import os
+import sys
+import json
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                'benchmarks'))
+
+import botocore.config
+from botocore.exceptions import ClientError
+
+import bench_r53utils
+import fakeroute53
+from r53utils import (ClientPool, ChangeBatch, create_zone, change_rrsets,
+                      wait_for_insync, generator_zones)
+
+
+class TestBenchmarks(unittest.TestCase):
+
+    def test_bench_r53utils(self):
+        """Test the benchmark suite runs past the batch limits."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            output = os.path.join(tmpdir, 'run.json')
+            bench_r53utils.main(['--sizes', '1500', '--zones', '10',
+                                 '--lookups', '5', '--output', output])
+            with open(output) as infile:
+                results = json.load(infile)['results']
+        benchmarks = {x['benchmark']: x for x in results}
+        self.assertIn('empty_zone_streaming', benchmarks)
+        self.assertNotIn('empty_zone', benchmarks)
+        self.assertIn('generator_zones', benchmarks)
+        # memory is traced replaying the listing, with moto left out
+        self.assertLess(benchmarks['rrsets_in_memory_compact']['peak_memory'],
+                        benchmarks['rrsets_in_memory']['peak_memory'])
+        self.assertEqual(benchmarks['generator_rrsets']['calls'],
+                         {'ListResourceRecordSets': 16})
+
+    def test_fakeroute53(self):
+        """Test the stand-in throttles, delays INSYNC and checks batches."""
+        fake = fakeroute53.FakeRoute53(port=0, rate=1, burst=1,
+                                       insync_delay=0.5)
+        fake.start()
+        try:
+            config = botocore.config.Config(
+                retries={'mode': 'standard', 'total_max_attempts': 10})
+            client = ClientPool(config=config,
+                                endpoint_url=fake.endpoint_url).get()
+
+            # back to back calls exceed the bucket, and are retried
+            for _ in range(2):
+                list(generator_zones(client))
+            stats = fake.stats()['ListHostedZonesByName']
+            self.assertGreaterEqual(stats['throttled'], 1)
+            self.assertEqual(stats[200], 2)
+
+            fake.rate = 0
+            zoneid = create_zone(client, 'fake.example.')[0]
+            batch = ChangeBatch()
+            batch.create('www.fake.example.', 'A', 300, ['192.0.2.1'])
+            changeinfo = change_rrsets(client, zoneid, batch)
+            self.assertEqual(changeinfo['Status'], 'PENDING')
+            wait_for_insync(client, changeinfo['Id'], polltime=0.3)
+            # polled PENDING at least once before INSYNC
+            self.assertGreaterEqual(fake.stats()['GetChange'][200], 2)
+
+            batch = ChangeBatch()
+            for i in range(1001):
+                batch.create('h{}.fake.example.'.format(i), 'A', 300,
+                             ['192.0.2.1'])
+            with self.assertRaises(ClientError) as context:
+                change_rrsets(client, zoneid, batch)
+            self.assertEqual(context.exception.response['Error']['Code'],
+                             'InvalidChangeBatch')
+        finally:
+            fake.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
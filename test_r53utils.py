@@ -1,14 +1,86 @@
+import io
+import os
+import sys
+import json
+import time
+import asyncio
 import unittest
+import threading
+import tempfile
+import subprocess
+from types import SimpleNamespace
 from unittest.mock import patch, MagicMock
 import boto3
 import moto
+import r53utils
 from r53utils import (
     R53Error, get_client, get_caller_ref, status, generator_zones,
     generator_rrsets, ChangeBatch, name_to_zoneid, get_rrset,
     rrset_to_text, test_dns_answer, wait_for_insync, create_zone,
-    change_rrsets, get_zone, get_associated_vpcs, empty_zone, delete_zone
+    change_rrsets, get_zone, get_associated_vpcs, empty_zone, delete_zone,
+    BatchLimits, change_rrsets_chunked, empty_zone_streaming, ZoneIndex,
+    ClientPool, RateLimiter, ChangeTracker, ZoneExporter, plan_reconcile,
+    plan_zone, apply_plan, SnapshotStore, RRsetCache, get_rrsets, listing_key,
+    Metrics, prometheus_text, json_text, RRset, write_rrsets, export_zone,
+    generator_zone_rrsets, import_zone, closest_parents, ZoneProvisioner,
+    ZoneTeardown, Checkpoint, generator_rrsets_partitioned
 )
 
+
+def rrset_pages(count, pagesize=100):
+    """Return list of list_resource_record_sets responses for count rrsets"""
+    rrsets = [{'Name': 'h{:06d}.example.com.'.format(i), 'Type': 'A',
+               'TTL': 300, 'ResourceRecords': [{'Value': '192.0.2.1'}]}
+              for i in range(count)]
+    responses = []
+    for i in range(0, count, pagesize):
+        response = {'ResourceRecordSets': rrsets[i:i+pagesize],
+                    'IsTruncated': i + pagesize < count,
+                    'ResponseMetadata': {'HTTPStatusCode': 200}}
+        if response['IsTruncated']:
+            response['NextRecordName'] = rrsets[i+pagesize]['Name']
+            response['NextRecordType'] = 'A'
+        responses.append(response)
+    return responses
+
+
+class SortedZoneClient:
+    """Fake client listing rrsets from a zone in Route53 listing order"""
+
+    def __init__(self, rrsets, latency=0):
+        self.rrsets = sorted(rrsets,
+                             key=lambda x: listing_key(x['Name'], x['Type']))
+        self.latency = latency
+        self.calls = 0
+
+    def get_hosted_zone(self, Id):
+        return {'HostedZone': {'Id': Id, 'Name': 'example.com.',
+                               'ResourceRecordSetCount': len(self.rrsets)},
+                'ResponseMetadata': {'HTTPStatusCode': 200}}
+
+    def list_resource_record_sets(self, HostedZoneId, MaxItems,
+                                  StartRecordName=None, StartRecordType=''):
+        self.calls += 1
+        time.sleep(self.latency)
+        index = 0
+        if StartRecordName is not None:
+            start = listing_key(StartRecordName, StartRecordType)
+            while (index < len(self.rrsets) and
+                   listing_key(self.rrsets[index]['Name'],
+                               self.rrsets[index]['Type']) < start):
+                index += 1
+        page = self.rrsets[index:index + int(MaxItems)]
+        response = {'ResourceRecordSets': page,
+                    'IsTruncated': index + int(MaxItems) < len(self.rrsets),
+                    'ResponseMetadata': {'HTTPStatusCode': 200}}
+        if response['IsTruncated']:
+            response['NextRecordName'] = self.rrsets[index + int(MaxItems)][
+                'Name']
+            response['NextRecordType'] = self.rrsets[index + int(MaxItems)][
+                'Type']
+        return response
+
+
 class TestR53Utils(unittest.TestCase):
     def setUp(self):
         """Set up test fixtures before each test method."""
@@ -22,6 +94,8 @@ class TestR53Utils(unittest.TestCase):
 
     def test_get_client(self):
         """Test get_client function."""
+        r53utils.client_pool.clear()
+
         # Test without credentials
         with patch('boto3.client') as mock_boto3:
             get_client()
@@ -43,6 +117,154 @@ class TestR53Utils(unittest.TestCase):
                 aws_session_token=creds['SessionToken']
             )
 
+    def test_lazy_sdk_import(self):
+        """Test offline helpers don't import boto3/botocore."""
+        code = ("import sys, r53utils\n"
+                "batch = r53utils.ChangeBatch()\n"
+                "batch.create('www.example.com.', 'A', 300, ['192.0.2.1'])\n"
+                "list(batch.chunks())\n"
+                "r53utils.rrset_to_text("
+                "batch.data()['Changes'][0]['ResourceRecordSet'])\n"
+                "assert 'boto3' not in sys.modules\n"
+                "assert 'botocore' not in sys.modules\n"
+                "assert r53utils.botoconfig.retries['mode'] == 'standard'\n"
+                "assert 'botocore' in sys.modules\n")
+        subprocess.run([sys.executable, '-c', code], check=True,
+                       cwd=os.path.dirname(os.path.abspath(__file__)))
+
+    def test_client_pool(self):
+        """Test ClientPool reuses clients per credentials."""
+        pool = ClientPool(max_pool_connections=50, tcp_keepalive=False)
+        self.assertEqual(pool.config.max_pool_connections, 50)
+        self.assertEqual(pool.config.retries['total_max_attempts'], 3)
+        creds = {
+            'AccessKeyId': 'test-key',
+            'SecretAccessKey': 'test-secret',
+            'SessionToken': 'test-token'
+        }
+        with patch('boto3.client') as mock_boto3:
+            mock_boto3.side_effect = lambda *args, **kwargs: MagicMock()
+            client1 = get_client(pool=pool)
+            self.assertIs(get_client(pool=pool), client1)
+            client2 = pool.get(creds)
+            self.assertIsNot(client2, client1)
+            self.assertIs(pool.get(creds), client2)
+            self.assertEqual(mock_boto3.call_count, 2)
+            pool.clear()
+            self.assertIsNot(get_client(pool=pool), client1)
+
+        # least recently used clients are evicted, or can be discarded
+        pool = ClientPool(maxclients=2)
+        tokens = [dict(creds, SessionToken='token{}'.format(i))
+                  for i in range(3)]
+        with patch('boto3.client') as mock_boto3:
+            mock_boto3.side_effect = lambda *args, **kwargs: MagicMock()
+            client0 = pool.get(tokens[0])
+            pool.get(tokens[1])
+            self.assertIs(pool.get(tokens[0]), client0)
+            pool.get(tokens[2])
+            self.assertEqual(len(pool.clients), 2)
+            self.assertIs(pool.get(tokens[0]), client0)
+            self.assertEqual(mock_boto3.call_count, 3)
+            pool.discard(tokens[0])
+            self.assertIsNot(pool.get(tokens[0]), client0)
+
+        # clients for other endpoints are pooled separately
+        with patch('boto3.client') as mock_boto3:
+            get_client(pool=pool, endpoint_url='http://127.0.0.1:8053')
+            mock_boto3.assert_called_once_with(
+                'route53', config=unittest.mock.ANY,
+                endpoint_url='http://127.0.0.1:8053')
+
+        # helpers accept the pool in place of a client
+        pool.clients[(None, None)] = self.mock_client
+        self.mock_client.get_hosted_zone.return_value = {
+            'HostedZone': {'Id': self.zone_id, 'Name': self.zone_name},
+            'ResponseMetadata': {'HTTPStatusCode': 200}
+        }
+        self.assertEqual(get_zone(pool, self.zone_id)['Id'], self.zone_id)
+
+    def test_rate_limiter(self):
+        """Test RateLimiter token bucket and rate adaptation."""
+        limiter = RateLimiter(rate=10, burst=2, increase=1)
+        with patch('time.sleep') as mock_sleep:
+            limiter.acquire()
+            limiter.acquire()
+            mock_sleep.assert_not_called()
+            limiter.acquire()
+            mock_sleep.assert_called_once()
+            self.assertAlmostEqual(mock_sleep.call_args[0][0], 0.1, places=2)
+        self.assertEqual(limiter.queue_depth, 0)
+        self.assertEqual(limiter.requests, 3)
+
+        throttled = (None, {'Error': {'Code': 'Throttling'}})
+        limiter._needs_retry(response=throttled)
+        self.assertEqual(limiter.rate, 5)
+        # throttles arriving together are one signal
+        limiter._needs_retry(response=throttled)
+        self.assertEqual(limiter.rate, 5)
+        self.assertEqual(limiter.throttles, 2)
+        limiter._needs_retry(response=(None, {'ResponseMetadata': {}}))
+        self.assertEqual(limiter.rate, 6)
+        for _ in range(10):
+            limiter.on_success()
+        self.assertEqual(limiter.rate, 10)
+
+        limiter = RateLimiter(rate=0.5, burst=2)
+        self.assertTrue(limiter.try_acquire())
+        self.assertTrue(limiter.try_acquire())
+        self.assertFalse(limiter.try_acquire())
+        self.assertEqual(limiter.requests, 2)
+
+    @moto.mock_aws
+    def test_rate_limiter_attached(self):
+        """Test RateLimiter attached to pooled clients."""
+        pool = ClientPool()
+        limiter = RateLimiter(rate=1000)
+        pool.attach(limiter)
+        client = get_client(pool=pool)
+        zoneid = create_zone(client, self.zone_name)[0]
+        list(generator_rrsets(client, zoneid))
+        self.assertEqual(limiter.requests, 2)
+        # successful responses are seen by the limiter too
+        limiter._rate = 500
+        get_zone(client, zoneid)
+        self.assertGreater(limiter.rate, 500)
+
+    @moto.mock_aws
+    def test_metrics(self):
+        """Test Metrics instrumentation of pooled clients."""
+        pool = ClientPool()
+        metrics = Metrics()
+        pool.attach(metrics)
+        client = get_client(pool=pool)
+        zoneid = create_zone(client, self.zone_name)[0]
+        list(generator_rrsets(client, zoneid))
+        with self.assertRaises(Exception):
+            get_zone(client, '/hostedzone/ZNOSUCHZONE')
+        metrics._needs_retry(
+            response=(None, {'Error': {'Code': 'Throttling'}}),
+            operation=SimpleNamespace(name='GetHostedZone'))
+
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot['CreateHostedZone']['calls'], 1)
+        listing = snapshot['ListResourceRecordSets']
+        self.assertEqual((listing['calls'], listing['pages'],
+                          listing['items']), (1, 1, 2))
+        self.assertEqual(listing['items_per_page'], 2.0)
+        self.assertEqual(listing['latency_buckets'][-1], (float('inf'), 1))
+        self.assertEqual(snapshot['GetHostedZone']['errors'], 1)
+        self.assertEqual(snapshot['GetHostedZone']['throttles'], 1)
+
+        text = metrics.export(prometheus_text)
+        self.assertIn('r53utils_calls_total{operation="CreateHostedZone"} 1',
+                      text)
+        self.assertIn('r53utils_latency_seconds_bucket{operation='
+                      '"ListResourceRecordSets",le="+Inf"} 1', text)
+        self.assertIn('"ListResourceRecordSets"', metrics.export(json_text))
+        metrics.reset()
+        self.assertEqual(metrics.snapshot(), {})
+
     def test_get_caller_ref(self):
         """Test get_caller_ref function."""
         ref = get_caller_ref()
@@ -95,6 +317,186 @@ class TestR53Utils(unittest.TestCase):
         self.assertEqual(rrsets[0]['Name'], self.rr_name)
         self.assertEqual(rrsets[0]['Type'], self.rr_type)
 
+    def test_generator_rrsets_pages(self):
+        """Test generator_rrsets pagination, with and without prefetch."""
+        responses = rrset_pages(250)
+        responses[0]['NextRecordIdentifier'] = 'set1'
+        for prefetch in (0, 2):
+            self.mock_client.list_resource_record_sets.reset_mock()
+            self.mock_client.list_resource_record_sets.side_effect = responses
+            rrsets = list(generator_rrsets(self.mock_client, self.zone_id,
+                                           prefetch=prefetch))
+            self.assertEqual(len(rrsets), 250)
+            self.assertEqual(rrsets[-1]['Name'], 'h000249.example.com.')
+            calls = self.mock_client.list_resource_record_sets.call_args_list
+            self.assertEqual(calls[1][1]['StartRecordName'],
+                             'h000100.example.com.')
+            self.assertEqual(calls[1][1]['StartRecordIdentifier'], 'set1')
+            self.assertNotIn('StartRecordIdentifier', calls[2][1])
+
+    def test_compact_rrsets(self):
+        """Test compact RRset objects and their conversion to dicts."""
+        self.mock_client.list_resource_record_sets.side_effect = \
+            rrset_pages(250)
+        rrsets = list(generator_rrsets(self.mock_client, self.zone_id,
+                                       compact=True))
+        self.assertEqual(len(rrsets), 250)
+        self.assertIsInstance(rrsets[0], RRset)
+        self.assertEqual(rrsets[0].values, ('192.0.2.1',))
+        self.assertIs(rrsets[0].values[0], rrsets[1].values[0])
+        self.assertEqual(rrsets[0].to_dict(), rrset_pages(1)[0]
+                         ['ResourceRecordSets'][0])
+        self.assertEqual(rrset_to_text(rrsets[0]),
+                         "h000000.example.com. 300 IN A 192.0.2.1")
+
+        alias = {'Name': 'www.example.com.', 'Type': 'A',
+                 'SetIdentifier': 'east', 'Region': 'us-east-1',
+                 'AliasTarget': {'HostedZoneId': 'Z2', 'DNSName': 'lb.',
+                                 'EvaluateTargetHealth': False}}
+        compact = RRset.from_dict(alias)
+        self.assertEqual(compact.to_dict(), alias)
+        self.assertEqual(compact['SetIdentifier'], 'east')
+        self.assertIsNone(compact.get('TTL'))
+        with self.assertRaises(KeyError):
+            compact['ResourceRecords']
+
+        # compact rrsets go straight into changes
+        batch = ChangeBatch()
+        batch.delete(rrsets[0])
+        batch.delete(compact)
+        self.assertEqual(batch.data()['Changes'][1]['ResourceRecordSet'],
+                         alias)
+        self.assertEqual(batch.num_values, 1)
+
+    def test_generator_rrsets_cursor(self):
+        """Test resuming generator_rrsets from a cursor."""
+        for prefetch in (0, 2):
+            responses = rrset_pages(250)
+            self.mock_client.list_resource_record_sets.side_effect = \
+                responses[:1] + [R53Error("throttled")]
+            cursors = []
+            rrsets = []
+            with self.assertRaises(R53Error):
+                for rrset in generator_rrsets(self.mock_client, self.zone_id,
+                                              prefetch=prefetch,
+                                              on_cursor=cursors.append):
+                    rrsets.append(rrset)
+            self.assertEqual(cursors, [{'StartRecordName':
+                                        'h000100.example.com.',
+                                        'StartRecordType': 'A'}])
+            cursor = json.loads(json.dumps(cursors[-1]))
+            self.mock_client.list_resource_record_sets.side_effect = \
+                responses[1:]
+            rrsets += generator_rrsets(self.mock_client, self.zone_id,
+                                       prefetch=prefetch, cursor=cursor,
+                                       on_cursor=cursors.append)
+            self.assertEqual([x['Name'] for x in rrsets],
+                             ['h{:06d}.example.com.'.format(i)
+                              for i in range(250)])
+            call = self.mock_client.list_resource_record_sets.call_args
+            self.assertEqual(call[1]['StartRecordName'],
+                             'h000200.example.com.')
+            self.assertEqual(cursors[-1], {})
+            self.assertEqual(list(generator_rrsets(
+                self.mock_client, self.zone_id, cursor={})), [])
+
+    def test_generator_zones_cursor(self):
+        """Test resuming generator_zones from a cursor."""
+        self.mock_client.list_hosted_zones_by_name.side_effect = [
+            {'HostedZones': [{'Id': 'Z1', 'Name': 'a.example.'}],
+             'IsTruncated': True, 'NextDNSName': 'b.example.',
+             'NextHostedZoneId': 'Z2',
+             'ResponseMetadata': {'HTTPStatusCode': 200}},
+            {'HostedZones': [{'Id': 'Z2', 'Name': 'b.example.'}],
+             'IsTruncated': False,
+             'ResponseMetadata': {'HTTPStatusCode': 200}},
+        ]
+        cursors = []
+        zones = generator_zones(self.mock_client, on_cursor=cursors.append)
+        self.assertEqual(next(zones)['Id'], 'Z1')
+        self.assertEqual(cursors, [])
+        zones.close()
+        zones = list(generator_zones(self.mock_client, cursor={
+            'DNSName': 'b.example.', 'HostedZoneId': 'Z2'},
+                                     on_cursor=cursors.append))
+        self.assertEqual([x['Id'] for x in zones], ['Z2'])
+        self.assertEqual(cursors, [{}])
+        call = self.mock_client.list_hosted_zones_by_name.call_args
+        self.assertEqual(call[1]['HostedZoneId'], 'Z2')
+
+    def test_checkpoint(self):
+        """Test Checkpoint saves cursors to a file and resumes exports."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'checkpoint.json')
+            outpath = os.path.join(tmpdir, 'zone.ndjson')
+            checkpoint = Checkpoint(path)
+            self.assertIsNone(checkpoint.cursor(self.zone_id))
+            self.mock_client.list_resource_record_sets.side_effect = \
+                rrset_pages(250)[:2] + [R53Error("throttled")]
+            with open(outpath, 'w') as outfile:
+                with self.assertRaises(R53Error):
+                    export_zone(self.mock_client, self.zone_id, outfile,
+                                'ndjson',
+                                on_cursor=checkpoint.callback(self.zone_id))
+
+            checkpoint = Checkpoint(path)
+            self.assertEqual(checkpoint.cursor(self.zone_id)
+                             ['StartRecordName'], 'h000200.example.com.')
+            self.assertFalse(checkpoint.done(self.zone_id))
+            self.mock_client.list_resource_record_sets.side_effect = \
+                rrset_pages(250)[2:]
+            with open(outpath, 'a') as outfile:
+                export_zone(self.mock_client, self.zone_id, outfile,
+                            'ndjson', cursor=checkpoint.cursor(self.zone_id),
+                            on_cursor=checkpoint.callback(self.zone_id))
+            with open(outpath) as infile:
+                self.assertEqual(len(infile.readlines()), 250)
+            self.assertTrue(Checkpoint(path).done(self.zone_id))
+            self.assertEqual(sorted(os.listdir(tmpdir)),
+                             ['checkpoint.json', 'zone.ndjson'])
+
+    def test_generator_prefetch_error(self):
+        """Test errors from the prefetch worker reach the caller."""
+        self.mock_client.list_resource_record_sets.side_effect = \
+            rrset_pages(250)[:1] + [R53Error("listing failed")]
+        rrsets = generator_rrsets(self.mock_client, self.zone_id, prefetch=2)
+        self.assertEqual(len([next(rrsets) for _ in range(100)]), 100)
+        with self.assertRaises(R53Error):
+            next(rrsets)
+
+    def test_zone_exporter(self):
+        """Test ZoneExporter across zones, with a resumed failure."""
+        pages = {'Z1': rrset_pages(250), 'Z2': rrset_pages(120)}
+        failed = []
+
+        def list_rrsets(HostedZoneId, MaxItems, StartRecordName=None,
+                        StartRecordType=None):
+            index = 0
+            if StartRecordName is not None:
+                index = int(StartRecordName[1:7]) // 100
+            if HostedZoneId == 'Z1' and index == 2 and not failed:
+                failed.append(index)
+                raise R53Error("Throttling")
+            return pages[HostedZoneId][index]
+
+        self.mock_client.list_resource_record_sets.side_effect = list_rrsets
+        zones = [{'Id': 'Z1', 'Name': 'one.'}, {'Id': 'Z2', 'Name': 'two.'},
+                 {'Id': 'Z3', 'Name': 'three.'}]
+        exporter = ZoneExporter(self.mock_client, workers=2)
+        with patch('time.sleep'):
+            results = list(exporter.export(zones))
+        self.assertEqual(failed, [2])
+        for zoneid, count in (('Z1', 250), ('Z2', 120)):
+            names = [rrset['Name'] for zone, rrset in results
+                     if zone['Id'] == zoneid]
+            self.assertEqual(len(names), count)
+            self.assertEqual(names, sorted(names))
+        self.assertEqual(list(exporter.errors), ['Z3'])
+        # errors of an earlier export don't carry over
+        with patch('time.sleep'):
+            list(exporter.export(zones[:2]))
+        self.assertEqual(exporter.errors, {})
+
     def test_change_batch(self):
         """Test ChangeBatch class."""
         batch = ChangeBatch()
@@ -122,6 +524,121 @@ class TestR53Utils(unittest.TestCase):
         self.assertEqual(len(batch.datadict['Changes']), 1)
         self.assertEqual(batch.datadict['Changes'][0]['Action'], 'DELETE')
 
+    def test_change_batch_chunks(self):
+        """Test ChangeBatch size tracking and chunking."""
+        batch = ChangeBatch()
+        for i in range(2500):
+            batch.create('h{}.example.com.'.format(i), 'A', 300, ['192.0.2.1'])
+        self.assertEqual(batch.num_values, 2500)
+        self.assertEqual(batch.num_chars, 2500 * len('192.0.2.1'))
+        chunks = list(batch.chunks())
+        self.assertEqual([len(x) for x in chunks], [1000, 1000, 500])
+
+        # UPSERT counts twice against the values and characters limits
+        batch.reset()
+        batch.upsert(self.rr_name, 'TXT', self.ttl, ['"abcd"'] * 3)
+        self.assertEqual(batch.num_values, 6)
+        self.assertEqual(batch.num_chars, 36)
+
+        # character limit
+        batch.reset()
+        for i in range(5):
+            batch.create('t{}.example.com.'.format(i), 'TXT', 300, ['x' * 10])
+        limits = BatchLimits(changes=1000, values=1000, chars=25)
+        self.assertEqual([len(x) for x in batch.chunks(limits)], [2, 2, 1])
+
+        # a single change larger than the limits
+        batch.reset()
+        batch.create(self.rr_name, 'TXT', 300, ['x' * 30])
+        with self.assertRaises(R53Error):
+            list(batch.chunks(limits))
+
+    def test_change_rrsets_chunked(self):
+        """Test change_rrsets_chunked function."""
+        self.mock_client.change_resource_record_sets.side_effect = [
+            {'ChangeInfo': {'Id': 'c{}'.format(i), 'Status': 'PENDING'},
+             'ResponseMetadata': {'HTTPStatusCode': 200}} for i in range(3)
+        ]
+        batch = ChangeBatch()
+        for i in range(2001):
+            batch.create('h{}.example.com.'.format(i), 'A', 300, ['192.0.2.1'])
+        change_infos = change_rrsets_chunked(self.mock_client, self.zone_id,
+                                             batch)
+        self.assertEqual([x['Id'] for x in change_infos], ['c0', 'c1', 'c2'])
+        calls = self.mock_client.change_resource_record_sets.call_args_list
+        self.assertEqual([len(x[1]['ChangeBatch']['Changes']) for x in calls],
+                         [1000, 1000, 1])
+
+    def test_generator_zone_rrsets(self):
+        """Test reading rrsets from a master file."""
+        zonefile = io.StringIO(
+            "$TTL 1h\n"
+            "$ORIGIN example.com.\n"
+            "@   IN SOA ns1 hostmaster (\n"
+            "        2024010101 ; serial\n"
+            "        1h 15m 1w 1d )\n"
+            "    IN NS ns1\n"
+            "    IN NS ns2.example.net.\n"
+            "www 300 IN A 192.0.2.1\n"
+            "mail IN 1d MX 10 mx\n"
+            "www A 192.0.2.2 ; same rrset, smaller TTL wins\n"
+            "txt TXT \"v=spf1 -all; x\" \"(a)\"\n"
+            "$ORIGIN sub\n"
+            "*  CNAME www.example.com.\n")
+        rrsets = list(generator_zone_rrsets(zonefile))
+        self.assertEqual([(x['Name'], x['Type'], x['TTL']) for x in rrsets], [
+            ('example.com.', 'SOA', 3600), ('example.com.', 'NS', 3600),
+            ('www.example.com.', 'A', 300), ('mail.example.com.', 'MX', 86400),
+            ('txt.example.com.', 'TXT', 3600),
+            ('*.sub.example.com.', 'CNAME', 3600)])
+        values = [[y['Value'] for y in x['ResourceRecords']] for x in rrsets]
+        self.assertEqual(values[0], ['ns1.example.com. hostmaster.example.com. '
+                                     '2024010101 3600 900 604800 86400'])
+        self.assertEqual(values[1], ['ns1.example.com.', 'ns2.example.net.'])
+        self.assertEqual(values[2], ['192.0.2.1', '192.0.2.2'])
+        self.assertEqual(values[3], ['10 mx.example.com.'])
+        self.assertEqual(values[4], ['"v=spf1 -all; x" "(a)"'])
+
+        # rrsets split beyond the grouping window are an error with check
+        zonefile = io.StringIO("a 300 A 192.0.2.1\nb 300 A 192.0.2.1\n"
+                               "a 300 A 192.0.2.2\n")
+        with self.assertRaises(R53Error):
+            list(generator_zone_rrsets(zonefile, 'example.com', window=1,
+                                       check=True))
+        zonefile.seek(0)
+        self.assertEqual(len(list(generator_zone_rrsets(
+            zonefile, 'example.com', window=1))), 3)
+        zonefile.seek(0)
+        self.assertEqual(len(list(generator_zone_rrsets(
+            zonefile, 'example.com', window=2))), 2)
+        with self.assertRaises(R53Error):
+            list(generator_zone_rrsets(io.StringIO("a A 192.0.2.1\n"),
+                                       'example.com'))
+
+    def test_import_zone(self):
+        """Test importing a master file as chunked change batches."""
+        self.mock_client.change_resource_record_sets.side_effect = [
+            {'ChangeInfo': {'Id': 'c{}'.format(i), 'Status': 'PENDING'},
+             'ResponseMetadata': {'HTTPStatusCode': 200}} for i in range(2)
+        ]
+        zonefile = io.StringIO(
+            "$TTL 300\n"
+            "@ SOA ns1 hostmaster 1 2 3 4 5\n"
+            "  NS ns1\n" +
+            "".join("h{} A 192.0.2.1\n".format(i) for i in range(1500)))
+        progress = []
+        change_infos = import_zone(
+            self.mock_client, self.zone_id, zonefile, origin=self.zone_name,
+            progress=lambda chunk, info: progress.append((len(chunk),
+                                                          info['Id'])))
+        self.assertEqual(len(change_infos), 2)
+        self.assertEqual(progress, [(1000, 'c0'), (500, 'c1')])
+        changes = self.mock_client.change_resource_record_sets.call_args_list[
+            0][1]['ChangeBatch']['Changes']
+        self.assertEqual(changes[0]['Action'], 'CREATE')
+        self.assertEqual(changes[0]['ResourceRecordSet']['Name'],
+                         'h0.{}'.format(self.zone_name))
+
     def test_name_to_zoneid(self):
         """Test name_to_zoneid function."""
         mock_response = {
@@ -136,6 +653,73 @@ class TestR53Utils(unittest.TestCase):
         zone_id = name_to_zoneid(self.mock_client, self.zone_name)
         self.assertEqual(zone_id, self.zone_id)
 
+    def test_zone_index_seek(self):
+        """Test ZoneIndex lookups that seek to the zone name."""
+        self.mock_client.list_hosted_zones_by_name.return_value = {
+            'HostedZones': [
+                {'Id': '/hostedzone/Z1', 'Name': self.zone_name},
+                {'Id': '/hostedzone/Z2', 'Name': self.zone_name},
+                {'Id': '/hostedzone/Z3', 'Name': 'example.net.'},
+            ],
+            'IsTruncated': True,
+            'NextDNSName': 'example.org.',
+            'NextHostedZoneId': 'Z4',
+            'ResponseMetadata': {'HTTPStatusCode': 200}
+        }
+        index = ZoneIndex(self.mock_client)
+        self.assertEqual(index.zoneids(self.zone_name),
+                         ['/hostedzone/Z1', '/hostedzone/Z2'])
+        self.mock_client.list_hosted_zones_by_name.assert_called_once_with(
+            DNSName=self.zone_name, MaxItems='100')
+        with self.assertRaises(R53Error):
+            index.zoneid(self.zone_name)
+
+    def test_zone_index_cached(self):
+        """Test ZoneIndex lookups answered from the account-wide map."""
+        self.mock_client.list_hosted_zones_by_name.return_value = {
+            'HostedZones': [
+                {'Id': '/hostedzone/Z1', 'Name': self.zone_name},
+                {'Id': '/hostedzone/Z3', 'Name': 'example.net.'},
+            ],
+            'IsTruncated': False,
+            'ResponseMetadata': {'HTTPStatusCode': 200}
+        }
+        index = ZoneIndex(self.mock_client, ttl=300)
+        self.assertEqual(index.zoneid(self.zone_name), '/hostedzone/Z1')
+        self.assertEqual(index.zoneid('example.net.'), '/hostedzone/Z3')
+        with self.assertRaises(R53Error):
+            index.zoneid('example.org.')
+        self.assertEqual(self.mock_client.list_hosted_zones_by_name.call_count,
+                         1)
+
+        # invalidated names are looked up again
+        self.mock_client.list_hosted_zones_by_name.return_value = {
+            'HostedZones': [
+                {'Id': '/hostedzone/Z3', 'Name': 'example.net.'},
+            ],
+            'IsTruncated': False,
+            'ResponseMetadata': {'HTTPStatusCode': 200}
+        }
+        index.invalidate('example.net.')
+        self.assertEqual(index.zoneid('example.net.'), '/hostedzone/Z3')
+        self.assertEqual(self.mock_client.list_hosted_zones_by_name.call_count,
+                         2)
+        index.invalidate()
+        index.zoneid('example.net.')
+        self.assertEqual(self.mock_client.list_hosted_zones_by_name.call_count,
+                         3)
+
+        # invalidating the map while a lookup refreshes it is safe
+        refresh = index.refresh
+
+        def racing_refresh():
+            zonemap = refresh()
+            index.invalidate()
+            return zonemap
+        index.invalidate()
+        with patch.object(index, 'refresh', racing_refresh):
+            self.assertEqual(index.zoneid('example.net.'), '/hostedzone/Z3')
+
     def test_get_rrset(self):
         """Test get_rrset function."""
         mock_response = {
@@ -155,6 +739,251 @@ class TestR53Utils(unittest.TestCase):
         self.assertEqual(rrset['Name'], self.rr_name)
         self.assertEqual(rrset['Type'], self.rr_type)
 
+    def test_get_rrset_cached(self):
+        """Test get_rrset through an RRsetCache."""
+        self.mock_client.list_resource_record_sets.return_value = {
+            'ResourceRecordSets': [
+                {
+                    'Name': self.rr_name,
+                    'Type': self.rr_type,
+                    'TTL': self.ttl,
+                    'ResourceRecords': [{'Value': self.rdata[0]}]
+                }
+            ],
+            'ResponseMetadata': {'HTTPStatusCode': 200}
+        }
+        cache = RRsetCache(maxsize=2, ttl=60)
+        for _ in range(3):
+            rrset = get_rrset(self.mock_client, self.zone_id, self.rr_name,
+                              self.rr_type, cache=cache)
+            self.assertEqual(rrset['Name'], self.rr_name)
+        # misses are cached too
+        for _ in range(2):
+            with self.assertRaises(R53Error):
+                get_rrset(self.mock_client, self.zone_id, self.rr_name,
+                          'AAAA', cache=cache)
+        self.assertEqual(self.mock_client.list_resource_record_sets.call_count,
+                         2)
+        self.assertEqual(cache.stats(), {'hits': 3, 'misses': 2, 'size': 2})
+
+        # least recently used entry is evicted
+        with self.assertRaises(R53Error):
+            get_rrset(self.mock_client, self.zone_id, 'x.example.com.', 'A',
+                      cache=cache)
+        get_rrset(self.mock_client, self.zone_id, self.rr_name,
+                  self.rr_type, cache=cache)
+        self.assertEqual(self.mock_client.list_resource_record_sets.call_count,
+                         4)
+        cache.invalidate('Z1234567890')
+        self.assertEqual(cache.stats()['size'], 0)
+
+    @moto.mock_aws
+    def test_rrset_cache_invalidation(self):
+        """Test RRsetCache entries are dropped on writes via the client."""
+        client = ClientPool().get()
+        zoneid = create_zone(client, self.zone_name)[0]
+        cache = RRsetCache()
+        with self.assertRaises(R53Error):
+            get_rrset(client, zoneid, self.rr_name, self.rr_type, cache=cache)
+        batch = ChangeBatch()
+        batch.create(self.rr_name, self.rr_type, self.ttl, self.rdata)
+        change_rrsets(client, zoneid, batch)
+        rrset = get_rrset(client, zoneid, self.rr_name, self.rr_type,
+                          cache=cache)
+        self.assertEqual(rrset['ResourceRecords'], [{'Value': '192.0.2.1'}])
+        empty_zone(client, zoneid, self.zone_name)
+        with self.assertRaises(R53Error):
+            get_rrset(client, zoneid, self.rr_name, self.rr_type, cache=cache)
+        self.assertEqual(cache.stats()['hits'], 0)
+
+    def test_closest_parents(self):
+        """Test closest_parents finds the nearest ancestor zone."""
+        self.assertEqual(closest_parents(
+            ['example.com', 'a.b.c.example.com.', 'c.example.com',
+             'Other.example.COM', 'example.org']), {
+                 'example.com.': None, 'a.b.c.example.com.': 'c.example.com.',
+                 'c.example.com.': 'example.com.',
+                 'other.example.com.': 'example.com.', 'example.org.': None})
+
+    @moto.mock_aws
+    def test_zone_provisioner(self):
+        """Test ZoneProvisioner creates zones and grouped delegations."""
+        pool = ClientPool()
+        metrics = Metrics()
+        pool.attach(metrics)
+        client = get_client(pool=pool)
+        names = ['example.com.'] + \
+            ['c{}.example.com.'.format(i) for i in range(20)] + \
+            ['g{}.c0.example.com.'.format(i) for i in range(5)]
+        provisioner = ZoneProvisioner(client, workers=4)
+        zones = provisioner.provision(names)
+        self.assertEqual(provisioner.errors, {})
+        self.assertEqual(set(zones), set(names))
+
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot['CreateHostedZone']['calls'], 26)
+        self.assertEqual(snapshot['ChangeResourceRecordSets']['calls'], 2)
+        rrset = get_rrset(client, zones['c0.example.com.'][0],
+                          'g3.c0.example.com.', 'NS')
+        self.assertEqual([x['Value'] for x in rrset['ResourceRecords']],
+                         zones['g3.c0.example.com.'][1])
+
+    @moto.mock_aws
+    def test_zone_teardown(self):
+        """Test ZoneTeardown empties and deletes zones, children first."""
+        client = ClientPool().get()
+        names = ['example.com.', 'c0.example.com.', 'c1.example.com.',
+                 'g0.c0.example.com.']
+        zones = ZoneProvisioner(client).provision(names)
+        batch = ChangeBatch()
+        for i in range(1200):
+            batch.create('h{}.c1.example.com.'.format(i), 'A', 300,
+                         ['192.0.2.1'])
+        change_rrsets_chunked(client, zones['c1.example.com.'][0], batch)
+
+        order = []
+        original = r53utils.delete_zone
+
+        def delete_zone_logged(client, zoneid):
+            order.append(zoneid)
+            return original(client, zoneid)
+
+        tracker = ChangeTracker(client, initial=0.01)
+        teardown = ZoneTeardown(client, workers=4, tracker=tracker)
+        with patch('r53utils.delete_zone', side_effect=delete_zone_logged):
+            deleted = teardown.teardown(names + ['nosuch.example.com'])
+        self.assertEqual(teardown.errors, {})
+        self.assertEqual(teardown.missing, ['nosuch.example.com.'])
+        self.assertEqual(set(deleted), {zones[x][0] for x in names})
+        self.assertLess(order.index(zones['g0.c0.example.com.'][0]),
+                        order.index(zones['c0.example.com.'][0]))
+        self.assertEqual(order[-1], zones['example.com.'][0])
+        self.assertEqual(list(generator_zones(client)), [])
+
+        # zones whose children fail are left in place
+        zones = ZoneProvisioner(client).provision(names[:2])
+        teardown = ZoneTeardown(client, tracker=tracker)
+
+        def empty_child_fails(client, zoneid, zonename, limits):
+            if zonename == names[1]:
+                raise R53Error("failed")
+            return []
+
+        with patch('r53utils.empty_zone_streaming',
+                   side_effect=empty_child_fails):
+            deleted = teardown.teardown(names[:2])
+        self.assertEqual(deleted, {})
+        self.assertEqual(set(teardown.errors), {zones[x][0]
+                                                for x in names[:2]})
+        tracker.close()
+
+    def test_generator_rrsets_partitioned(self):
+        """Test partitioned listing returns each rrset once, in order."""
+        rrsets = [{'Name': 'h{:05d}.example.com.'.format(i), 'Type': 'A',
+                   'TTL': 300, 'ResourceRecords': [{'Value': '192.0.2.1'}]}
+                  for i in range(3000)] + \
+            [{'Name': '{}.example.com.'.format(x), 'Type': rrtype, 'TTL': 300,
+              'ResourceRecords': [{'Value': '192.0.2.1'}]}
+             for x in ('a', 'x.b', 'm', 'www', 'z-1', '0')
+             for rrtype in ('A', 'TXT')] + \
+            [{'Name': 'example.com.', 'Type': 'NS', 'TTL': 300,
+              'ResourceRecords': [{'Value': 'ns1.example.net.'}]}]
+        client = SortedZoneClient(rrsets)
+        expected = [(x['Name'], x['Type']) for x in client.rrsets]
+
+        names = [(x['Name'], x['Type']) for x in generator_rrsets_partitioned(
+            client, self.zone_id, 'example.com.', partitions=4,
+            maxpages=None)]
+        self.assertEqual(names, expected)
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            store = SnapshotStore(os.path.join(tmpdir, 'snapshot.db'))
+            store.capture_zone(client, {'Id': self.zone_id,
+                                        'Name': 'example.com.'})
+            self.assertEqual(len(store.split_points(self.zone_id, 4)), 3)
+            # rrsets changed since the snapshot was taken are listed too
+            del client.rrsets[750]
+            client.rrsets.append({'Name': 'h01999x.example.com.',
+                                  'Type': 'A', 'TTL': 300})
+            client.rrsets.sort(key=lambda x: listing_key(x['Name'],
+                                                         x['Type']))
+            client.calls = 0
+            names = [(x['Name'], x['Type']) for x in
+                     generator_rrsets_partitioned(client, self.zone_id,
+                                                  partitions=4, store=store,
+                                                  maxpages=None)]
+            self.assertEqual(names, [(x['Name'], x['Type'])
+                                     for x in client.rrsets])
+            # 3 probes, and about a page of overlap per range
+            self.assertLessEqual(client.calls, 3 + 31 + 4)
+
+            # with a small buffer, the zone is split into more ranges
+            client.calls = 0
+            names = [(x['Name'], x['Type']) for x in
+                     generator_rrsets_partitioned(client, self.zone_id,
+                                                  partitions=4, store=store,
+                                                  maxpages=8)]
+            self.assertEqual(names, [(x['Name'], x['Type'])
+                                     for x in client.rrsets])
+            self.assertLessEqual(client.calls, 15 + 31 + 16)
+            store.close()
+
+    def test_generator_rrsets_partitioned_speedup(self):
+        """Test partitioned listing lists ranges concurrently by default."""
+        rrsets = [{'Name': '{:05x}.example.com.'.format(i * 40503 % 2 ** 20),
+                   'Type': 'A', 'TTL': 300,
+                   'ResourceRecords': [{'Value': '192.0.2.1'}]}
+                  for i in range(1000)]
+        client = SortedZoneClient(rrsets, latency=0.01)
+
+        started = time.monotonic()
+        expected = list(generator_rrsets(client, self.zone_id,
+                                         maxitems='10'))
+        sequential = time.monotonic() - started
+
+        started = time.monotonic()
+        names = list(generator_rrsets_partitioned(client, self.zone_id,
+                                                  maxitems='10'))
+        partitioned = time.monotonic() - started
+        self.assertEqual(names, expected)
+        self.assertLess(partitioned, sequential / 2)
+
+    def test_listing_key(self):
+        """Test listing_key follows Route53 listing order."""
+        names = ['x.a.example.com.', 'a.example.com.', 'a-b.example.com.',
+                 'example.com.', 'b.example.com']
+        self.assertEqual(sorted(names, key=listing_key),
+                         ['example.com.', 'a-b.example.com.', 'a.example.com.',
+                          'x.a.example.com.', 'b.example.com'])
+        self.assertLess(listing_key('a.example.com.', 'A'),
+                        listing_key('a.example.com.', 'TXT'))
+
+    def test_get_rrsets(self):
+        """Test get_rrsets strategies."""
+        rrsets = [{'Name': 'h{:04d}.example.com.'.format(i), 'Type': rrtype,
+                   'TTL': 300, 'ResourceRecords': [{'Value': '192.0.2.1'}]}
+                  for i in range(1000) for rrtype in ('A', 'TXT')]
+        keys = [('h{:04d}.example.com'.format(i), 'A')
+                for i in range(0, 1000, 20)]
+        keys += [('h0101.example.com.', 'TXT'), ('h0101.example.com.', 'MX'),
+                 ('zzz.example.com.', 'A'), ('aaa.example.com.', 'A')]
+        misses = [('h0101.example.com.', 'MX'), ('zzz.example.com.', 'A'),
+                  ('aaa.example.com.', 'A')]
+
+        for strategy, calls in (('point', 54), ('scan', 17), ('full', 20),
+                                ('auto', 17)):
+            client = SortedZoneClient(rrsets)
+            hits, missed = get_rrsets(client, self.zone_id, keys,
+                                      strategy=strategy)
+            self.assertEqual(len(hits), 51, strategy)
+            self.assertEqual(sorted(missed), sorted(misses), strategy)
+            self.assertEqual(hits[('h0500.example.com', 'A')]['Name'],
+                             'h0500.example.com.')
+            self.assertEqual(client.calls, calls, strategy)
+
+        with self.assertRaises(R53Error):
+            get_rrsets(client, self.zone_id, keys, strategy='bogus')
+
     def test_rrset_to_text(self):
         """Test rrset_to_text function."""
         rrset = {
@@ -166,6 +995,58 @@ class TestR53Utils(unittest.TestCase):
         expected = f"{self.rr_name} {self.ttl} IN {self.rr_type} {self.rdata[0]}"
         self.assertEqual(rrset_to_text(rrset), expected)
 
+    def test_rrset_to_text_routing(self):
+        """Test rrset_to_text with alias and routing policy rrsets."""
+        rrset = {'Name': self.rr_name, 'Type': 'A', 'SetIdentifier': 'us',
+                 'GeoLocation': {'CountryCode': 'US'}, 'TTL': 60,
+                 'ResourceRecords': [{'Value': '192.0.2.1'}]}
+        self.assertEqual(rrset_to_text(rrset).split("\n"), [
+            "; {} A SetIdentifier=us GeoLocation=CountryCode=US".format(
+                self.rr_name),
+            "{} 60 IN A 192.0.2.1".format(self.rr_name)])
+        alias = {'Name': self.rr_name, 'Type': 'AAAA', 'SetIdentifier': 'w1',
+                 'Weight': 10,
+                 'AliasTarget': {'HostedZoneId': 'Z2', 'DNSName': 'lb.',
+                                 'EvaluateTargetHealth': True}}
+        self.assertEqual(rrset_to_text(RRset.from_dict(alias)).split("\n"), [
+            "; {} AAAA SetIdentifier=w1 Weight=10".format(self.rr_name),
+            "; {} ALIAS AAAA lb. HostedZoneId=Z2 "
+            "EvaluateTargetHealth=True".format(self.rr_name)])
+
+    def test_export_zone(self):
+        """Test streaming rrset export in each format."""
+        alias = {'Name': 'www.example.com.', 'Type': 'A',
+                 'AliasTarget': {'HostedZoneId': 'Z2', 'DNSName': 'lb.',
+                                 'EvaluateTargetHealth': False}}
+        for fmt in ('zone', 'json', 'ndjson'):
+            responses = rrset_pages(150)
+            responses[-1]['ResourceRecordSets'].append(alias)
+            self.mock_client.list_resource_record_sets.side_effect = responses
+            outfile = io.StringIO()
+            self.assertEqual(export_zone(self.mock_client, self.zone_id,
+                                         outfile, fmt), 151)
+            text = outfile.getvalue()
+            if fmt == 'zone':
+                lines = text.splitlines()
+                self.assertEqual(lines[0],
+                                 "h000000.example.com. 300 IN A 192.0.2.1")
+                self.assertTrue(lines[-1].startswith(
+                    "; www.example.com. ALIAS A lb."))
+            elif fmt == 'json':
+                rrsets = json.loads(text)
+                self.assertEqual(len(rrsets), 151)
+                self.assertEqual(rrsets[-1], alias)
+            else:
+                lines = text.splitlines()
+                self.assertEqual(len(lines), 151)
+                self.assertEqual(json.loads(lines[-1]), alias)
+
+        outfile = io.StringIO()
+        self.assertEqual(write_rrsets(outfile, [], 'json'), 0)
+        self.assertEqual(json.loads(outfile.getvalue()), [])
+        with self.assertRaises(R53Error):
+            write_rrsets(outfile, [], 'yaml')
+
     def test_test_dns_answer(self):
         """Test test_dns_answer function."""
         mock_response = {
@@ -204,6 +1085,63 @@ class TestR53Utils(unittest.TestCase):
             with self.assertRaises(R53Error):
                 wait_for_insync(self.mock_client, 'change-123', timeout=1)
 
+    def test_change_tracker(self):
+        """Test ChangeTracker polling many changes."""
+        polls = {}
+
+        def get_change(Id):
+            polls[Id] = polls.get(Id, 0) + 1
+            done = polls[Id] >= int(Id[-1])
+            return {'ChangeInfo': {'Id': Id,
+                                   'Status': 'INSYNC' if done else 'PENDING'}}
+
+        self.mock_client.get_change.side_effect = get_change
+        tracker = ChangeTracker(self.mock_client, initial=0.001,
+                                maxpoll=0.005, timeout=10)
+        called = []
+        futures = [tracker.track('/change/C{}'.format(i),
+                                 callback=called.append) for i in (1, 2, 3)]
+        # ChangeInfo dicts are accepted too, and tracked only once
+        self.assertIs(tracker.track({'Id': '/change/C1'}), futures[0])
+        infos = tracker.wait()
+        self.assertEqual([x['Status'] for x in infos], ['INSYNC'] * 3)
+        self.assertEqual(polls, {'/change/C1': 1, '/change/C2': 2,
+                                 '/change/C3': 3})
+        self.assertEqual(len(called), 3)
+        self.assertEqual(tracker.pending, 0)
+
+        async def wait_async():
+            return await tracker.track_async('/change/C4')
+        polls.clear()
+        self.assertEqual(asyncio.run(wait_async())['Status'], 'INSYNC')
+
+    def test_change_tracker_timeout(self):
+        """Test ChangeTracker overall deadline."""
+        self.mock_client.get_change.return_value = {
+            'ChangeInfo': {'Status': 'PENDING'}}
+        tracker = ChangeTracker(self.mock_client, initial=0.001, timeout=0.05)
+        future = tracker.track('/change/C1')
+        with self.assertRaises(R53Error):
+            future.result(timeout=5)
+
+    def test_change_tracker_close_while_polling(self):
+        """Test closing ChangeTracker fails a change being polled."""
+        polling = threading.Event()
+
+        def get_change(Id):
+            polling.set()
+            time.sleep(0.3)
+            return {'ChangeInfo': {'Id': Id, 'Status': 'PENDING'}}
+
+        self.mock_client.get_change.side_effect = get_change
+        tracker = ChangeTracker(self.mock_client, initial=0.001, timeout=10)
+        future = tracker.track('/change/C1')
+        self.assertTrue(polling.wait(timeout=5))
+        tracker.close()
+        with self.assertRaises(R53Error):
+            future.result(timeout=2)
+        self.assertEqual(tracker.pending, 0)
+
     def test_create_zone(self):
         """Test create_zone function."""
         mock_response = {
@@ -300,6 +1238,150 @@ class TestR53Utils(unittest.TestCase):
             change_info = empty_zone(self.mock_client, self.zone_id, self.zone_name)
             self.assertEqual(change_info['Status'], 'PENDING')
 
+    def test_empty_zone_streaming(self):
+        """Test empty_zone_streaming function."""
+        self.mock_client.change_resource_record_sets.return_value = {
+            'ChangeInfo': {'Status': 'PENDING'},
+            'ResponseMetadata': {'HTTPStatusCode': 200}
+        }
+        rrsets = [
+            {'Name': self.zone_name, 'Type': 'NS', 'TTL': 300,
+             'ResourceRecords': [{'Value': 'ns1.example.net.'}]},
+            {'Name': self.zone_name, 'Type': 'SOA', 'TTL': 300,
+             'ResourceRecords': [{'Value': 'ns1 hostmaster 1 2 3 4 5'}]},
+        ] + [
+            {'Name': 'h{}.example.com.'.format(i), 'Type': 'A', 'TTL': 300,
+             'ResourceRecords': [{'Value': '192.0.2.1'}]} for i in range(1500)
+        ]
+        with patch('r53utils.generator_rrsets') as mock_generator:
+            mock_generator.return_value = iter(rrsets)
+            change_infos = empty_zone_streaming(self.mock_client, self.zone_id,
+                                                self.zone_name)
+        self.assertEqual(len(change_infos), 2)
+        calls = self.mock_client.change_resource_record_sets.call_args_list
+        changes = [c for x in calls for c in x[1]['ChangeBatch']['Changes']]
+        self.assertEqual(len(changes), 1500)
+        self.assertTrue(all(c['ResourceRecordSet']['Name'] != self.zone_name
+                            for c in changes))
+
+    def test_plan_reconcile(self):
+        """Test plan_reconcile computes the minimal change set."""
+        def rrset(name, rrtype, values, ttl=300, **extra):
+            result = {'Name': name, 'Type': rrtype, 'TTL': ttl,
+                      'ResourceRecords': [{'Value': x} for x in values]}
+            result.update(extra)
+            return result
+        current = [
+            rrset('example.com.', 'NS', ['ns1.example.net.']),
+            rrset('example.com.', 'SOA', ['ns1 hostmaster 1 2 3 4 5']),
+            rrset('\\052.example.com.', 'A', ['192.0.2.1']),
+            rrset('same.example.com.', 'A', ['192.0.2.1', '192.0.2.2']),
+            rrset('ttl.example.com.', 'A', ['192.0.2.1']),
+            rrset('gone.example.com.', 'TXT', ['"x"']),
+            rrset('w.example.com.', 'A', ['192.0.2.1'],
+                  SetIdentifier='one', Weight=10),
+        ]
+        desired = [
+            rrset('*.Example.com', 'A', ['192.0.2.1']),
+            rrset('same.example.com.', 'A', ['192.0.2.2', '192.0.2.1']),
+            rrset('ttl.example.com.', 'A', ['192.0.2.1'], ttl=60),
+            rrset('new.example.com.', 'A', ['192.0.2.3']),
+            rrset('w.example.com.', 'A', ['192.0.2.1'],
+                  SetIdentifier='one', Weight=10),
+            rrset('w.example.com.', 'A', ['192.0.2.9'],
+                  SetIdentifier='two', Weight=10),
+        ]
+        plan = plan_reconcile(desired, current, zonename='example.com.')
+        self.assertEqual([x['Name'] for x in plan.creates],
+                         ['new.example.com.', 'w.example.com.'])
+        self.assertEqual([x['Name'] for x in plan.upserts],
+                         ['ttl.example.com.'])
+        self.assertEqual([x['Name'] for x in plan.deletes],
+                         ['gone.example.com.'])
+        self.assertEqual(len(plan), 4)
+        self.assertEqual(plan.api_calls, 1)
+        actions = [x['Action'] for x in plan.batches[0].data()['Changes']]
+        self.assertEqual(actions, ['DELETE', 'CREATE', 'CREATE', 'UPSERT'])
+
+        plan = plan_reconcile(desired, current, zonename='example.com.',
+                              delete=False,
+                              limits=BatchLimits(changes=2, values=1000,
+                                                 chars=32000))
+        self.assertEqual(plan.deletes, [])
+        self.assertEqual(plan.api_calls, 2)
+
+        with self.assertRaises(R53Error):
+            plan_reconcile(desired + desired[:1], current)
+
+    def test_plan_zone(self):
+        """Test plan_zone and apply_plan functions."""
+        self.mock_client.list_resource_record_sets.side_effect = \
+            rrset_pages(150)
+        self.mock_client.change_resource_record_sets.return_value = {
+            'ChangeInfo': {'Status': 'PENDING'},
+            'ResponseMetadata': {'HTTPStatusCode': 200}
+        }
+        desired = [x for page in rrset_pages(150)[:1]
+                   for x in page['ResourceRecordSets']]
+        plan = plan_zone(self.mock_client, self.zone_id, desired,
+                         zonename=self.zone_name)
+        self.assertEqual(len(plan.deletes), 50)
+        self.assertEqual(len(apply_plan(self.mock_client, self.zone_id,
+                                        plan)), 1)
+
+    def test_snapshot_store(self):
+        """Test SnapshotStore capture, lookups and refresh."""
+        zones = [{'Id': '/hostedzone/Z1', 'Name': self.zone_name,
+                  'ResourceRecordSetCount': 150},
+                 {'Id': '/hostedzone/Z2', 'Name': 'example.net.',
+                  'ResourceRecordSetCount': 1}]
+        self.mock_client.list_hosted_zones_by_name.return_value = {
+            'HostedZones': zones,
+            'IsTruncated': False,
+            'ResponseMetadata': {'HTTPStatusCode': 200}
+        }
+
+        def list_rrsets(HostedZoneId, MaxItems, **kwargs):
+            if HostedZoneId == '/hostedzone/Z2':
+                return {'ResourceRecordSets': [
+                    {'Name': 'www.example.net.', 'Type': 'A',
+                     'AliasTarget': {'HostedZoneId': 'Z3',
+                                     'DNSName': 'lb.example.org.',
+                                     'EvaluateTargetHealth': False}}],
+                        'IsTruncated': False,
+                        'ResponseMetadata': {'HTTPStatusCode': 200}}
+            pages = rrset_pages(150)
+            return pages[1] if 'StartRecordName' in kwargs else pages[0]
+        self.mock_client.list_resource_record_sets.side_effect = list_rrsets
+
+        store = SnapshotStore(':memory:')
+        self.assertEqual(store.refresh(self.mock_client), ['Z1', 'Z2'])
+        self.assertIsNotNone(store.captured_at('/hostedzone/Z1'))
+        self.assertEqual(len(list(store.generator_rrsets('Z1'))), 150)
+        rrset = store.get_rrset('Z1', 'H000042.example.com', 'A')
+        self.assertEqual(rrset['Name'], 'h000042.example.com.')
+        with self.assertRaises(R53Error):
+            store.get_rrset('Z1', 'h000042.example.com.', 'AAAA')
+        self.assertEqual(len(store.find_rrsets(value='192.0.2.1')), 150)
+        self.assertEqual(store.find_rrsets(value='lb.example.org.')[0][0],
+                         'Z2')
+
+        # only changed or stale zones are listed again
+        calls = self.mock_client.list_resource_record_sets.call_count
+        self.assertEqual(store.refresh(self.mock_client), [])
+        zones[1]['ResourceRecordSetCount'] = 2
+        store.mark_stale('/hostedzone/Z1')
+        self.assertEqual(store.refresh(self.mock_client), ['Z1', 'Z2'])
+        self.assertEqual(
+            self.mock_client.list_resource_record_sets.call_count, calls + 3)
+        self.assertEqual(len(list(store.generator_rrsets('Z1'))), 150)
+
+        # zones that went away are dropped
+        del zones[1]
+        store.refresh(self.mock_client)
+        self.assertEqual([x['Id'] for x in store.zones()], ['Z1'])
+        self.assertEqual(store.find_rrsets(value='lb.example.org.'), [])
+
     def test_delete_zone(self):
         """Test delete_zone function."""
         mock_response = {
@@ -0,0 +1,190 @@
+import asyncio
+import time
+import unittest
+from unittest.mock import MagicMock
+from r53utils import R53Error, ChangeBatch
+from r53utils_async import (
+    AsyncClient, generator_zones, generator_rrsets, get_rrset,
+    change_rrsets, create_zone, delete_zone, wait_for_insync
+)
+
+
+class FakeAioClient:
+    """Fake aiobotocore client, whose API calls are coroutines"""
+
+    def __init__(self):
+        self.active = 0
+        self.peak = 0
+
+    async def _make_api_call(self, operation_name, api_params):
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        await asyncio.sleep(0.01)
+        self.active -= 1
+        return {'ChangeInfo': {'Id': api_params['Id'], 'Status': 'INSYNC'},
+                'ResponseMetadata': {'HTTPStatusCode': 200}}
+
+    async def get_change(self, Id):
+        return await self._make_api_call('GetChange', {'Id': Id})
+
+
+class TestR53UtilsAsync(unittest.TestCase):
+    def setUp(self):
+        """Set up test fixtures before each test method."""
+        self.mock_client = MagicMock()
+        self.aclient = AsyncClient(self.mock_client, concurrency=4)
+        self.zone_id = '/hostedzone/Z1234567890'
+        self.zone_name = 'example.com.'
+        self.rr_name = 'test.example.com.'
+        self.rr_type = 'A'
+        self.rrset = {
+            'Name': self.rr_name,
+            'Type': self.rr_type,
+            'TTL': 300,
+            'ResourceRecords': [{'Value': '192.0.2.1'}]
+        }
+
+    def test_generator_zones(self):
+        """Test async generator_zones function."""
+        self.mock_client.list_hosted_zones_by_name.side_effect = [
+            {'HostedZones': [{'Id': 'Z1', 'Name': 'one.'}],
+             'IsTruncated': True, 'NextDNSName': 'two.',
+             'NextHostedZoneId': 'Z2',
+             'ResponseMetadata': {'HTTPStatusCode': 200}},
+            {'HostedZones': [{'Id': 'Z2', 'Name': 'two.'}],
+             'IsTruncated': False,
+             'ResponseMetadata': {'HTTPStatusCode': 200}},
+        ]
+
+        async def collect():
+            return [x async for x in generator_zones(self.aclient)]
+        zones = asyncio.run(collect())
+        self.assertEqual([x['Id'] for x in zones], ['Z1', 'Z2'])
+
+    def test_generator_rrsets(self):
+        """Test async generator_rrsets function."""
+        self.mock_client.list_resource_record_sets.return_value = {
+            'ResourceRecordSets': [self.rrset],
+            'IsTruncated': False,
+            'ResponseMetadata': {'HTTPStatusCode': 200}
+        }
+
+        async def collect():
+            return [x async for x in generator_rrsets(self.aclient,
+                                                      self.zone_id)]
+        self.assertEqual(asyncio.run(collect()), [self.rrset])
+
+    def test_get_rrset(self):
+        """Test async get_rrset function."""
+        self.mock_client.list_resource_record_sets.return_value = {
+            'ResourceRecordSets': [self.rrset],
+            'ResponseMetadata': {'HTTPStatusCode': 200}
+        }
+        rrset = asyncio.run(get_rrset(self.aclient, self.zone_id,
+                                      self.rr_name, self.rr_type))
+        self.assertEqual(rrset, self.rrset)
+        with self.assertRaises(R53Error):
+            asyncio.run(get_rrset(self.aclient, self.zone_id,
+                                  self.rr_name, 'AAAA'))
+        # lookups past the last rrset of the zone
+        self.mock_client.list_resource_record_sets.return_value = {
+            'ResourceRecordSets': [],
+            'ResponseMetadata': {'HTTPStatusCode': 200}
+        }
+        with self.assertRaises(R53Error):
+            asyncio.run(get_rrset(self.aclient, self.zone_id,
+                                  'zzz.example.com.', self.rr_type))
+
+    def test_zone_and_change_operations(self):
+        """Test async create_zone, change_rrsets and delete_zone."""
+        self.mock_client.create_hosted_zone.return_value = {
+            'HostedZone': {'Id': self.zone_id, 'Name': self.zone_name},
+            'DelegationSet': {'NameServers': ['ns-1.awsdns-00.com']},
+            'ChangeInfo': {'Status': 'PENDING'},
+            'ResponseMetadata': {'HTTPStatusCode': 201}
+        }
+        self.mock_client.change_resource_record_sets.return_value = {
+            'ChangeInfo': {'Status': 'PENDING'},
+            'ResponseMetadata': {'HTTPStatusCode': 200}
+        }
+        self.mock_client.delete_hosted_zone.return_value = {
+            'ChangeInfo': {'Status': 'PENDING'},
+            'ResponseMetadata': {'HTTPStatusCode': 200}
+        }
+        batch = ChangeBatch()
+        batch.create(self.rr_name, self.rr_type, 300, ['192.0.2.1'])
+
+        async def run():
+            zoneid, ns_set, _, _ = await create_zone(self.aclient,
+                                                     self.zone_name)
+            await change_rrsets(self.aclient, zoneid, batch)
+            await delete_zone(self.aclient, zoneid)
+            return zoneid, ns_set
+        self.assertEqual(asyncio.run(run()),
+                         (self.zone_id, ['ns-1.awsdns-00.com']))
+        self.mock_client.change_resource_record_sets.assert_called_once_with(
+            HostedZoneId=self.zone_id, ChangeBatch=batch.data())
+
+    def test_wait_for_insync(self):
+        """Test async wait_for_insync, timeout and cancellation."""
+        self.mock_client.get_change.return_value = {
+            'ChangeInfo': {'Status': 'INSYNC'}}
+        info = asyncio.run(wait_for_insync(self.aclient, 'C1', polltime=0))
+        self.assertEqual(info['Status'], 'INSYNC')
+
+        self.mock_client.get_change.return_value = {
+            'ChangeInfo': {'Status': 'PENDING'}}
+        with self.assertRaises(R53Error):
+            asyncio.run(wait_for_insync(self.aclient, 'C1', polltime=0.01,
+                                        timeout=0.02))
+
+        async def cancel():
+            task = asyncio.ensure_future(
+                wait_for_insync(self.aclient, 'C1', polltime=60))
+            await asyncio.sleep(0)
+            task.cancel()
+            await task
+        with self.assertRaises(asyncio.CancelledError):
+            asyncio.run(cancel())
+
+    def test_concurrency_limit(self):
+        """Test AsyncClient limits calls in flight."""
+        state = {'active': 0, 'peak': 0}
+
+        def get_change(Id):
+            state['active'] += 1
+            state['peak'] = max(state['peak'], state['active'])
+            time.sleep(0.01)
+            state['active'] -= 1
+            return {'ChangeInfo': {'Id': Id, 'Status': 'INSYNC'}}
+        self.mock_client.get_change.side_effect = get_change
+
+        async def run():
+            return await asyncio.gather(*[
+                self.aclient.call('get_change', Id=str(i))
+                for i in range(20)])
+        self.assertEqual(len(asyncio.run(run())), 20)
+        self.assertLessEqual(state['peak'], 4)
+
+    def test_native_client(self):
+        """Test aiobotocore clients are awaited without threads."""
+        client = FakeAioClient()
+        aclient = AsyncClient(client, concurrency=4)
+        self.assertTrue(aclient.native)
+
+        async def run():
+            return await asyncio.gather(*[
+                aclient.call('get_change', Id=str(i)) for i in range(20)])
+        # the client is reused across event loops
+        for _ in range(2):
+            responses = asyncio.run(run())
+            self.assertEqual([x['ChangeInfo']['Id'] for x in responses],
+                             [str(i) for i in range(20)])
+        self.assertEqual(client.peak, 4)
+        self.assertIsNone(aclient.executor)
+        info = asyncio.run(wait_for_insync(aclient, 'C1', polltime=0))
+        self.assertEqual(info['Status'], 'INSYNC')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+import io
+import os
+import sys
+import tempfile
+import unittest
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                'examples'))
+
+import tf_zonehier
+from r53utils import closest_parents, R53Error
+
+
+ZONENAMES = ['example.com.', 'a.example.com.', 'b.a.example.com.',
+             'c.example.com.', 'example.org.', 'x.example.org.']
+
+
+class TestTfZonehier(unittest.TestCase):
+
+    def test_write_config_shards(self):
+        """Test each zone subtree is written contiguously to its own file."""
+        parents = closest_parents(ZONENAMES)
+        shards = {}
+        roots = []
+
+        def outfiles(root):
+            if not roots or roots[-1] != root:
+                roots.append(root)
+            return shards.setdefault(root, io.StringIO())
+
+        tf_zonehier.write_config(outfiles, {}, parents)
+        self.assertEqual(sorted(roots), ['example.com.', 'example.org.'])
+        com = shards['example.com.'].getvalue()
+        for name in ('example_com', 'a_example_com', 'b_a_example_com',
+                     'c_example_com'):
+            self.assertIn('resource "aws_route53_zone" "{}"'.format(name),
+                          com)
+        self.assertIn('resource "aws_route53_record" "ns-b_a_example_com"',
+                      com)
+        self.assertIn('zone_id = aws_route53_zone.a_example_com.zone_id',
+                      com)
+        self.assertNotIn('example.org', com)
+        self.assertIn('### Delegation: example.org -> x.example.org',
+                      shards['example.org.'].getvalue())
+        self.assertNotIn('import {', com)
+
+    def test_write_config_imports(self):
+        """Test import blocks for existing zones and delegations."""
+        names = ['example.com.', 'a.example.com.', 'c.example.com.']
+        zones = {name: {'Id': '/hostedzone/Z{}'.format(i), 'Name': name}
+                 for i, name in enumerate(names)}
+        delegations = {'a.example.com.': {'Name': 'a.example.com.',
+                                          'Type': 'NS', 'TTL': 3600}}
+        outfile = io.StringIO()
+        tf_zonehier.write_config(lambda root: outfile, zones,
+                                 closest_parents(names), delegations)
+        config = outfile.getvalue()
+        self.assertIn('import {\n  to = aws_route53_zone.a_example_com\n'
+                      '  id = "Z1"\n}', config)
+        self.assertIn('import {\n  to = aws_route53_record.ns-a_example_com\n'
+                      '  id = "Z0_a.example.com_NS"\n}', config)
+        self.assertIn('ttl = "3600"', config)
+        # c.example.com has no delegation yet: created, not imported
+        self.assertNotIn('aws_route53_record.ns-c_example_com\n', config)
+        self.assertEqual(config.count('import {'), 4)
+
+    def test_inventory_lookup_errors(self):
+        """Test a failed delegation lookup doesn't abort the inventory."""
+        zones = [{'Id': '/hostedzone/Z{}'.format(i), 'Name': name,
+                  'ResourceRecordSetCount': 10}
+                 for i, name in enumerate(ZONENAMES)]
+        zones.append({'Id': '/hostedzone/ZP', 'Name': 'p.example.com.',
+                      'Config': {'PrivateZone': True}})
+
+        def get_rrsets(client, zoneid, keys, rrcount=None):
+            if zoneid == '/hostedzone/Z4':
+                raise R53Error("throttled")
+            return {key: {'Name': key[0], 'Type': 'NS', 'TTL': 300}
+                    for key in keys}, []
+
+        with patch.object(tf_zonehier, 'generator_zones',
+                          return_value=iter(zones)), \
+                patch.object(tf_zonehier, 'get_rrsets', get_rrsets):
+            found, parents, delegations, errors = tf_zonehier.inventory(
+                None)
+        self.assertEqual(sorted(found), sorted(ZONENAMES))
+        self.assertEqual(parents['b.a.example.com.'], 'a.example.com.')
+        self.assertEqual(sorted(delegations), ['a.example.com.',
+                                               'b.a.example.com.',
+                                               'c.example.com.'])
+        self.assertEqual(list(errors), ['example.org.'])
+
+    def test_main_shard_dir(self):
+        """Test main writes provider.tf and one file per subtree."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            self.assertEqual(tf_zonehier.main(
+                ['--shard-dir', tmpdir] + ZONENAMES), 0)
+            self.assertEqual(sorted(os.listdir(tmpdir)),
+                             ['provider.tf', 'zone_example_com.tf',
+                              'zone_example_org.tf'])
+            with open(os.path.join(tmpdir, 'zone_example_org.tf')) as infile:
+                self.assertIn('resource "aws_route53_zone" "x_example_org"',
+                              infile.read())
+
+
+if __name__ == '__main__':
+    unittest.main()